@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+对比原生 .docx 提取器与 pandoc 的转换耗时。
+
+用法:
+    python benchmarks/bench_extract.py --paragraphs 4000 --repeat 5
+    python benchmarks/bench_extract.py --file 合同.docx
+"""
+
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import wg
+from corpus import make_paragraphs, write_docx
+
+def time_call(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    return statistics.median(samples)
+
+def main():
+    parser = argparse.ArgumentParser(description="原生提取器 vs pandoc 基准测试")
+    parser.add_argument("--file", help="使用已有的 .docx 文件 (默认生成合成文档)")
+    parser.add_argument("--paragraphs", type=int, default=4000, help="合成文档的段落数 (约 200 页)")
+    parser.add_argument("--tables", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        docx_path = args.file
+        if not docx_path:
+            docx_path = str(Path(tmp) / "bench.docx")
+            write_docx(docx_path, make_paragraphs(args.paragraphs), tables=args.tables)
+
+        size_kb = Path(docx_path).stat().st_size / 1024
+        print(f"文档: {docx_path} ({size_kb:.0f} KB)")
+
+        native = time_call(lambda: wg.extract_docx_text(docx_path), args.repeat)
+        print(f"native : {native * 1000:8.1f} ms")
+
+        if shutil.which("pandoc"):
+            pandoc = time_call(lambda: wg.convert_with_pandoc(docx_path), args.repeat)
+            print(f"pandoc : {pandoc * 1000:8.1f} ms")
+            print(f"speedup: {pandoc / native:8.1f}x")
+        else:
+            print("pandoc : 未安装, 跳过对比")
+
+if __name__ == "__main__":
+    main()
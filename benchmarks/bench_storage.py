@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+对比默认存储与规范化存储 (wg init --canonical-storage) 的仓库体积与提交/恢复耗时。
+两种模式各自生成同样的 N 个版本历史, 每个版本随机修改少量段落。
+
+用法:
+    python benchmarks/bench_storage.py --revisions 500 --paragraphs 1000
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import statistics
+import subprocess
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import wg
+from corpus import make_paragraphs, random_sentence, write_docx
+
+def dir_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct))]
+
+def build_history(project, canonical, revisions, paragraphs, edits, seed):
+    wg.handle_init(project, canonical_storage=canonical)
+    rng = random.Random(seed)
+    text = make_paragraphs(paragraphs, seed)
+    docx_path = os.path.join(project, "contract.docx")
+    commit_times = []
+    for rev in range(revisions):
+        for _ in range(edits):
+            text[rng.randrange(len(text))] = random_sentence(rng)
+        write_docx(docx_path, text, images=2, seed=rev)
+        started = time.perf_counter()
+        wg.handle_commit(project, f"rev {rev}")
+        commit_times.append(time.perf_counter() - started)
+    return commit_times
+
+def measure(label, canonical, args):
+    with tempfile.TemporaryDirectory() as tmp:
+        commit_times = build_history(tmp, canonical, args.revisions, args.paragraphs, args.edits, args.seed)
+        git_dir = os.path.join(tmp, ".git")
+        loose_size = dir_size(os.path.join(git_dir, "objects"))
+
+        started = time.perf_counter()
+        subprocess.run(["git", "gc", "--quiet"], cwd=tmp, check=True)
+        gc_time = time.perf_counter() - started
+        packed_size = dir_size(os.path.join(git_dir, "objects"))
+
+        commits = [entry["id"] for entry in wg.handle_log(tmp)]
+        rng = random.Random(args.seed)
+        restore_times = []
+        for commit_id in rng.sample(commits, min(args.restores, len(commits))):
+            started = time.perf_counter()
+            restored = wg.handle_restore(tmp, commit_id, "contract.docx")
+            restore_times.append(time.perf_counter() - started)
+            os.unlink(restored)
+        wg.close_cat_file_pools()
+
+    print(f"[{label}]")
+    print(f"  objects (loose) : {loose_size / 1024 / 1024:8.1f} MB")
+    print(f"  objects (gc)    : {packed_size / 1024 / 1024:8.1f} MB   (gc {gc_time:.1f} s)")
+    print(f"  commit  p50/p95 : {statistics.median(commit_times) * 1000:8.1f} / {percentile(commit_times, 0.95) * 1000:.1f} ms")
+    print(f"  restore p50/p95 : {statistics.median(restore_times) * 1000:8.1f} / {percentile(restore_times, 0.95) * 1000:.1f} ms")
+    return packed_size
+
+def main():
+    parser = argparse.ArgumentParser(description="默认存储 vs 规范化存储 基准测试")
+    parser.add_argument("--revisions", type=int, default=500)
+    parser.add_argument("--paragraphs", type=int, default=1000)
+    parser.add_argument("--edits", type=int, default=3, help="每个版本修改的段落数")
+    parser.add_argument("--restores", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{args.revisions} 个版本, {args.paragraphs} 段, 每版修改 {args.edits} 段")
+    default_size = measure("default", False, args)
+    canonical_size = measure("canonical", True, args)
+    print(f"packed size ratio: {default_size / canonical_size:.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+wg 引擎与 API 的基准测试套件。
+在合成仓库上计时每个 wg 操作 (冷/热缓存), 再用并发请求压测 FastAPI 端点,
+结果写成 JSON; 指定 --baseline 时与上次结果比较, 超过阈值即以非零状态退出。
+
+用法:
+    python benchmarks/bench_suite.py --docs 20 --paragraphs 500 --commits 100 --output results.json
+    python benchmarks/bench_suite.py --baseline results.json --threshold 1.25
+    python benchmarks/bench_suite.py --repo /path/to/existing/repo --skip-api
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import wg
+from corpus import build_repo, make_paragraphs, random_sentence, write_docx
+
+def summarize(samples):
+    ordered = sorted(samples)
+    return {
+        "runs": len(ordered),
+        "mean_ms": round(statistics.mean(ordered) * 1000, 3),
+        "p50_ms": round(statistics.median(ordered) * 1000, 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+def reset_caches(project, disk=True):
+    """清空进程内缓存; disk=True 时同时删除 .git/wg-cache (转换缓存、搜索索引等)"""
+    wg._status_cache.clear()
+    wg._log_indexes.clear()
+    wg._dir_indexes.clear()
+    wg._search_indexes.clear()
+    wg._stat_indexes.clear()
+    wg.close_cat_file_pools()
+    if disk:
+        shutil.rmtree(wg.get_cache_dir(project), ignore_errors=True)
+
+def time_op(func, repeat, setup=None):
+    samples = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return summarize(samples)
+
+def edit_worktree(project, names, rng, count=3):
+    """修改若干文档, 让 status / diff 有内容可比"""
+    for name in rng.sample(names, min(count, len(names))):
+        path = os.path.join(project, name)
+        text = wg.split_paragraphs(wg.extract_docx_text(path))
+        text[rng.randrange(len(text))] = random_sentence(rng)
+        write_docx(path, text)
+
+def bench_engine(project, names, args):
+    rng = random.Random(args.seed)
+    edit_worktree(project, names, rng)
+    query = " ".join(make_paragraphs(1, args.seed)[0].split()[:3])
+    results = {}
+
+    def record(name, func, setup=None, repeat=args.repeat):
+        results[name] = time_op(func, repeat, setup)
+        print(f"  {name:<24} p50 {results[name]['p50_ms']:10.1f} ms   p95 {results[name]['p95_ms']:10.1f} ms")
+
+    record("files.cold", lambda: wg.get_docx_files(project), lambda: wg._dir_indexes.clear())
+    record("files.warm", lambda: wg.get_docx_files(project))
+    record("status.cold", lambda: wg.handle_status(project), lambda: reset_caches(project))
+    record("status.warm", lambda: wg.handle_status(project))
+    record("diff.cold", lambda: wg.handle_diff(project), lambda: reset_caches(project))
+    record("diff.warm", lambda: wg.handle_diff(project))
+    record("paragraph_diff.cold", lambda: wg.handle_paragraph_diff(project), lambda: reset_caches(project))
+    record("paragraph_diff.warm", lambda: wg.handle_paragraph_diff(project))
+    depth = min(5, args.commits - 1)
+    if depth > 0:
+        record("revision_diff.warm", lambda: wg.handle_diff(project, None, f"HEAD~{depth}", "HEAD"))
+    record("log.cold", lambda: wg.handle_log(project), lambda: reset_caches(project, disk=False))
+    record("log.warm", lambda: wg.handle_log(project))
+    record("search.build", lambda: wg.update_search_index(project), lambda: reset_caches(project), repeat=1)
+    record("search.query", lambda: wg.handle_search(project, query))
+
+    commits = [entry["id"] for entry in wg.handle_log(project)]
+    restored = []
+    record("restore", lambda: restored.append(wg.handle_restore(project, rng.choice(commits), rng.choice(names))))
+    for path in restored:
+        if os.path.exists(path):
+            os.unlink(path)
+
+    commit_no = [0]
+    def next_commit():
+        commit_no[0] += 1
+        wg.handle_commit(project, f"bench commit {commit_no[0]}")
+    record("commit", next_commit, lambda: edit_worktree(project, names, rng, 1))
+    return results
+
+async def bench_api(project, names, args):
+    import httpx
+    import main
+
+    base_url = args.url or "http://bench"
+    transport = None if args.url else httpx.ASGITransport(app=main.app)
+    doc = names[0]
+    query = " ".join(make_paragraphs(1, args.seed)[0].split()[:3])
+    endpoints = {
+        "GET /api/files": ("/api/files", {}),
+        "GET /api/status": ("/api/status", {}),
+        "GET /api/log": ("/api/log", {"limit": 50}),
+        "GET /api/diff/{file}": (f"/api/diff/{doc}", {}),
+        "GET /api/diff/{file}?format=json": (f"/api/diff/{doc}", {"format": "json"}),
+        "GET /api/search": ("/api/search", {"q": query}),
+    }
+    results = {}
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=120) as client:
+        for label, (path, params) in endpoints.items():
+            params = {"project_path": project, **params}
+            await client.get(path, params=params) # Warm-up
+            samples, errors = [], 0
+            pending = iter(range(args.requests))
+
+            async def worker():
+                nonlocal errors
+                for _ in pending:
+                    started = time.perf_counter()
+                    response = await client.get(path, params=params)
+                    samples.append(time.perf_counter() - started)
+                    if response.status_code >= 400:
+                        errors += 1
+
+            started = time.perf_counter()
+            await asyncio.gather(*[worker() for _ in range(args.concurrency)])
+            elapsed = time.perf_counter() - started
+            results[label] = {
+                **summarize(samples),
+                "concurrency": args.concurrency,
+                "errors": errors,
+                "throughput_rps": round(len(samples) / elapsed, 1),
+            }
+            print(f"  {label:<34} p50 {results[label]['p50_ms']:8.1f} ms   p95 {results[label]['p95_ms']:8.1f} ms"
+                  f"   {results[label]['throughput_rps']:8.1f} req/s")
+    return results
+
+def compare(results, baseline, default_threshold, thresholds, min_delta_ms=0.0):
+    """
+    Returns: 回归列表 [(名称, 基线 p50, 当前 p50, 比值, 阈值)]
+    绝对差值不足 min_delta_ms 的变化视为噪声 (亚毫秒级操作的比值波动很大)。
+    """
+    regressions = []
+    for section in ("engine", "api"):
+        for name, current in results.get(section, {}).items():
+            previous = baseline.get(section, {}).get(name)
+            if not previous or not previous.get("p50_ms"):
+                continue
+            limit = thresholds.get(name, default_threshold)
+            ratio = current["p50_ms"] / previous["p50_ms"]
+            if ratio > limit and current["p50_ms"] - previous["p50_ms"] >= min_delta_ms:
+                regressions.append((f"{section}:{name}", previous["p50_ms"], current["p50_ms"], ratio, limit))
+    return regressions
+
+def git_version():
+    try:
+        return subprocess.run(["git", "--version"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="wg 基准测试套件")
+    parser.add_argument("--repo", help="使用已有仓库 (会在其中提交!) 而不是生成合成仓库")
+    parser.add_argument("--docs", type=int, default=10)
+    parser.add_argument("--paragraphs", type=int, default=300)
+    parser.add_argument("--commits", type=int, default=50)
+    parser.add_argument("--images", type=int, default=2)
+    parser.add_argument("--repeat", type=int, default=5, help="每个引擎操作的重复次数")
+    parser.add_argument("--concurrency", type=int, default=16, help="API 压测的并发请求数")
+    parser.add_argument("--requests", type=int, default=200, help="每个端点的请求总数")
+    parser.add_argument("--url", help="压测已运行的服务器 (默认进程内 ASGI)")
+    parser.add_argument("--skip-api", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench-results.json")
+    parser.add_argument("--baseline", help="与之比较的上次结果 JSON")
+    parser.add_argument("--threshold", type=float, default=1.25, help="p50 允许的最大变慢倍数")
+    parser.add_argument("--min-delta-ms", type=float, default=2.0, help="小于此绝对差值的变慢不算回归")
+    parser.add_argument("--thresholds", help="按名称覆盖阈值的 JSON 文件, 例如 {\"commit\": 1.5}")
+    args = parser.parse_args()
+
+    tmp = None
+    if args.repo:
+        project = str(Path(args.repo).resolve())
+        names = wg.get_docx_files(project)
+    else:
+        tmp = tempfile.mkdtemp(prefix="wg-bench-")
+        project = tmp
+        print(f"生成仓库: {args.docs} 文档 x {args.paragraphs} 段, {args.commits} 次提交, 每文档 {args.images} 张图片")
+        started = time.perf_counter()
+        names = build_repo(project, args.docs, args.paragraphs, args.commits, args.images, seed=args.seed)
+        print(f"  完成 ({time.perf_counter() - started:.1f} s)")
+
+    try:
+        results = {
+            "meta": {
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "git": git_version(),
+                "pandoc": bool(shutil.which("pandoc")),
+                "corpus": None if args.repo else {
+                    "docs": args.docs, "paragraphs": args.paragraphs, "commits": args.commits,
+                    "images": args.images, "seed": args.seed,
+                },
+            },
+        }
+        print("[engine]")
+        results["engine"] = bench_engine(project, names, args)
+        if not args.skip_api:
+            print("[api]")
+            results["api"] = asyncio.run(bench_api(project, names, args))
+    finally:
+        wg.close_cat_file_pools()
+        if tmp:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"结果已写入 {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        thresholds = {}
+        if args.thresholds:
+            with open(args.thresholds, encoding="utf-8") as f:
+                thresholds = json.load(f)
+        regressions = compare(results, baseline, args.threshold, thresholds, args.min_delta_ms)
+        for name, before, after, ratio, limit in regressions:
+            print(f"REGRESSION {name}: {before:.1f} ms -> {after:.1f} ms ({ratio:.2f}x > {limit:.2f}x)")
+        if regressions:
+            sys.exit(1)
+        print("没有超过阈值的回归。")
+
+if __name__ == "__main__":
+    main()
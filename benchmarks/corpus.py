@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+合成 .docx 语料生成器 (供 benchmarks/ 下的脚本使用)。
+生成的文件只包含 Word 能打开的最小部件集合, 不依赖 python-docx。
+
+也可以直接生成一个带历史的 wg 仓库:
+    python benchmarks/corpus.py /tmp/bench-repo --docs 50 --paragraphs 500 --commits 200 --images 2
+"""
+
+import os
+import sys
+import random
+import zipfile
+import argparse
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Default Extension="png" ContentType="image/png"/>
+<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>
+<Override PartName="/word/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml"/>
+</Types>"""
+
+PACKAGE_RELS = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>
+</Relationships>"""
+
+STYLES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<w:styles xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">
+<w:style w:type="paragraph" w:styleId="1"><w:name w:val="heading 1"/><w:pPr><w:outlineLvl w:val="0"/></w:pPr></w:style>
+<w:style w:type="paragraph" w:styleId="2"><w:name w:val="heading 2"/><w:pPr><w:outlineLvl w:val="1"/></w:pPr></w:style>
+</w:styles>"""
+
+DOCUMENT_HEAD = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships" '
+    'xmlns:wp="http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing" '
+    'xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main" '
+    'xmlns:pic="http://schemas.openxmlformats.org/drawingml/2006/picture"><w:body>'
+)
+DOCUMENT_TAIL = "</w:body></w:document>"
+
+# A 1x1 transparent PNG, padded with random bytes per image so blobs differ
+PNG_HEADER = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000154a24f5d0000000049454e44ae426082"
+)
+
+WORDS = (
+    "合同 甲方 乙方 条款 付款 期限 违约 责任 保密 争议 解决 生效 附件 签署 "
+    "contract party clause payment term liability notice schedule annex signature"
+).split()
+
+def random_sentence(rng, min_words=8, max_words=30):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(min_words, max_words)))
+
+def make_paragraphs(count, seed=0):
+    """生成 count 段可复现的随机文本"""
+    rng = random.Random(seed)
+    return [random_sentence(rng) for _ in range(count)]
+
+def _paragraph_xml(text, style=None):
+    ppr = f'<w:pPr><w:pStyle w:val="{style}"/></w:pPr>' if style else ""
+    return f'<w:p>{ppr}<w:r><w:t xml:space="preserve">{escape(text)}</w:t></w:r></w:p>'
+
+def _image_xml(rel_id):
+    return (
+        '<w:p><w:r><w:drawing><wp:inline><wp:extent cx="9525" cy="9525"/><wp:docPr id="1" name="img"/>'
+        '<a:graphic><a:graphicData uri="http://schemas.openxmlformats.org/drawingml/2006/picture">'
+        f'<pic:pic><pic:blipFill><a:blip r:embed="{rel_id}"/></pic:blipFill></pic:pic>'
+        '</a:graphicData></a:graphic></wp:inline></w:drawing></w:r></w:p>'
+    )
+
+def _table_xml(rows):
+    body = "".join(
+        "<w:tr>" + "".join(f"<w:tc>{_paragraph_xml(cell)}</w:tc>" for cell in row) + "</w:tr>"
+        for row in rows
+    )
+    return f"<w:tbl>{body}</w:tbl>"
+
+def write_docx(path, paragraphs, headings_every=20, tables=0, images=0, seed=0):
+    """
+    写出一个 .docx 文件。
+    paragraphs: 正文段落文本列表; 每 headings_every 段插入一个标题。
+    tables / images: 额外插入的表格 / 图片数量。
+    """
+    rng = random.Random(seed)
+    parts = [DOCUMENT_HEAD]
+    for i, text in enumerate(paragraphs):
+        if headings_every and i % headings_every == 0:
+            parts.append(_paragraph_xml(f"第 {i // headings_every + 1} 章", style="1"))
+        parts.append(_paragraph_xml(text))
+    for t in range(tables):
+        rows = [[f"{r}-{c} {rng.choice(WORDS)}" for c in range(4)] for r in range(5)]
+        parts.append(_table_xml(rows))
+    rels = []
+    for i in range(images):
+        rel_id = f"rIdImg{i}"
+        rels.append(
+            f'<Relationship Id="{rel_id}" '
+            'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/image" '
+            f'Target="media/image{i}.png"/>'
+        )
+        parts.append(_image_xml(rel_id))
+    parts.append(DOCUMENT_TAIL)
+
+    document_rels = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        + "".join(rels) + "</Relationships>"
+    )
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("[Content_Types].xml", CONTENT_TYPES)
+        archive.writestr("_rels/.rels", PACKAGE_RELS)
+        archive.writestr("word/document.xml", "".join(parts))
+        archive.writestr("word/styles.xml", STYLES)
+        archive.writestr("word/_rels/document.xml.rels", document_rels)
+        for i in range(images):
+            archive.writestr(f"word/media/image{i}.png", PNG_HEADER + rng.randbytes(2048))
+
+def build_repo(project, docs=10, paragraphs=200, commits=20, images=0, edits=3, seed=0):
+    """
+    生成一个 wg 仓库: docs 个文档, 每个 paragraphs 段, 共 commits 次提交。
+    每次提交随机选一个文档修改 edits 段; 第一次提交包含全部文档。
+    Returns: 文档相对路径列表
+    """
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    import wg
+
+    rng = random.Random(seed)
+    os.makedirs(project, exist_ok=True)
+    wg.handle_init(project)
+    names = [f"dept{i % 5}/doc{i:04d}.docx" for i in range(docs)]
+    texts = {}
+    for i, name in enumerate(names):
+        os.makedirs(os.path.join(project, os.path.dirname(name)), exist_ok=True)
+        texts[name] = make_paragraphs(paragraphs, seed + i)
+        write_docx(os.path.join(project, name), texts[name], images=images, seed=seed + i)
+    wg.handle_commit(project, "Import corpus")
+
+    for rev in range(1, commits):
+        name = rng.choice(names)
+        text = texts[name]
+        for _ in range(edits):
+            text[rng.randrange(len(text))] = random_sentence(rng)
+        write_docx(os.path.join(project, name), text, images=images, seed=seed + names.index(name))
+        wg.handle_commit(project, f"Edit {name} (rev {rev})", [name])
+    return names
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="生成合成 .docx 仓库")
+    parser.add_argument("project", help="输出目录")
+    parser.add_argument("--docs", type=int, default=10)
+    parser.add_argument("--paragraphs", type=int, default=200)
+    parser.add_argument("--commits", type=int, default=20)
+    parser.add_argument("--images", type=int, default=0)
+    parser.add_argument("--edits", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    created = build_repo(args.project, args.docs, args.paragraphs, args.commits, args.images, args.edits, args.seed)
+    print(f"已生成 {len(created)} 个文档, {args.commits} 次提交: {args.project}")
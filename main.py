@@ -1,19 +1,38 @@
+import os
 import json
+import time
 import asyncio
+from urllib.parse import quote
+from contextlib import asynccontextmanager
 from typing import List, Optional
 from pathlib import Path
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Header, Request, Response
 from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse, PlainTextResponse, HTMLResponse, JSONResponse
+import anyio
 
 # Import our refactored engine
 import wg
 
-app = FastAPI(title="WG-Server", version="5.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Background work that lives as long as the server (V5.18)
+    stats_backfill.start()
+    prerender.start()
+    # Periodic / server-wide work runs in one worker only (V5.25)
+    worker_role.start()
+    try:
+        yield
+    finally:
+        await worker_role.stop()
+        await prerender.stop()
+        await stats_backfill.stop()
+
+app = FastAPI(title="WG-Server", version="5.0", lifespan=lifespan)
 
 # --- CORS Configuration ---
 app.add_middleware(
@@ -22,8 +41,47 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor"],
 )
 
+# --- Metrics (V5.19) ---
+
+REQUEST_SECONDS = wg.Histogram(
+    "wg_http_request_seconds", "Latency of API requests by route.", ("method", "route", "status")
+)
+UNTIMED_ROUTES = {"/api/events", "/metrics"} # Long-lived streams / the scrape itself
+
+class RequestMetricsMiddleware:
+    """Plain ASGI middleware (keeps request.is_disconnected() working for handlers)."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            if path not in UNTIMED_ROUTES:
+                REQUEST_SECONDS.observe((scope["method"], path, str(status[0])), time.perf_counter() - started)
+
+app.add_middleware(RequestMetricsMiddleware)
+
+# Optional slow-operation log: WG_SLOW_OP_SECONDS=1.5 [WG_SLOW_OP_LOG=slow-ops.jsonl]
+if os.environ.get("WG_SLOW_OP_SECONDS"):
+    wg.configure_slow_log(float(os.environ["WG_SLOW_OP_SECONDS"]), os.environ.get("WG_SLOW_OP_LOG") or None)
+
 # --- Static Files Configuration ---
 # Mount the frontend 'dist' directory
 # Ensure 'wg-frontend/dist' exists (run 'npm run build' first)
@@ -37,12 +95,24 @@ if DIST_DIR.exists():
 else:
     print("Warning: Frontend dist directory not found. Run 'npm run build' in wg-frontend.")
 
-PROJECTS_FILE = Path("projects.json")
+PROJECTS_FILE = Path("projects.json") # Before V5.25; imported once into the state store
+
+# --- Shared State Store (V5.25) ---
+# Project registry plus status / log caches shared by every worker (start.py --workers N)
+STATE_DB = Path(os.environ.get("WG_STATE_DB", "wg-state.db"))
+state = wg.configure_state_store(STATE_DB)
+if PROJECTS_FILE.exists():
+    try:
+        with open(PROJECTS_FILE, "r") as f:
+            state.import_projects(json.load(f))
+    except (OSError, ValueError) as e:
+        print(f"Warning: could not import {PROJECTS_FILE}: {e}")
 
 # --- Pydantic Models ---
 
 class AddProjectRequest(BaseModel):
     path: str
+    canonical_storage: bool = False # Store .docx uncompressed so git can delta them (V5.17)
 
 class CommitRequest(BaseModel):
     message: str
@@ -62,21 +132,653 @@ class LogEntry(BaseModel):
     author: str
     date: str
     files: List[str] = []
+    stats: Optional[dict] = None # refs/notes/wg-stats; None until computed (V5.22)
 
 # --- Helper Functions ---
 
 def load_projects() -> List[str]:
-    if not PROJECTS_FILE.exists():
-        return []
+    return state.list_projects()
+
+# --- Operation Scheduler (V5.11) ---
+
+MAX_QUEUE_DEPTH = 32 # Requests allowed to wait per project before answering 503
+
+class ProjectScheduler:
+    """
+    Reader/writer lock for one project. Status/log/diff run in parallel;
+    init/commit/reset/revert get the repository to themselves, so git never
+    sees a status poll racing a commit on index.lock. Waiting is async, so
+    queued requests do not hold threadpool threads.
+    """
+
+    def __init__(self, max_queue: int = MAX_QUEUE_DEPTH):
+        self.max_queue = max_queue
+        self.readers = 0
+        self.writer = False
+        self.writers_waiting = 0
+        self.queued = 0
+        self.waits = {"read": [0, 0.0, 0.0], "write": [0, 0.0, 0.0]} # count, total, max (seconds)
+        self.last_active = time.monotonic()
+        self._cond = asyncio.Condition()
+
+    @asynccontextmanager
+    async def acquire(self, exclusive: bool):
+        if self.queued >= self.max_queue:
+            raise HTTPException(status_code=503, detail="Project is busy, try again shortly",
+                                headers={"Retry-After": "1"})
+        started = time.perf_counter()
+        self.last_active = time.monotonic()
+        self.queued += 1
+        try:
+            async with self._cond:
+                if exclusive:
+                    self.writers_waiting += 1
+                    try:
+                        await self._cond.wait_for(lambda: not self.writer and self.readers == 0)
+                    finally:
+                        self.writers_waiting -= 1
+                        self._cond.notify_all()
+                    self.writer = True
+                else:
+                    # Writers waiting go first, so a steady poll stream cannot starve a commit
+                    await self._cond.wait_for(lambda: not self.writer and self.writers_waiting == 0)
+                    self.readers += 1
+        finally:
+            self.queued -= 1
+        self._record_wait("write" if exclusive else "read", time.perf_counter() - started)
+
+        try:
+            yield
+        finally:
+            self.last_active = time.monotonic()
+            async with self._cond:
+                if exclusive:
+                    self.writer = False
+                else:
+                    self.readers -= 1
+                self._cond.notify_all()
+
+    def _record_wait(self, mode: str, seconds: float):
+        stats = self.waits[mode]
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2] = max(stats[2], seconds)
+
+    def idle_for(self) -> float:
+        """Seconds since the last request started or finished; 0 while any is running."""
+        if self.readers or self.writer or self.queued:
+            return 0.0
+        return time.monotonic() - self.last_active
+
+    def snapshot(self) -> dict:
+        return {
+            "readers": self.readers,
+            "writer": self.writer,
+            "queued": self.queued,
+            "max_queue": self.max_queue,
+            "wait_ms": {
+                mode: {
+                    "count": count,
+                    "avg": round(total / count * 1000, 2) if count else 0.0,
+                    "max": round(peak * 1000, 2),
+                }
+                for mode, (count, total, peak) in self.waits.items()
+            },
+        }
+
+schedulers = {}
+
+def get_scheduler(project_path: str) -> ProjectScheduler:
+    key = os.path.normcase(os.path.abspath(project_path))
+    scheduler = schedulers.get(key)
+    if scheduler is None:
+        scheduler = schedulers[key] = ProjectScheduler()
+    return scheduler
+
+WORKER_LOCK_POLL = 0.05 # Seconds between attempts on another worker's write lock
+
+@asynccontextmanager
+async def across_workers(project_path: str):
+    """
+    Exclusive against the other server workers (.git/wg-cache/write.lock, V5.25).
+    Waiting polls asynchronously, so no threadpool thread is parked on the lock.
+    A folder that is not a repository yet has nothing to protect (init is idempotent).
+    """
+    if not (Path(project_path) / ".git").is_dir():
+        yield
+        return
+    lock = wg.project_lock(project_path, "write")
+    while not lock.acquire(blocking=False):
+        await asyncio.sleep(WORKER_LOCK_POLL)
     try:
-        with open(PROJECTS_FILE, "r") as f:
-            return json.load(f)
-    except:
-        return []
+        yield
+    finally:
+        lock.release()
+
+def reading(project_path: str):
+    """Shared access: status, files, log, diff, restore."""
+    return get_scheduler(project_path).acquire(exclusive=False)
+
+@asynccontextmanager
+async def writing(project_path: str):
+    """Exclusive access: init, commit, reset, revert (in this worker and across workers)."""
+    async with get_scheduler(project_path).acquire(exclusive=True), across_workers(project_path):
+        yield
+
+async def run_exclusive(func, *args):
+    """
+    Run a writer in the threadpool and keep the lock until git has finished,
+    even if the request is cancelled meanwhile.
+    """
+    task = asyncio.ensure_future(run_in_threadpool(func, *args))
+    try:
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        await asyncio.wait([task])
+        raise
+
+# --- Repository Maintenance (V5.18) ---
+
+MAINTENANCE_INTERVAL = 300 # Seconds between checks of all projects
+MAINTENANCE_IDLE = 120 # A project must have seen no requests for this long
+
+class MaintenanceScheduler:
+    """
+    Periodically packs loose objects / refreshes the commit-graph of idle projects.
+    A pass holds the project's shared lock, so it never overlaps a commit, reset
+    or revert; writers arriving meanwhile wait for it to finish.
+    """
+
+    def __init__(self):
+        self.reports = {} # project -> last report (with 'finished_at')
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(MAINTENANCE_INTERVAL)
+            for project_path in load_projects():
+                try:
+                    await self.maintain(project_path)
+                except Exception as e:
+                    print(f"Maintenance failed for {project_path}: {e}")
+
+    async def maintain(self, project_path: str, force: bool = False) -> Optional[dict]:
+        """Run whatever maintenance is due; None when skipped (busy or nothing to do)."""
+        if not force and get_scheduler(project_path).idle_for() < MAINTENANCE_IDLE:
+            return None
+        tasks = await run_in_threadpool(wg.plan_maintenance, project_path)
+        if not tasks:
+            return None
+        async with reading(project_path), across_workers(project_path):
+            report = await run_exclusive(wg.run_maintenance, project_path, tasks)
+        report["finished_at"] = time.time()
+        self.reports[project_path] = report
+        return report
+
+maintenance = MaintenanceScheduler()
+
+# --- Commit Statistics Backfill (V5.22) ---
+
+STATS_WORKERS = int(os.environ.get("WG_STATS_WORKERS", wg.STATS_WORKERS)) # Conversions at once, server-wide
+
+class StatsBackfill:
+    """
+    Fills refs/notes/wg-stats for commits that have no statistics yet, one project
+    at a time so at most STATS_WORKERS conversions run server-wide. Notes are
+    written after every batch; after a restart the queue simply picks up the
+    commits still missing. The same pass brings the search index up to date, so
+    searches never extract text themselves. Only immutable objects are read, so
+    no project lock is held and commits are never delayed by a long backfill.
+    """
+
+    def __init__(self):
+        self.reports = {} # project -> last report (with 'finished_at')
+        self.current = None
+        self._queue = None
+        self._queued = set()
+        self._task = None
+        self._stopping = False
+
+    def start(self):
+        if self._task is None:
+            self._stopping = False
+            self._queue = asyncio.Queue()
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._stopping = True # The running batch finishes and is written
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def request_all(self):
+        """Queue every registered project (done once, by the leading worker)."""
+        for project_path in load_projects():
+            self.request(project_path)
+
+    def request(self, project_path: str):
+        """Queue a project (no-op when already queued or the backfill is not running)."""
+        if self._queue is not None and project_path not in self._queued:
+            self._queued.add(project_path)
+            self._queue.put_nowait(project_path)
+
+    def snapshot(self) -> dict:
+        return {"current": self.current, "queued": sorted(self._queued), "reports": self.reports}
+
+    async def _run(self):
+        while True:
+            project_path = await self._queue.get()
+            self._queued.discard(project_path)
+            self.current = project_path
+            try:
+                report = await run_in_threadpool(
+                    wg.backfill_commit_stats, project_path, STATS_WORKERS, None, lambda: self._stopping
+                )
+                report["search"] = await run_in_threadpool(
+                    wg.update_search_index, project_path, lambda: self._stopping
+                )
+                report["finished_at"] = time.time()
+                self.reports[project_path] = report
+            except Exception as e:
+                print(f"Stats backfill failed for {project_path}: {e}")
+            finally:
+                self.current = None
+
+stats_backfill = StatsBackfill()
+
+# --- Preview Pre-rendering (V5.23) ---
+
+PRERENDER_WORKERS = int(os.environ.get("WG_PRERENDER_WORKERS", 2)) # Renders at once, server-wide
+
+class PrerenderQueue:
+    """
+    Warms the preview cache for every document a commit touched, so the newest
+    versions open instantly. A blob already queued is not queued again; renders
+    read only immutable objects, so no project lock is taken.
+    """
+
+    def __init__(self):
+        self.rendered = 0
+        self.failed = 0
+        self._queue = None
+        self._queued = set() # (project, blob sha)
+        self._tasks = []
+
+    def start(self):
+        if not self._tasks:
+            self._queue = asyncio.Queue()
+            self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(PRERENDER_WORKERS)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def request_commit(self, project_path: str, commit_id: str):
+        """Queue the versions written by commit_id that have no cached preview yet."""
+        if self._queue is None:
+            return
+        try:
+            pending = await run_in_threadpool(wg.pending_previews, project_path, commit_id)
+        except Exception as e:
+            print(f"Pre-render skipped for {project_path}: {e}")
+            return
+        for _, blob_sha in pending:
+            if (project_path, blob_sha) not in self._queued:
+                self._queued.add((project_path, blob_sha))
+                self._queue.put_nowait((project_path, blob_sha))
+
+    def snapshot(self) -> dict:
+        return {"queued": len(self._queued), "rendered": self.rendered, "failed": self.failed}
+
+    async def _worker(self):
+        while True:
+            project_path, blob_sha = await self._queue.get()
+            try:
+                await run_in_threadpool(wg.get_preview, project_path, blob_sha)
+                self.rendered += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"Pre-render failed for {blob_sha} in {project_path}: {e}")
+            finally:
+                self._queued.discard((project_path, blob_sha))
+
+prerender = PrerenderQueue()
+
+# --- Auto Snapshots (V5.24) ---
+
+SNAPSHOT_QUIET_SECONDS = float(os.environ.get("WG_SNAPSHOT_QUIET", 30)) # Snapshot once saves pause this long
+SNAPSHOT_MAX_DELAY = float(os.environ.get("WG_SNAPSHOT_MAX_DELAY", 300)) # ...or at the latest this long after the first one
+
+class AutoSnapshotter:
+    """
+    Watches projects with auto-snapshot enabled and records a snapshot once a
+    burst of saves has settled. A save keeps pushing the snapshot back by
+    SNAPSHOT_QUIET_SECONDS, but never beyond SNAPSHOT_MAX_DELAY after the first
+    one, so continuous editing is still captured. Snapshots never touch the
+    index, so they only take the shared lock (no waiting on status reads).
+    """
+
+    def __init__(self):
+        self.last = {} # project -> last snapshot result / error
+        self._watchers = {}
+        self._timers = {}
+        self._first_change = {}
+        self._config_stamps = {} # project -> .git/config mtime at the last sync
+        self._loop = None
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        await self.sync()
+
+    async def sync(self):
+        """
+        Match the watchers to wg.autoSnapshot in each project's git config (V5.25),
+        which another worker may have switched. Only re-read when the config changed.
+        """
+        projects = load_projects()
+        for project_path in set(self._watchers) - set(projects):
+            await self.disable(project_path)
+        for project_path in projects:
+            try:
+                stamp = os.stat(Path(project_path) / ".git" / "config").st_mtime_ns
+                if self._config_stamps.get(project_path) == stamp:
+                    continue
+                self._config_stamps[project_path] = stamp
+                if await run_in_threadpool(wg.is_auto_snapshot_enabled, project_path):
+                    await self.enable(project_path)
+                else:
+                    await self.disable(project_path)
+            except Exception as e:
+                print(f"Auto snapshot not started for {project_path}: {e}")
+
+    async def stop(self):
+        for project_path in list(self._watchers):
+            await self.disable(project_path)
+
+    def enabled(self, project_path: str) -> bool:
+        return project_path in self._watchers
+
+    async def enable(self, project_path: str):
+        if project_path in self._watchers or self._loop is None:
+            return
+        loop = self._loop
+        watcher = wg.ProjectWatcher(project_path, lambda: loop.call_soon_threadsafe(self._on_change, project_path))
+        self._watchers[project_path] = await run_in_threadpool(watcher.start)
+        self._on_change(project_path) # Capture whatever is unsaved right now
+
+    async def disable(self, project_path: str):
+        watcher = self._watchers.pop(project_path, None)
+        timer = self._timers.pop(project_path, None)
+        if timer:
+            timer.cancel()
+        self._first_change.pop(project_path, None)
+        if watcher:
+            await run_in_threadpool(watcher.stop)
+
+    def _on_change(self, project_path: str):
+        if project_path not in self._watchers:
+            return
+        now = self._loop.time()
+        first = self._first_change.setdefault(project_path, now)
+        timer = self._timers.pop(project_path, None)
+        if timer:
+            timer.cancel()
+        delay = max(0.0, min(SNAPSHOT_QUIET_SECONDS, first + SNAPSHOT_MAX_DELAY - now))
+        self._timers[project_path] = self._loop.call_later(
+            delay, lambda: asyncio.ensure_future(self._snapshot(project_path))
+        )
+
+    async def _snapshot(self, project_path: str):
+        self._timers.pop(project_path, None)
+        self._first_change.pop(project_path, None)
+        try:
+            async with reading(project_path):
+                result = await run_in_threadpool(wg.take_snapshot, project_path)
+            if result:
+                self.last[project_path] = {**result, "finished_at": time.time()}
+        except Exception as e:
+            self.last[project_path] = {"error": str(e), "finished_at": time.time()}
+            print(f"Auto snapshot failed for {project_path}: {e}")
+
+snapshotter = AutoSnapshotter()
+
+# --- Worker Roles (V5.25) ---
+
+LEADER_POLL_INTERVAL = 5.0 # Seconds between leadership attempts / auto-snapshot config syncs
+
+class WorkerRole:
+    """
+    With several workers, server-wide background work must run once, not once per
+    worker. The worker holding the leader lock (next to the state database) runs
+    the maintenance loop, the startup stats backfill and the auto-snapshot watchers;
+    the others retry every LEADER_POLL_INTERVAL, so one of them takes over when the
+    leader exits. Work triggered by a request (statistics and previews for a new
+    commit) stays in the worker that served it.
+    """
+
+    def __init__(self, lock_path: Path):
+        self.leader = False
+        self._lock = wg.FileLock(lock_path)
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self.leader:
+            await snapshotter.stop()
+            await maintenance.stop()
+            self._lock.release()
+            self.leader = False
+
+    async def _run(self):
+        while True:
+            try:
+                if self.leader:
+                    await snapshotter.sync()
+                elif self._lock.acquire(blocking=False):
+                    self.leader = True
+                    maintenance.start()
+                    stats_backfill.request_all()
+                    await snapshotter.start()
+            except Exception as e:
+                print(f"Background work failed in worker {os.getpid()}: {e}")
+            await asyncio.sleep(LEADER_POLL_INTERVAL)
+
+    def snapshot(self) -> dict:
+        return {"pid": os.getpid(), "leader": self.leader}
+
+worker_role = WorkerRole(STATE_DB.with_name(STATE_DB.name + ".leader"))
+
+# --- Request Coalescing (V5.13) ---
+
+class SingleFlight:
+    """
+    Identical in-flight reads share one computation. The key always includes
+    the project's on-disk stamp, so a request arriving after a change never
+    gets a result computed before it. The shared task is only cancelled once
+    every waiting request has gone away.
+    """
+
+    def __init__(self):
+        self.inflight = {}
+        self.stats = {} # op -> [calls, shared]
+
+    async def run(self, op: str, key: tuple, factory):
+        flight_key = (op,) + key
+        stats = self.stats.setdefault(op, [0, 0])
+        stats[0] += 1
+        entry = self.inflight.get(flight_key)
+        if entry is None:
+            entry = self.inflight[flight_key] = {"task": asyncio.ensure_future(factory()), "waiters": 0}
+            entry["task"].add_done_callback(lambda _: self._forget(flight_key, entry))
+        else:
+            stats[1] += 1
+        entry["waiters"] += 1
+        try:
+            return await asyncio.shield(entry["task"])
+        finally:
+            entry["waiters"] -= 1
+            if entry["waiters"] == 0 and not entry["task"].done():
+                # Forget it first: a request arriving before the done callback runs
+                # must start a fresh task, not join the cancelled one
+                self._forget(flight_key, entry)
+                entry["task"].cancel()
+
+    def _forget(self, flight_key: tuple, entry: dict):
+        if self.inflight.get(flight_key) is entry:
+            del self.inflight[flight_key]
+
+    def snapshot(self) -> dict:
+        return {
+            "inflight": len(self.inflight),
+            "ops": {
+                op: {
+                    "calls": calls,
+                    "shared": shared,
+                    "hit_rate": round(shared / calls, 4) if calls else 0.0,
+                }
+                for op, (calls, shared) in self.stats.items()
+            },
+        }
+
+single_flight = SingleFlight()
+
+def coalesce(op: str, project_path: str, etag: str, args: tuple, factory):
+    key = (os.path.normcase(os.path.abspath(project_path)), etag) + args
+    return single_flight.run(op, key, factory)
+
+# --- Change Notifications (V5.5) ---
+
+class EventHub:
+    """
+    One filesystem watcher per project, shared by every connected client.
+    When the watcher fires, status / files / log are recomputed once and only
+    the kinds that actually changed are pushed to subscribers.
+    """
+
+    def __init__(self, project_path: str, loop: asyncio.AbstractEventLoop):
+        self.project_path = project_path
+        self.loop = loop
+        self.subscribers = set()
+        self.state = {}
+        self.watcher = None
+        self._refresh_task = None
+        self._dirty = False
 
-def save_projects(projects: List[str]):
-    with open(PROJECTS_FILE, "w") as f:
-        json.dump(projects, f, indent=2)
+    def start(self):
+        self.watcher = wg.ProjectWatcher(self.project_path, self._on_change).start()
+
+    def stop(self):
+        if self.watcher:
+            self.watcher.stop()
+            self.watcher = None
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=100)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+
+    def _on_change(self):
+        # Called from the watcher thread
+        self.loop.call_soon_threadsafe(self.schedule_refresh)
+
+    def schedule_refresh(self):
+        if self._refresh_task and not self._refresh_task.done():
+            self._dirty = True # Run once more after the current pass
+            return
+        self._refresh_task = asyncio.ensure_future(self.refresh())
+
+    async def refresh(self):
+        while True:
+            self._dirty = False
+            try:
+                async with reading(self.project_path):
+                    new_state = {
+                        "status": await wg.handle_status_async(self.project_path, []),
+                        "files": await run_in_threadpool(wg.get_docx_files, self.project_path),
+                        "log": (await wg.query_log_async(self.project_path, []))[0],
+                    }
+            except Exception as e:
+                print(f"Error refreshing events for {self.project_path}: {e}")
+                return
+            for kind, value in new_state.items():
+                if self.state.get(kind) != value:
+                    self._publish(kind, self._delta(kind, self.state.get(kind), value))
+            self.state = new_state
+            if not self._dirty:
+                return
+
+    @staticmethod
+    def _delta(kind, old, new):
+        if kind != "log":
+            return new
+        # New commits on top of the known history are sent on their own
+        if old and new:
+            head_ids = [c["id"] for c in new]
+            if old[0]["id"] in head_ids:
+                start = head_ids.index(old[0]["id"])
+                # (V5.22) Stats arriving for known commits change old entries: resend all
+                if new[start:] == old:
+                    return {"mode": "prepend", "commits": new[:start]}
+        return {"mode": "reset", "commits": new}
+
+    def _publish(self, kind, data):
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait((kind, data))
+            except asyncio.QueueFull:
+                pass # A stuck client only misses deltas; it resyncs on reconnect
+
+event_hubs = {}
+
+async def acquire_event_hub(project_path: str):
+    """Returns (hub, queue); the watcher is started by the first subscriber."""
+    hub = event_hubs.get(project_path)
+    if hub is not None:
+        return hub, hub.subscribe()
+
+    hub = EventHub(project_path, asyncio.get_running_loop())
+    event_hubs[project_path] = hub
+    try:
+        await run_in_threadpool(hub.start)
+        await hub.refresh()
+    except Exception:
+        del event_hubs[project_path]
+        await run_in_threadpool(hub.stop)
+        raise
+    # Subscribe after the first refresh: its state is sent as the initial snapshot
+    return hub, hub.subscribe()
+
+async def release_event_hub(hub: EventHub, queue: asyncio.Queue):
+    hub.unsubscribe(queue)
+    if not hub.subscribers and event_hubs.get(hub.project_path) is hub:
+        del event_hubs[hub.project_path]
+        await run_in_threadpool(hub.stop)
+
+def format_sse(kind: str, data) -> str:
+    return f"event: {kind}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
 # --- API Endpoints ---
 
@@ -94,145 +796,726 @@ async def add_project(req: AddProjectRequest):
         raise HTTPException(status_code=400, detail="Path does not exist")
     
     # Initialize (idempotent now)
-    try:
-        await run_in_threadpool(wg.handle_init, abs_path)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to initialize project: {str(e)}")
+    async with writing(abs_path):
+        try:
+            await run_exclusive(wg.handle_init, abs_path, req.canonical_storage)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Failed to initialize project: {str(e)}")
 
-    projects = load_projects()
-    if abs_path not in projects:
-        projects.append(abs_path)
-        save_projects(projects)
+    await run_in_threadpool(state.add_project, abs_path)
+    stats_backfill.request(abs_path)
     
     return {"message": "Project added", "path": abs_path}
 
 @app.delete("/api/projects")
 async def remove_project(path: str):
     """Remove a project from the list."""
-    projects = load_projects()
-    if path in projects:
-        projects.remove(path)
-        save_projects(projects)
+    await run_in_threadpool(state.remove_project, path)
     return {"success": True}
 
+# --- Multi-project Summary (V5.14) ---
+
+SUMMARY_CONCURRENCY = 8 # Projects summarised at the same time
+SUMMARY_TIMEOUT = 10.0 # Seconds per project before it is reported as timed out
+
+async def summarize_project(project_path: str) -> dict:
+    """Status counts, file count and last commit for one project."""
+    wg.check_init_status(project_path)
+    hub = event_hubs.get(project_path)
+    if hub is not None and hub.state:
+        # A watched project already holds fresh state; no git needed
+        status_list, files, commits = hub.state["status"], hub.state["files"], hub.state["log"][:1]
+    else:
+        async with reading(project_path):
+            status_list = await wg.handle_status_async(project_path, [])
+            files = await run_in_threadpool(wg.get_docx_files, project_path)
+            commits, _ = await wg.query_log_async(project_path, [], None, 1)
+    counts = {}
+    for item in status_list:
+        counts[item["status"]] = counts.get(item["status"], 0) + 1
+    return {
+        "changed": len(status_list),
+        "status_counts": counts,
+        "file_count": len(files),
+        "last_commit": commits[0] if commits else None,
+    }
+
+async def _summary_entry(project_path: str, slots: asyncio.Semaphore) -> dict:
+    started = time.perf_counter()
+    async with slots:
+        try:
+            entry = {"ok": True, **await asyncio.wait_for(summarize_project(project_path), SUMMARY_TIMEOUT)}
+        except asyncio.TimeoutError:
+            entry = {"ok": False, "error": f"timed out after {SUMMARY_TIMEOUT:g}s"}
+        except HTTPException as e:
+            entry = {"ok": False, "error": e.detail}
+        except Exception as e:
+            entry = {"ok": False, "error": str(e)}
+    entry["path"] = project_path
+    entry["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return entry
+
+@app.get("/api/projects/summary")
+async def get_projects_summary():
+    """
+    Summary of every registered project, one JSON object per line in the order
+    projects finish. Projects run in parallel (at most SUMMARY_CONCURRENCY at once),
+    so the whole response takes about as long as the slowest project.
+    """
+    projects = load_projects()
+
+    async def summary_stream():
+        slots = asyncio.Semaphore(SUMMARY_CONCURRENCY)
+        tasks = [asyncio.ensure_future(_summary_entry(path, slots)) for path in projects]
+        try:
+            for finished in asyncio.as_completed(tasks):
+                yield json.dumps(await finished, ensure_ascii=False) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(
+        summary_stream(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.post("/api/init")
-async def init_project(project_path: str):
-    """Ensure project is initialized (git init + pandoc config)."""
+async def init_project(project_path: str, canonical_storage: bool = False):
+    """Ensure project is initialized (git init + pandoc config, optionally canonical storage)."""
+    async with writing(project_path):
+        try:
+            await run_exclusive(wg.handle_init, project_path, canonical_storage)
+            return {"success": True}
+        except Exception as e:
+            print(f"Error in /api/init: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+
+def not_modified(etag: str, if_none_match: Optional[str]) -> Optional[Response]:
+    """304 response when the client already has this ETag (V5.6)."""
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": "no-cache"})
+    return None
+
+DISCONNECT_POLL_INTERVAL = 0.5
+
+async def cancel_on_disconnect(request: Request, coro):
+    """
+    Await coro, but cancel it (killing any git/pandoc child it is waiting on)
+    as soon as the client goes away. Returns a 499 response in that case.
+    """
+    task = asyncio.ensure_future(coro)
     try:
-        await run_in_threadpool(wg.handle_init, project_path)
-        return {"success": True}
-    except Exception as e:
-        print(f"Error in /api/init: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                return Response(status_code=499)
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+
+def timeout_error(e: Exception):
+    return HTTPException(status_code=504, detail=str(e))
 
 @app.get("/api/status", response_model=List[StatusFile])
-async def get_status(project_path: str, files: Optional[List[str]] = Query(None)):
+async def get_status(
+    project_path: str,
+    request: Request,
+    response: Response,
+    files: Optional[List[str]] = Query(None),
+    if_none_match: Optional[str] = Header(None),
+):
     """Get status of files in a project."""
-    try:
-        status_list = await run_in_threadpool(
-            wg.handle_status, 
-            project_path, 
-            files or []
-        )
-        return status_list
-    except Exception as e:
-        print(f"Error in /api/status: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    async with reading(project_path):
+        try:
+            # Stat-only check first: an unchanged project answers 304 without forking git
+            etag, stamp = await run_in_threadpool(wg.status_etag, project_path, files or [])
+            cached = not_modified(etag, if_none_match)
+            if cached:
+                return cached
+            status_list = await cancel_on_disconnect(
+                request,
+                coalesce("status", project_path, etag, tuple(files or ()),
+                         lambda: wg.handle_status_async(project_path, files or [], stamp))
+            )
+            if isinstance(status_list, Response):
+                return status_list
+            response.headers["ETag"] = etag
+            response.headers["Cache-Control"] = "no-cache"
+            return status_list
+        except wg.CommandTimeoutError as e:
+            raise timeout_error(e)
+        except Exception as e:
+            print(f"Error in /api/status: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/files", response_model=List[str])
-async def get_files(project_path: str):
+async def get_files(project_path: str, response: Response, if_none_match: Optional[str] = Header(None)):
     """Get list of all .docx files in the project."""
-    try:
-        files = await run_in_threadpool(wg.get_docx_files, project_path)
-        return files
-    except Exception as e:
-        print(f"Error in /api/files: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    async with reading(project_path):
+        try:
+            files = await run_in_threadpool(wg.get_docx_files, project_path)
+            etag = wg.make_etag(files)
+            cached = not_modified(etag, if_none_match)
+            if cached:
+                return cached
+            response.headers["ETag"] = etag
+            response.headers["Cache-Control"] = "no-cache"
+            return files
+        except Exception as e:
+            print(f"Error in /api/files: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/api/diff/{file_name}")
-async def get_diff(file_name: str, project_path: str):
-    """Get diff for a specific file."""
+@app.get("/api/events")
+async def stream_events(project_path: str):
+    """Server-Sent Events stream of status / files / log changes for a project."""
     try:
-        diff_output = await run_in_threadpool(
-            wg.handle_diff, 
-            project_path, 
-            [file_name]
-        )
-        return {"diff": diff_output}
+        wg.check_init_status(project_path)
+        hub, queue = await acquire_event_hub(project_path)
     except Exception as e:
-        print(f"Error in /api/diff: {e}")
+        print(f"Error in /api/events: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+    async def event_stream():
+        try:
+            # Full snapshot first, then only changes
+            for kind, value in hub.state.items():
+                yield format_sse(kind, {"mode": "reset", "commits": value} if kind == "log" else value)
+            while True:
+                try:
+                    kind, data = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_sse(kind, data)
+        finally:
+            await release_event_hub(hub, queue)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# --- Bounded Diffs (V5.26) ---
+DIFF_MAX_BYTES = int(os.environ.get("WG_DIFF_MAX_BYTES", wg.DIFF_MAX_BYTES)) # Per response, text or JSON hunks
+
+class DiffQuery(BaseModel):
+    """What to return of a diff: everything (up to the byte cap), a hunk range, or only a summary."""
+    format: str = "text"
+    summary: bool = False
+    hunk_start: int = 0
+    hunk_limit: Optional[int] = None
+
+    def key(self) -> tuple:
+        return (self.format, self.summary, self.hunk_start, self.hunk_limit)
+
+async def diff_etag(project_path: str, files: List[str], rev_from: Optional[str], rev_to: Optional[str], query: DiffQuery) -> str:
+    """Same disk state and same question, same answer: lets a polling DiffView get 304s."""
+    etag, _ = await run_in_threadpool(wg.status_etag, project_path, files)
+    return wg.make_etag(etag, tuple(files), rev_from, rev_to, query.key())
+
+async def compute_diff(project_path: str, files: List[str], rev_from: Optional[str], rev_to: Optional[str],
+                       query: DiffQuery, etag: str):
+    return await coalesce(
+        "diff", project_path, etag, (tuple(files), rev_from, rev_to) + query.key(),
+        lambda: _compute_diff(project_path, files, rev_from, rev_to, query)
+    )
+
+async def _compute_diff(project_path: str, files: List[str], rev_from: Optional[str], rev_to: Optional[str], query: DiffQuery):
+    if query.format == "json":
+        results = await wg.handle_paragraph_diff_async(project_path, files, rev_from, rev_to)
+        # Hunk ranges apply to each file's own hunks
+        if query.summary:
+            results = [await run_in_threadpool(wg.summarize_paragraph_page, result) for result in results]
+        else:
+            results = [
+                await run_in_threadpool(wg.page_paragraph_diff, result, query.hunk_start, query.hunk_limit, DIFF_MAX_BYTES)
+                for result in results
+            ]
+        if len(files) == 1:
+            return results[0] if results else {"path": files[0], "hunks": [], "stats": None, "total_hunks": 0}
+        return {"files": results}
+    # Text hunks are numbered across all files, in order
+    page = await wg.handle_diff_page_async(
+        project_path, files, rev_from, rev_to,
+        query.hunk_start, 0 if query.summary else query.hunk_limit, DIFF_MAX_BYTES
+    )
+    if query.summary:
+        del page["diff"], page["hunk_start"], page["hunk_count"], page["truncated"]
+    return page
+
+async def diff_response(request: Request, project_path: str, files: List[str], rev_from: Optional[str],
+                        rev_to: Optional[str], query: DiffQuery, if_none_match: Optional[str]):
+    etag = await diff_etag(project_path, files, rev_from, rev_to, query)
+    cached = not_modified(etag, if_none_match)
+    if cached:
+        return cached
+    result = await cancel_on_disconnect(request, compute_diff(project_path, files, rev_from, rev_to, query, etag))
+    if isinstance(result, Response):
+        return result
+    return JSONResponse(result, headers={"ETag": etag, "Cache-Control": "no-cache"})
+
+@app.get("/api/diff/{file_name:path}")
+async def get_diff(
+    file_name: str,
+    project_path: str,
+    request: Request,
+    format: str = Query("text", pattern="^(text|json)$"),
+    summary: bool = False,
+    hunk_start: int = Query(0, ge=0),
+    hunk_limit: Optional[int] = Query(None, ge=1, le=1000),
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    Get diff for a specific file (format=json: paragraph hunks with word-level ranges).
+    summary=true returns only hunk counts and sizes; hunk_start / hunk_limit select a
+    range of hunks. Responses are capped at WG_DIFF_MAX_BYTES ('truncated' is then set).
+    """
+    query = DiffQuery(format=format, summary=summary, hunk_start=hunk_start, hunk_limit=hunk_limit)
+    async with reading(project_path):
+        try:
+            return await diff_response(request, project_path, [file_name], None, None, query, if_none_match)
+        except wg.CommandTimeoutError as e:
+            raise timeout_error(e)
+        except Exception as e:
+            print(f"Error in /api/diff: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/diff")
+async def get_revision_diff(
+    project_path: str,
+    request: Request,
+    files: Optional[List[str]] = Query(None),
+    rev_from: Optional[str] = Query(None, alias="from"),
+    rev_to: Optional[str] = Query(None, alias="to"),
+    format: str = Query("text", pattern="^(text|json)$"),
+    summary: bool = False,
+    hunk_start: int = Query(0, ge=0),
+    hunk_limit: Optional[int] = Query(None, ge=1, le=1000),
+    if_none_match: Optional[str] = Header(None),
+):
+    """
+    Diff between two revisions. 'from'/'to' take any commit-ish or INDEX / WORKTREE;
+    'to' defaults to the worktree and 'from' to the index. summary / hunk_start /
+    hunk_limit work as for a single file.
+    """
+    query = DiffQuery(format=format, summary=summary, hunk_start=hunk_start, hunk_limit=hunk_limit)
+    async with reading(project_path):
+        try:
+            # Unknown revisions are a client error, checked before any work is done
+            rev_from, rev_to = await run_in_threadpool(wg.resolve_revisions, project_path, rev_from, rev_to)
+            return await diff_response(request, project_path, files or [], rev_from, rev_to, query, if_none_match)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except wg.CommandTimeoutError as e:
+            raise timeout_error(e)
+        except Exception as e:
+            print(f"Error in /api/diff: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+
 @app.post("/api/commit")
 async def do_commit(req: CommitRequest, project_path: str):
     """Commit changes to a project."""
-    try:
-        success = await run_in_threadpool(
-            wg.handle_commit, 
-            project_path, 
-            req.message, 
-            req.files
-        )
-        if not success:
-             return {"success": False, "message": "No changes to commit"}
-        return {"success": True}
-    except Exception as e:
-        print(f"Error in /api/commit: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    async with writing(project_path):
+        try:
+            success = await run_exclusive(
+                wg.handle_commit, 
+                project_path, 
+                req.message, 
+                req.files
+            )
+            if not success:
+                 return {"success": False, "message": "No changes to commit"}
+            stats_backfill.request(project_path)
+            asyncio.ensure_future(prerender.request_commit(project_path, wg.read_head_sha(project_path)))
+            return {"success": True}
+        except Exception as e:
+            print(f"Error in /api/commit: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/log", response_model=List[LogEntry])
-async def get_log(project_path: str, files: Optional[List[str]] = Query(None)):
-    """Get commit log for a project."""
-    try:
-        logs = await run_in_threadpool(
-            wg.handle_log, 
-            project_path, 
-            files or []
-        )
-        return logs
-    except Exception as e:
-        print(f"Error in /api/log: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+async def get_log(
+    project_path: str,
+    request: Request,
+    response: Response,
+    files: Optional[List[str]] = Query(None),
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+):
+    """Get commit log for a project (paginated; next page cursor in X-Next-Cursor)."""
+    async with reading(project_path):
+        try:
+            etag, _ = await run_in_threadpool(wg.status_etag, project_path, files or [])
+            result = await cancel_on_disconnect(
+                request,
+                coalesce("log", project_path, etag, (tuple(files or ()), cursor, limit),
+                         lambda: wg.query_log_async(project_path, files or [], cursor, limit))
+            )
+            if isinstance(result, Response):
+                return result
+            logs, next_cursor = result
+            if next_cursor:
+                response.headers["X-Next-Cursor"] = next_cursor
+            return logs
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except wg.CommandTimeoutError as e:
+            raise timeout_error(e)
+        except Exception as e:
+            print(f"Error in /api/log: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/search")
+async def search_history(
+    project_path: str,
+    q: str = Query(..., min_length=1),
+    limit: int = Query(50, ge=1, le=500),
+):
+    """
+    Full-text search over every committed version of every document. Only the
+    existing index is queried; commits not indexed yet are queued for the
+    background indexer and counted in X-Search-Pending.
+    """
+    async with reading(project_path):
+        try:
+            results = await run_in_threadpool(wg.handle_search, project_path, q, limit)
+            pending = await run_in_threadpool(wg.search_index_pending, project_path)
+        except Exception as e:
+            print(f"Error in /api/search: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+    if pending:
+        stats_backfill.request(project_path)
+    return JSONResponse(results, headers={"X-Search-Pending": str(pending)})
 
 @app.post("/api/restore")
 async def do_restore(req: RestoreRequest, project_path: str):
     """Restore a file to a previous version."""
+    async with reading(project_path):
+        try:
+            restored_path = await run_in_threadpool(
+                wg.handle_restore, 
+                project_path, 
+                req.commit_id, 
+                req.file_name
+            )
+            return {"success": True, "restored_path": restored_path}
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+def attachment_headers(filename: str) -> dict:
+    # RFC 6266 / 5987: ASCII fallback plus the UTF-8 name for Chinese file names
+    fallback = filename.encode("ascii", "replace").decode("ascii").replace("?", "_").replace('"', "_")
+    return {"Content-Disposition": f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename)}"}
+
+@app.get("/api/download/{file_name:path}")
+async def download_version(file_name: str, project_path: str, commit_id: str):
+    """Stream one historical version of a document (no copy written to disk)."""
+    async with reading(project_path):
+        try:
+            prepared = await run_in_threadpool(wg.prepare_blob_download, project_path, commit_id, file_name)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            print(f"Error in /api/download: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+    if prepared is None:
+        raise HTTPException(status_code=404, detail=f"{file_name} not found in {commit_id}")
+    command, size = prepared
+    stem = Path(file_name).stem
+    headers = attachment_headers(f"{stem}_v{commit_id[:7]}.docx")
+    if size is not None:
+        headers["Content-Length"] = str(size)
+    return StreamingResponse(
+        wg.stream_command_async(command, cwd=project_path),
+        media_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        headers=headers
+    )
+
+@app.get("/api/download-zip")
+async def download_snapshot(project_path: str, commit_id: str, files: Optional[List[str]] = Query(None)):
+    """Stream a zip of every .docx (or the given files) at a commit, built by git archive."""
+    async with reading(project_path):
+        try:
+            prepared = await run_in_threadpool(wg.prepare_archive_download, project_path, commit_id, files)
+        except Exception as e:
+            print(f"Error in /api/download-zip: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+    if prepared is None:
+        raise HTTPException(status_code=404, detail=f"No .docx files found in {commit_id}")
+    command, paths = prepared
+    headers = attachment_headers(f"{Path(project_path).name}_v{commit_id[:7]}.zip")
+    headers["X-File-Count"] = str(len(paths))
+    return StreamingResponse(
+        wg.stream_command_async(command, cwd=project_path),
+        media_type="application/zip",
+        headers=headers
+    )
+
+# Document content is untrusted: no scripts, no plugins, nothing but same-origin images
+PREVIEW_SECURITY_HEADERS = {
+    "X-Content-Type-Options": "nosniff",
+    "Content-Security-Policy": "sandbox; default-src 'none'; img-src 'self'; style-src 'unsafe-inline'",
+}
+
+@app.get("/api/preview-images/{key}")
+async def get_preview_image(key: str, project_path: str):
+    """An image extracted by a preview, addressed by content hash (immutable)."""
+    found = await run_in_threadpool(wg.read_preview_image, project_path, key)
+    if found is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    data, content_type = found
+    return Response(
+        data,
+        media_type=content_type,
+        headers={"Cache-Control": "public, max-age=31536000, immutable", "ETag": f'"{key}"', **PREVIEW_SECURITY_HEADERS}
+    )
+
+@app.get("/api/preview/{file_name:path}", response_class=HTMLResponse)
+async def preview_version(
+    file_name: str,
+    project_path: str,
+    commit_id: str,
+    request: Request,
+    if_none_match: Optional[str] = Header(None),
+):
+    """HTML rendering of one historical version, cached by blob SHA."""
+    async with reading(project_path):
+        try:
+            blob_sha = await run_in_threadpool(wg.resolve_preview, project_path, commit_id, file_name)
+            if blob_sha is None:
+                raise HTTPException(status_code=404, detail=f"{file_name} not found in {commit_id}")
+            etag = f'"{wg.preview_cache_key(blob_sha)}"'
+            cached = not_modified(etag, if_none_match)
+            if cached:
+                return cached
+            body = await cancel_on_disconnect(
+                request,
+                coalesce("preview", project_path, blob_sha, (),
+                         lambda: run_in_threadpool(wg.get_preview, project_path, blob_sha))
+            )
+            if isinstance(body, Response):
+                return body
+        except HTTPException:
+            raise
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except wg.CommandTimeoutError as e:
+            raise timeout_error(e)
+        except Exception as e:
+            print(f"Error in /api/preview: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+
+    image_base = f"/api/preview-images/{{}}?project_path={quote(project_path)}"
+    page = wg.render_preview_page(body, f"{file_name} @ {commit_id[:7]}", image_base.format)
+    return HTMLResponse(page, headers={"ETag": etag, "Cache-Control": "no-cache", **PREVIEW_SECURITY_HEADERS})
+
+@app.get("/api/preview-queue")
+async def get_prerender_queue():
+    """Pre-render queue: versions waiting, rendered and failed since startup."""
+    return prerender.snapshot()
+
+# --- Snapshots (V5.24) ---
+
+class SnapshotRequest(BaseModel):
+    message: Optional[str] = None
+
+class PromoteRequest(BaseModel):
+    snapshot_id: str
+    message: str
+
+@app.get("/api/snapshots")
+async def get_snapshots(project_path: str, limit: int = Query(50, ge=1, le=1000)):
+    """Recent auto snapshots (refs/wg/snapshots), newest first."""
     try:
-        restored_path = await run_in_threadpool(
-            wg.handle_restore, 
-            project_path, 
-            req.commit_id, 
-            req.file_name
-        )
-        return {"success": True, "restored_path": restored_path}
+        snapshots = await run_in_threadpool(wg.list_snapshots, project_path, limit)
+        # The watcher may live in another worker; the git config is the shared truth (V5.25)
+        auto = await run_in_threadpool(wg.is_auto_snapshot_enabled, project_path)
+        return {"auto": auto, "last": snapshotter.last.get(project_path), "snapshots": snapshots}
     except Exception as e:
+        print(f"Error in /api/snapshots: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/snapshots")
+async def create_snapshot(project_path: str, req: Optional[SnapshotRequest] = None):
+    """Record a snapshot now (no-op when nothing changed since the last one)."""
+    async with reading(project_path):
+        try:
+            snapshot = await run_in_threadpool(wg.take_snapshot, project_path, req.message if req else None)
+            return {"snapshot": snapshot}
+        except Exception as e:
+            print(f"Error in /api/snapshots: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+
+@app.put("/api/snapshots/auto")
+async def set_auto_snapshot(project_path: str, enabled: bool):
+    """Turn auto snapshots on or off (stored in the project's git config)."""
+    try:
+        await run_in_threadpool(wg.set_auto_snapshot, project_path, enabled)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if enabled:
+        await snapshotter.enable(project_path)
+    else:
+        await snapshotter.disable(project_path)
+    return {"auto": enabled}
+
+@app.post("/api/snapshots/promote")
+async def promote_snapshot(req: PromoteRequest, project_path: str):
+    """Turn a snapshot into a real commit on the current branch (worktree untouched)."""
+    async with writing(project_path):
+        try:
+            sha = await run_exclusive(wg.promote_snapshot, project_path, req.snapshot_id, req.message)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            print(f"Error in /api/snapshots/promote: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+    if not sha:
+        return {"success": False, "message": "Snapshot matches the current commit"}
+    stats_backfill.request(project_path)
+    asyncio.ensure_future(prerender.request_commit(project_path, sha))
+    return {"success": True, "id": sha[:7]}
+
 class ResetRequest(BaseModel):
     commit_id: str
 
 @app.post("/api/reset")
 async def do_reset(req: ResetRequest, project_path: str):
     """Reset project to a specific commit (Hard Reset)."""
-    try:
-        await run_in_threadpool(
-            wg.handle_reset, 
-            project_path, 
-            req.commit_id
-        )
-        return {"success": True}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    async with writing(project_path):
+        try:
+            await run_exclusive(
+                wg.handle_reset, 
+                project_path, 
+                req.commit_id
+            )
+            return {"success": True}
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/revert")
 async def do_revert(req: ResetRequest, project_path: str): # Reusing ResetRequest as it only needs commit_id
     """Revert a specific commit."""
+    async with writing(project_path):
+        try:
+            await run_exclusive(
+                wg.handle_revert_commit, 
+                project_path, 
+                req.commit_id
+            )
+            return {"success": True}
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+class ImportRequest(BaseModel):
+    source_dir: Optional[str] = None # Defaults to the project itself
+    order: str = "mtime" # "mtime" or "name"
+    dry_run: bool = False
+
+@app.post("/api/import")
+async def do_import(req: ImportRequest, project_path: str):
+    """Import piles of versioned files (v1 / v2 / 终稿) as history, in one git fast-import run."""
+    async with writing(project_path):
+        try:
+            report = await run_exclusive(
+                wg.handle_import,
+                project_path,
+                req.source_dir,
+                req.order,
+                req.dry_run
+            )
+            if not req.dry_run:
+                stats_backfill.request(project_path)
+            return report
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            print(f"Error in /api/import: {e}")
+            raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/stats/backfill")
+async def get_stats_backfill():
+    """Commit statistics backfill: project in progress, queue, last report per project."""
+    return stats_backfill.snapshot()
+
+@app.post("/api/stats/backfill")
+async def request_stats_backfill(project_path: str):
+    """Queue a project for commit statistics backfill."""
     try:
-        await run_in_threadpool(
-            wg.handle_revert_commit, 
-            project_path, 
-            req.commit_id
-        )
-        return {"success": True}
+        wg.check_init_status(project_path)
+    except RuntimeError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    stats_backfill.request(project_path)
+    return {"queued": True}
+
+@app.get("/api/scheduler")
+async def get_scheduler_stats():
+    """Per-project lock state and queue-wait times."""
+    return {path: scheduler.snapshot() for path, scheduler in schedulers.items()}
+
+@app.get("/api/worker")
+async def get_worker_role():
+    """Which worker served this request and whether it runs the background work."""
+    return worker_role.snapshot()
+
+@app.get("/api/maintenance")
+async def get_maintenance_reports():
+    """Last maintenance pass per project: tasks run, object counts before/after, gains."""
+    return maintenance.reports
+
+@app.post("/api/maintenance")
+async def run_maintenance_now(project_path: str):
+    """Run due maintenance for one project now, regardless of idle time."""
+    try:
+        report = await maintenance.maintain(project_path, force=True)
+        return report or {"tasks": [], "message": "Nothing to do"}
     except Exception as e:
+        print(f"Error in /api/maintenance: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+def gauge_lines(name: str, help_text: str, samples: dict) -> List[str]:
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+    for labels, value in samples.items():
+        label_text = ",".join(f'{k}="{wg._escape_label(v)}"' for k, v in labels)
+        lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+    return lines
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus text format: subprocess / operation / request histograms plus queue gauges."""
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    limiter_stats = limiter.statistics()
+    # asyncio.to_thread (async read paths) runs on the loop's default executor
+    executor = getattr(asyncio.get_running_loop(), "_default_executor", None)
+    executor_queue = executor._work_queue.qsize() if executor is not None else 0
+    lines = []
+    lines += gauge_lines("wg_threadpool_size", "Worker threads available.", {
+        (("pool", "anyio"),): limiter.total_tokens,
+    })
+    lines += gauge_lines("wg_threadpool_busy", "Worker threads currently running a task.", {
+        (("pool", "anyio"),): limiter_stats.borrowed_tokens,
+    })
+    lines += gauge_lines("wg_threadpool_queue_depth", "Tasks waiting for a worker thread.", {
+        (("pool", "anyio"),): limiter_stats.tasks_waiting,
+        (("pool", "asyncio"),): executor_queue,
+    })
+    lines += gauge_lines("wg_scheduler_queued", "Requests waiting for a project lock.", {
+        (("project", path),): scheduler.queued for path, scheduler in schedulers.items()
+    })
+    lines += gauge_lines("wg_coalesced_inflight", "Shared computations currently running.", {
+        (): len(single_flight.inflight),
+    })
+    return PlainTextResponse(
+        wg.render_metrics(lines),
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+@app.get("/api/coalescing")
+async def get_coalescing_stats():
+    """How many status/log/diff requests shared an in-flight computation."""
+    return single_flight.snapshot()
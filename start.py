@@ -1,6 +1,7 @@
 import uvicorn
 import webbrowser
 import threading
+import argparse
 import time
 import os
 import sys
@@ -11,13 +12,20 @@ def open_browser():
     webbrowser.open("http://localhost:8000")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Start the GituDoc server")
+    # Workers share the project list and caches through wg-state.db (V5.25)
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WG_WORKERS", 1)),
+                        help="Number of server processes (default 1, or WG_WORKERS)")
+    parser.add_argument("--no-browser", action="store_true", help="Do not open a browser window")
+    args = parser.parse_args()
+
     print("Starting GituDoc Server...")
-    print("Please wait, browser will open automatically...")
-    
-    # Start browser in a separate thread
-    threading.Thread(target=open_browser, daemon=True).start()
-    
+    if not args.no_browser:
+        print("Please wait, browser will open automatically...")
+        # Start browser in a separate thread
+        threading.Thread(target=open_browser, daemon=True).start()
+
     # Run the server
     # We use 'main:app' assuming this script is in the same dir as main.py
     # reload=False for production/server mode
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=False)
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=False, workers=max(1, args.workers))
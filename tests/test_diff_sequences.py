@@ -0,0 +1,69 @@
+"""diff_sequences: 最短 diff 的正确性, 以及重排文档时的代价上限。"""
+
+import sys
+import time
+import random
+import difflib
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import wg
+
+PARAGRAPHS = 10000
+
+def apply_opcodes(a, b, opcodes):
+    """opcodes 必须首尾相接地覆盖两侧, equal 段两侧相同"""
+    i = j = 0
+    for tag, i1, i2, j1, j2 in opcodes:
+        assert (i1, j1) == (i, j)
+        if tag == "equal":
+            assert a[i1:i2] == b[j1:j2]
+        i, j = i2, j2
+    assert (i, j) == (len(a), len(b))
+
+def equal_count(opcodes):
+    return sum(i2 - i1 for tag, i1, i2, _, _ in opcodes if tag == "equal")
+
+@pytest.fixture
+def search_steps(monkeypatch):
+    """累计 _middle_snake 报告的搜索步数"""
+    steps = []
+    original = wg._middle_snake
+
+    def counting(*args):
+        snake, cost = original(*args)
+        steps.append(cost)
+        return snake, cost
+
+    monkeypatch.setattr(wg, "_middle_snake", counting)
+    return steps
+
+def test_small_edits_stay_minimal():
+    rng = random.Random(7)
+    for _ in range(300):
+        a = [rng.randrange(6) for _ in range(rng.randrange(40))]
+        b = [rng.randrange(6) for _ in range(rng.randrange(40))]
+        opcodes = wg.diff_sequences(a, b)
+        apply_opcodes(a, b, opcodes)
+        # Myers finds a longest common subsequence; difflib's is never longer
+        matcher = difflib.SequenceMatcher(None, a, b, autojunk=False)
+        assert equal_count(opcodes) >= sum(block.size for block in matcher.get_matching_blocks())
+
+@pytest.mark.parametrize("name", ["swap_halves", "reverse"])
+def test_reordered_document_is_bounded(name, search_steps):
+    a = [f"段落 {i}" for i in range(PARAGRAPHS)]
+    b = a[PARAGRAPHS // 2:] + a[:PARAGRAPHS // 2] if name == "swap_halves" else a[::-1]
+    started = time.perf_counter()
+    opcodes = wg.diff_sequences(a, b)
+    elapsed = time.perf_counter() - started
+
+    apply_opcodes(a, b, opcodes)
+    budget = max(wg.DIFF_COST_MIN, wg.DIFF_COST_PER_ITEM * 2 * PARAGRAPHS)
+    # The last search may overshoot by one round of diagonals
+    assert sum(search_steps) <= budget + 2 * (PARAGRAPHS + 1)
+    assert elapsed < 5 # Unbounded Myers took 15 s (swap) and 60 s (reverse)
+    if name == "swap_halves":
+        assert equal_count(opcodes) == PARAGRAPHS // 2 # One half kept, the other moved
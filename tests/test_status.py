@@ -0,0 +1,57 @@
+"""handle_status: 文件名含空格 / 非 ASCII 字符时的状态。"""
+
+import sys
+import asyncio
+import subprocess
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import wg
+
+def git(project, *args):
+    subprocess.run(["git", *args], cwd=project, check=True, capture_output=True)
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    for name in ("AUTHOR", "COMMITTER"):
+        monkeypatch.setenv(f"GIT_{name}_NAME", "wg test")
+        monkeypatch.setenv(f"GIT_{name}_EMAIL", "wg@example.com")
+    wg.handle_init(str(tmp_path))
+    (tmp_path / "My Doc.docx").write_bytes(b"v1")
+    (tmp_path / "plain.docx").write_bytes(b"v1")
+    (tmp_path / "sub dir").mkdir()
+    (tmp_path / "sub dir" / "合同 v1.docx").write_bytes(b"v1")
+    return tmp_path
+
+def by_path(status_list):
+    return {item["path"]: item["status"] for item in status_list}
+
+def test_untracked_files_with_spaces(project):
+    assert by_path(wg.handle_status(str(project))) == {
+        "My Doc.docx": "??",
+        "plain.docx": "??",
+        "sub dir/合同 v1.docx": "??",
+    }
+
+def test_modified_file_with_spaces(project):
+    git(project, "add", "-A")
+    git(project, "commit", "-q", "-m", "base")
+    (project / "My Doc.docx").write_bytes(b"v2")
+    (project / "sub dir" / "合同 v1.docx").write_bytes(b"v2")
+    (project / "new file.docx").write_bytes(b"v1")
+
+    expected = {"My Doc.docx": "M", "sub dir/合同 v1.docx": "M", "new file.docx": "??"}
+    assert by_path(wg.handle_status(str(project))) == expected
+    wg._status_cache.clear()
+    assert by_path(asyncio.run(wg.handle_status_async(str(project)))) == expected
+
+def test_renamed_file_with_spaces(project):
+    git(project, "add", "-A")
+    git(project, "commit", "-q", "-m", "base")
+    git(project, "mv", "My Doc.docx", "Your Doc.docx")
+    # Both sides in the pathspec: git reports a rename, the old path as a second -z record
+    files = ["My Doc.docx", "Your Doc.docx"]
+    assert by_path(wg.handle_status(str(project), files)) == {"My Doc.docx -> Your Doc.docx": "R"}
@@ -8,6 +8,7 @@ const apiClient = axios.create({ baseURL: 'http://localhost:8000/api' });
 export const useProjectsStore = defineStore('projects', () => {
     // --- State ---
     const projects = ref([]); // List of project paths
+    const projectSummaries = ref({}); // path -> summary from /api/projects/summary
     const activeProject = ref(null); // Currently selected project path
 
     const changedFiles = ref([]); // List of changed files in active project
@@ -16,6 +17,7 @@ export const useProjectsStore = defineStore('projects', () => {
     const stagedFiles = ref([]);   // Files selected for commit (currently we stage all or specific, let's keep it simple)
 
     const commits = ref([]); // Commit history
+    const diffRange = ref(null); // { from, to } when comparing two revisions instead of the worktree
 
     // --- Getters ---
     const hasActiveProject = computed(() => activeProject.value !== null);
@@ -30,6 +32,30 @@ export const useProjectsStore = defineStore('projects', () => {
         }
     }
 
+    async function fetchProjectSummaries() {
+        // NDJSON stream: each project's line arrives as soon as it is done
+        try {
+            const res = await fetch(`${apiClient.defaults.baseURL}/projects/summary`);
+            const reader = res.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                const lines = buffer.split('\n');
+                buffer = lines.pop();
+                for (const line of lines) {
+                    if (!line) continue;
+                    const summary = JSON.parse(line);
+                    projectSummaries.value = { ...projectSummaries.value, [summary.path]: summary };
+                }
+            }
+        } catch (error) {
+            console.error("Failed to fetch project summaries:", error);
+        }
+    }
+
     async function addProject(path) {
         try {
             await apiClient.post('/projects', { path });
@@ -57,6 +83,7 @@ export const useProjectsStore = defineStore('projects', () => {
         selectedFile.value = null;
         stagedFiles.value = [];
         commits.value = [];
+        diffRange.value = null;
 
         // Ensure project is initialized (idempotent check)
         try {
@@ -79,11 +106,22 @@ export const useProjectsStore = defineStore('projects', () => {
 
     async function selectFile(path) {
         selectedFile.value = path;
+        diffRange.value = null;
         await fetchLog();
     }
 
+    function compareCommit(commitId) {
+        // Show what this commit changed in the selected file (parent -> commit)
+        diffRange.value = { from: `${commitId}^`, to: commitId };
+    }
+
+    function clearDiffRange() {
+        diffRange.value = null;
+    }
+
     // --- Polling Actions ---
     let pollingInterval = null;
+    let eventSource = null;
 
     async function fetchStatus() {
         if (!activeProject.value) return;
@@ -170,7 +208,60 @@ export const useProjectsStore = defineStore('projects', () => {
         await fetchStatus();
     }
 
-    function startPollingStatus() {
+    function downloadUrl(commitId, fileName) {
+        // Streamed straight from git by the backend; used as a plain link so the browser saves it
+        const params = new URLSearchParams({ project_path: activeProject.value, commit_id: commitId });
+        if (fileName) {
+            const path = fileName.split('/').map(encodeURIComponent).join('/');
+            return `${apiClient.defaults.baseURL}/download/${path}?${params}`;
+        }
+        return `${apiClient.defaults.baseURL}/download-zip?${params}`;
+    }
+
+    function previewUrl(commitId, fileName) {
+        // Server-rendered HTML of that version, opened in a new tab
+        const params = new URLSearchParams({ project_path: activeProject.value, commit_id: commitId });
+        const path = fileName.split('/').map(encodeURIComponent).join('/');
+        return `${apiClient.defaults.baseURL}/preview/${path}?${params}`;
+    }
+
+    function applyLogEvent(data) {
+        // The event stream carries the unfiltered history; per-file views refetch
+        if (selectedFile.value) {
+            fetchLog();
+        } else if (data.mode === 'prepend') {
+            commits.value = [...data.commits, ...commits.value];
+        } else {
+            commits.value = data.commits;
+        }
+    }
+
+    function startEventStream() {
+        // Push updates from /api/events; returns false if the browser can't do SSE
+        if (typeof EventSource === 'undefined') return false;
+        const url = `${apiClient.defaults.baseURL}/events?project_path=${encodeURIComponent(activeProject.value)}`;
+        let opened = false;
+        eventSource = new EventSource(url);
+        eventSource.onopen = () => { opened = true; };
+        eventSource.addEventListener('status', (e) => { changedFiles.value = JSON.parse(e.data); });
+        eventSource.addEventListener('files', (e) => { allFiles.value = JSON.parse(e.data); });
+        eventSource.addEventListener('log', (e) => applyLogEvent(JSON.parse(e.data)));
+        eventSource.onerror = () => {
+            // EventSource reconnects by itself once it has worked; if it never opened, poll instead
+            if (!opened) {
+                stopEventStream();
+                startIntervalPolling();
+            }
+        };
+        return true;
+    }
+
+    function stopEventStream() {
+        if (eventSource) eventSource.close();
+        eventSource = null;
+    }
+
+    function startIntervalPolling() {
         if (pollingInterval) clearInterval(pollingInterval);
         fetchStatus(); // Immediate fetch
         fetchFiles(); // Fetch all files
@@ -181,14 +272,21 @@ export const useProjectsStore = defineStore('projects', () => {
         }, 2000);
     }
 
+    function startPollingStatus() {
+        stopPollingStatus();
+        if (!startEventStream()) startIntervalPolling();
+    }
+
     function stopPollingStatus() {
+        stopEventStream();
         if (pollingInterval) clearInterval(pollingInterval);
+        pollingInterval = null;
     }
 
     return {
-        projects, activeProject, changedFiles, allFiles, selectedFile, stagedFiles, commits,
+        projects, projectSummaries, activeProject, changedFiles, allFiles, selectedFile, stagedFiles, commits, diffRange,
         hasActiveProject,
-        fetchProjects, addProject, removeProject, selectProject, deselectProject, fetchStatus, fetchFiles, fetchLog, selectFile,
-        resetToCommit, revertCommit, restoreFile
+        fetchProjects, fetchProjectSummaries, addProject, removeProject, selectProject, deselectProject, fetchStatus, fetchFiles, fetchLog, selectFile,
+        resetToCommit, revertCommit, restoreFile, downloadUrl, previewUrl, compareCommit, clearDiffRange
     };
 });
@@ -1,17 +1,238 @@
 #!/usr/bin/env python3
 
+import os
 import sys
+import asyncio
+import io
+import re
+import html
+import json
+import time
+import ctypes
+import ctypes.util
+import select
+import shutil
+import struct
+import inspect
+import functools
+import contextlib
+import contextvars
+import bisect
+import threading
+import difflib
+import hashlib
+import zlib
+import sqlite3
+import zipfile
+import posixpath
+import tempfile
 import subprocess
+import concurrent.futures
+import atexit
 import argparse
+import xml.etree.ElementTree as ET
 from pathlib import Path
 
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+    import msvcrt
+
 # --- V4.7 架构 (Web API Ready) ---
 # 1. 重构为库模式: 所有 handle_* 函数接受 project_path
 # 2. 返回数据而非打印: 供 API 调用
 # 3. 异常处理: 抛出异常而非 sys.exit
 
-def run_command(command, capture_output=False, check=True, shell=False, cwd=None, **kwargs):
-    """(V3.1 修复) 一个通用的、健壮的子进程运行器"""
+# --- (V5.19 新增) 运行指标 ---
+# Process-wide Prometheus-style metrics, kept dependency free. Every subprocess is
+# timed and labelled with the wg operation that started it (set by @timed_operation)
+# and the command it ran; render_metrics() produces the text exposition format.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+_current_operation = contextvars.ContextVar("wg_operation", default=None)
+_metrics = {}
+_slow_log = {"threshold": None, "path": None}
+_slow_log_lock = threading.Lock()
+
+class Histogram:
+    """(V5.19 新增) 带标签的累积直方图"""
+
+    def __init__(self, name, help_text, labelnames, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self.series = {} # labels -> [bucket counts..., +Inf count, sum]
+        self.lock = threading.Lock()
+        _metrics[name] = self
+
+    def observe(self, labels, value):
+        with self.lock:
+            series = self.series.get(labels)
+            if series is None:
+                series = self.series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            items = sorted(self.series.items())
+        for labels, series in items:
+            base = ",".join(f'{k}="{_escape_label(v)}"' for k, v in zip(self.labelnames, labels))
+            sep = "," if base else ""
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{base}{sep}le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{base}{sep}le="+Inf"}} {series[len(self.buckets)]}')
+            lines.append(f"{self.name}_sum{{{base}}} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{{{base}}} {series[len(self.buckets)]}")
+        return lines
+
+class Counter:
+    """(V5.19 新增) 带标签的计数器"""
+
+    def __init__(self, name, help_text, labelnames):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.series = {}
+        self.lock = threading.Lock()
+        _metrics[name] = self
+
+    def inc(self, labels, amount=1):
+        with self.lock:
+            self.series[labels] = self.series.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            items = sorted(self.series.items())
+        for labels, value in items:
+            base = ",".join(f'{k}="{_escape_label(v)}"' for k, v in zip(self.labelnames, labels))
+            lines.append(f"{self.name}{{{base}}} {value}")
+        return lines
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+SUBPROCESS_SECONDS = Histogram("wg_subprocess_seconds", "Wall time of git/pandoc subprocesses.", ("op", "command"))
+SUBPROCESS_FAILURES = Counter("wg_subprocess_failures_total", "Subprocesses that failed or timed out.", ("op", "command"))
+OPERATION_SECONDS = Histogram("wg_operation_seconds", "Wall time of wg operations.", ("op",))
+EXTRACTION_FAILURES = Counter("wg_extraction_failures_total", "Blobs whose text could not be extracted.", ("op",))
+
+def render_metrics(extra_lines=()):
+    """(V5.19 新增) Prometheus 文本格式"""
+    lines = []
+    for metric in list(_metrics.values()):
+        lines.extend(metric.render())
+    lines.extend(extra_lines)
+    return "\n".join(lines) + "\n"
+
+def configure_slow_log(threshold, path=None):
+    """(V5.19 新增) 超过 threshold 秒的子进程写入慢操作日志 (JSON 行; path 为空则打印到 stderr)"""
+    _slow_log["threshold"] = threshold
+    _slow_log["path"] = path
+
+def _command_label(command):
+    if isinstance(command, str):
+        command = command.split()
+    for i, part in enumerate(command):
+        name = Path(str(part)).name.lower()
+        if name in ("git", "git.exe"):
+            args = iter(command[i + 1:])
+            for arg in args:
+                if arg in ("-c", "-C"):
+                    next(args, None) # Global option with a separate value
+                elif not str(arg).startswith("-"):
+                    return f"git {arg}"
+            return "git"
+        if name in ("pandoc", "pandoc.exe"):
+            return "pandoc"
+    return Path(str(command[0])).name if command else "?"
+
+def record_subprocess(command, cwd, seconds, failed):
+    """(V5.19 新增) 记录一次子进程执行; run_command / run_command_async / cat-file 进程池调用"""
+    op = _current_operation.get() or "other"
+    label = _command_label(command)
+    SUBPROCESS_SECONDS.observe((op, label), seconds)
+    if failed:
+        SUBPROCESS_FAILURES.inc((op, label))
+    threshold = _slow_log["threshold"]
+    if threshold is not None and seconds >= threshold:
+        _write_op_log({
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "op": op,
+            "seconds": round(seconds, 3),
+            "project": str(cwd) if cwd else None,
+            "command": [str(c) for c in command] if not isinstance(command, str) else command,
+            "failed": failed,
+        })
+
+def _write_op_log(entry):
+    """慢操作日志的一行 JSON (配置了文件则追加到文件, 否则写到 stderr)"""
+    line = json.dumps(entry, ensure_ascii=False)
+    with _slow_log_lock:
+        if _slow_log["path"]:
+            with open(_slow_log["path"], "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        else:
+            print(f"[slow-op] {line}", file=sys.stderr)
+
+def record_extraction_failure(project_path, blob_sha, error):
+    """(V5.16 修复) 无法提取文本的 blob: 计入 wg_extraction_failures_total 并写入慢操作日志"""
+    op = _current_operation.get() or "other"
+    EXTRACTION_FAILURES.inc((op,))
+    _write_op_log({
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "op": op,
+        "event": "extraction-failed",
+        "project": str(project_path),
+        "blob": blob_sha,
+        "error": str(error),
+    })
+
+def timed_operation(op):
+    """
+    (V5.19 新增)
+    装饰 handle_* 函数: 记录总耗时, 并把 op 作为其中所有子进程的标签。
+    嵌套调用时保留最外层的 op。
+    """
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                token = _current_operation.set(_current_operation.get() or op)
+                started = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    OPERATION_SECONDS.observe((op,), time.perf_counter() - started)
+                    _current_operation.reset(token)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            token = _current_operation.set(_current_operation.get() or op)
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                OPERATION_SECONDS.observe((op,), time.perf_counter() - started)
+                _current_operation.reset(token)
+        return wrapper
+    return decorator
+
+def run_command(command, capture_output=False, check=True, shell=False, cwd=None, text=True, **kwargs):
+    """
+    (V3.1 修复) 一个通用的、健壮的子进程运行器
+    (V5.4) text=False 时以 bytes 形式返回输出 (用于读取 .docx blob)
+    (V5.19) 每次执行都计入 wg_subprocess_seconds
+    """
+    started = time.perf_counter()
+    failed = True
     try:
         # Pager logic (git log/diff) only applies when running as CLI script and not capturing output
         is_pager_command = (
@@ -25,30 +246,37 @@ def run_command(command, capture_output=False, check=True, shell=False, cwd=None
             process.wait() 
             if check and process.returncode != 0:
                 raise subprocess.CalledProcessError(process.returncode, command)
+            failed = process.returncode != 0
             return process
         
         result = subprocess.run(
             command,
             check=check,
-            text=True,
+            text=text,
             capture_output=capture_output,
             shell=shell,
             cwd=cwd,
             **kwargs
         )
+        failed = result.returncode != 0
         return result
         
     except FileNotFoundError as e:
         # In library mode, we might want to raise this to be caught by API
         raise RuntimeError(f"依赖命令未找到: {e.filename}. 请确保 git 和 pandoc 都在系统 PATH 中。")
+    except subprocess.TimeoutExpired as e:
+        raise CommandTimeoutError(f"命令超时 ({e.timeout}s): {command}")
     except subprocess.CalledProcessError as e:
         # Capture stderr for better error messages
         error_msg = f"命令执行失败 (Code: {e.returncode}): {command}"
         if e.stderr:
-            error_msg += f"\nStderr:\n{e.stderr}"
-        if e.stdout:
+            stderr = e.stderr.decode("utf-8", "replace") if isinstance(e.stderr, bytes) else e.stderr
+            error_msg += f"\nStderr:\n{stderr}"
+        if e.stdout and not isinstance(e.stdout, bytes):
             error_msg += f"\nStdout:\n{e.stdout}"
         raise RuntimeError(error_msg)
+    finally:
+        record_subprocess(command, cwd, time.perf_counter() - started, failed)
 
 def check_init_status(project_path):
     """(V4.0 简化) 检查 .git 目录是否存在"""
@@ -56,31 +284,1231 @@ def check_init_status(project_path):
     if not git_dir.is_dir():
         raise RuntimeError(f"这不是一个 'wg' 仓库 (未找到 .git 目录: {git_dir})。请先初始化。")
 
+# --- (V5.8 新增) cat-file 进程池 ---
+CAT_FILE_POOL_SIZE = 4
+
+class CatFileProcess:
+    """
+    (V5.8 新增)
+    一个长期运行的 'git cat-file --batch' (或 --batch-check) 进程。
+    同一时间只能由一个线程使用, 由 CatFilePool 负责分配。
+    """
+
+    def __init__(self, project_path, mode="batch"):
+        self.mode = mode
+        try:
+            self.process = subprocess.Popen(
+                ["git", "cat-file", f"--{mode}"],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                cwd=project_path
+            )
+        except FileNotFoundError as e:
+            raise RuntimeError(f"依赖命令未找到: {e.filename}. 请确保 git 和 pandoc 都在系统 PATH 中。")
+
+    def is_alive(self):
+        return self.process.poll() is None
+
+    def request(self, spec):
+        """
+        发送一个对象名 (SHA 或 'commit:path')。
+        Returns: (sha, type, size, data) — batch-check 模式下 data 为 None; 对象不存在时返回 None
+        """
+        if "\n" in spec:
+            raise ValueError(f"无效的对象名: {spec!r}")
+        self.process.stdin.write(spec.encode("utf-8") + b"\n")
+        self.process.stdin.flush()
+
+        header = self.process.stdout.readline()
+        if not header:
+            raise BrokenPipeError("git cat-file 进程已退出")
+        fields = header.decode("utf-8", "replace").split()
+        if len(fields) != 3 or fields[-1] in ("missing", "ambiguous"):
+            return None
+        sha, obj_type, size = fields[0], fields[1], int(fields[2])
+
+        data = None
+        if self.mode == "batch":
+            data = self.process.stdout.read(size)
+            self.process.stdout.read(1) # Trailing LF after the contents
+            if len(data) != size:
+                raise BrokenPipeError("git cat-file 输出被截断")
+        return sha, obj_type, size, data
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.process.wait(timeout=2)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+class CatFilePool:
+    """
+    (V5.8 新增)
+    每个项目一组 cat-file 进程, 数量上限为 max_size。
+    取用前做健康检查, 进程异常退出时自动重启并重试一次。
+    """
+
+    def __init__(self, project_path, mode="batch", max_size=CAT_FILE_POOL_SIZE):
+        self.project_path = str(project_path)
+        self.mode = mode
+        self.max_size = max_size
+        self._idle = []
+        self._count = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def _acquire(self):
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError("cat-file 进程池已关闭")
+                while self._idle:
+                    worker = self._idle.pop()
+                    if worker.is_alive():
+                        return worker
+                    worker.close()
+                    self._count -= 1
+                if self._count < self.max_size:
+                    self._count += 1
+                    break
+                self._cond.wait()
+        try:
+            return CatFileProcess(self.project_path, self.mode)
+        except Exception:
+            with self._cond:
+                self._count -= 1
+                self._cond.notify()
+            raise
+
+    def _release(self, worker, healthy=True):
+        with self._cond:
+            if healthy and not self._closed and worker.is_alive():
+                self._idle.append(worker)
+            else:
+                worker.close()
+                self._count -= 1
+            self._cond.notify()
+
+    def request(self, spec):
+        """Returns: 同 CatFileProcess.request"""
+        # (V5.19) Timed per request, including the wait for a free worker
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = self._request(spec)
+            failed = False
+            return result
+        finally:
+            record_subprocess(["git", "cat-file", f"--{self.mode}"], self.project_path, time.perf_counter() - started, failed)
+
+    def _request(self, spec):
+        for attempt in range(2):
+            worker = self._acquire()
+            try:
+                result = worker.request(spec)
+            except (BrokenPipeError, OSError):
+                self._release(worker, healthy=False)
+                if attempt:
+                    raise RuntimeError(f"git cat-file 读取失败: {spec}")
+                continue
+            except Exception:
+                self._release(worker, healthy=False)
+                raise
+            self._release(worker)
+            return result
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._count -= len(idle)
+            self._cond.notify_all()
+        for worker in idle:
+            worker.close()
+
+# (project, mode) -> CatFilePool
+_cat_file_pools = {}
+_cat_file_pools_lock = threading.Lock()
+
+def get_cat_file_pool(project_path, mode="batch"):
+    """(V5.8 新增) 取得 (或创建) 项目的 cat-file 进程池"""
+    key = (str(Path(project_path).resolve()), mode)
+    with _cat_file_pools_lock:
+        pool = _cat_file_pools.get(key)
+        if pool is None:
+            pool = CatFilePool(project_path, mode)
+            _cat_file_pools[key] = pool
+        return pool
+
+def close_cat_file_pools():
+    """(V5.8 新增) 关闭所有 cat-file 进程 (进程退出时自动调用)"""
+    with _cat_file_pools_lock:
+        pools = list(_cat_file_pools.values())
+        _cat_file_pools.clear()
+    for pool in pools:
+        pool.close()
+
+atexit.register(close_cat_file_pools)
+
+def read_object(project_path, spec):
+    """
+    (V5.8 新增)
+    通过进程池读取对象内容, spec 为 SHA 或 'commit:path'。
+    Returns: bytes
+    """
+    result = get_cat_file_pool(project_path).request(spec)
+    if result is None:
+        raise RuntimeError(f"对象不存在: {spec}")
+    return result[3]
+
+def object_info(project_path, spec):
+    """
+    (V5.8 新增) 只查询对象信息, 不读取内容。
+    Returns: (sha, type, size), 不存在时返回 None
+    """
+    result = get_cat_file_pool(project_path, "batch-check").request(spec)
+    return result[:3] if result else None
+
+# --- (V5.4 新增) 原生 .docx 文本提取 ---
+# Streams word/document.xml out of the zip with iterparse, so no pandoc process is
+# needed for ordinary documents. Anything it does not understand raises
+# UnsupportedDocxError and the caller falls back to pandoc.
+W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+R_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}"
+A_NS = "{http://schemas.openxmlformats.org/drawingml/2006/main}"
+V_NS = "{urn:schemas-microsoft-com:vml}"
+MC_NS = "{http://schemas.openxmlformats.org/markup-compatibility/2006}"
+M_NS = "{http://schemas.openxmlformats.org/officeDocument/2006/math}"
+PKG_REL_NS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+
+# Constructs whose text pandoc renders meaningfully but we cannot reproduce
+UNSUPPORTED_DOCX_TAGS = {
+    M_NS + "oMath": "公式",
+    M_NS + "oMathPara": "公式",
+    W_NS + "altChunk": "嵌入文档 (altChunk)",
+    W_NS + "object": "OLE 对象",
+}
+
+class UnsupportedDocxError(RuntimeError):
+    """(V5.4 新增) 原生提取器无法处理该文档, 需要回退到 pandoc"""
+
+def _read_heading_styles(archive):
+    """styleId -> 标题级别 (中文版 Word 的标题样式 ID 是 '1', '2' ..., 只能按名称/大纲级别识别)"""
+    try:
+        styles_xml = archive.read("word/styles.xml")
+    except KeyError:
+        return {}
+
+    levels = {}
+    for style in ET.fromstring(styles_xml).iter(W_NS + "style"):
+        style_id = style.get(W_NS + "styleId")
+        name_elem = style.find(W_NS + "name")
+        name = (name_elem.get(W_NS + "val") if name_elem is not None else "") or ""
+        outline = style.find(f"{W_NS}pPr/{W_NS}outlineLvl")
+
+        match = re.fullmatch(r"heading (\d)", name.strip().lower())
+        if outline is not None and outline.get(W_NS + "val", "").isdigit():
+            levels[style_id] = int(outline.get(W_NS + "val")) + 1
+        elif match:
+            levels[style_id] = int(match.group(1))
+        elif name.strip().lower() == "title":
+            levels[style_id] = 1
+    return levels
+
+def _read_relationships(archive):
+    """rId -> 目标路径 (用于图片引用)"""
+    try:
+        rels_xml = archive.read("word/_rels/document.xml.rels")
+    except KeyError:
+        return {}
+    return {
+        rel.get("Id"): rel.get("Target")
+        for rel in ET.fromstring(rels_xml).iter(PKG_REL_NS + "Relationship")
+    }
+
+def _iter_document_blocks(stream, heading_styles, relationships):
+    paragraphs = [] # Stack: text boxes nest paragraphs inside paragraphs
+    table = None
+    body = None
+    in_ppr = 0
+    skip_depth = 0
+
+    for event, elem in ET.iterparse(stream, events=("start", "end")):
+        tag = elem.tag
+        if event == "start":
+            if tag == MC_NS + "Fallback":
+                skip_depth += 1 # Same content as mc:Choice, would be extracted twice
+            elif skip_depth:
+                continue
+            elif tag in UNSUPPORTED_DOCX_TAGS:
+                raise UnsupportedDocxError(f"不支持的内容: {UNSUPPORTED_DOCX_TAGS[tag]}")
+            elif tag == W_NS + "body":
+                body = elem
+            elif tag == W_NS + "p":
+                paragraphs.append({"parts": [], "level": None, "list": False})
+            elif tag == W_NS + "pPr":
+                in_ppr += 1
+            elif tag == W_NS + "tbl":
+                if table is not None:
+                    raise UnsupportedDocxError("不支持的内容: 嵌套表格")
+                table = {"rows": [], "row": None, "cell": None}
+            elif tag == W_NS + "tr" and table is not None:
+                table["row"] = []
+            elif tag == W_NS + "tc" and table is not None:
+                table["cell"] = []
+            continue
+
+        if tag == MC_NS + "Fallback":
+            skip_depth -= 1
+            continue
+        if skip_depth:
+            continue
+
+        current = paragraphs[-1] if paragraphs else None
+        if tag == W_NS + "t":
+            if current is not None:
+                current["parts"].append(elem.text or "")
+        elif tag == W_NS + "pPr":
+            in_ppr -= 1
+        elif in_ppr:
+            # Paragraph properties: w:tab here is a tab stop, not a tab character
+            if current is None:
+                continue
+            if tag == W_NS + "pStyle":
+                style_level = heading_styles.get(elem.get(W_NS + "val"))
+                if style_level and current["level"] is None:
+                    current["level"] = style_level
+            elif tag == W_NS + "outlineLvl" and elem.get(W_NS + "val", "").isdigit():
+                level = int(elem.get(W_NS + "val")) + 1
+                if level <= 9:
+                    current["level"] = level
+            elif tag == W_NS + "numPr":
+                current["list"] = True
+        elif tag == W_NS + "tab":
+            if current is not None:
+                current["parts"].append("\t")
+        elif tag in (W_NS + "br", W_NS + "cr"):
+            if current is not None:
+                current["parts"].append("\n")
+        elif tag in (A_NS + "blip", V_NS + "imagedata"):
+            rel_id = elem.get(R_NS + "embed") or elem.get(R_NS + "id")
+            target = relationships.get(rel_id)
+            if current is not None and target:
+                current["parts"].append(f"![]({target})")
+        elif tag == W_NS + "p":
+            para = paragraphs.pop()
+            text = "".join(para["parts"]).strip()
+            if table is not None and table["cell"] is not None and not paragraphs:
+                if text:
+                    table["cell"].append(text)
+            elif text:
+                if para["level"]:
+                    yield {"type": "heading", "level": para["level"], "text": text}
+                else:
+                    yield {"type": "paragraph", "text": text, "list": para["list"]}
+            elem.clear()
+            if body is not None and table is None and not paragraphs:
+                body.clear() # Keep memory flat on long documents
+        elif tag == W_NS + "tc" and table is not None:
+            table["row"].append(" ".join(table["cell"]))
+            table["cell"] = None
+        elif tag == W_NS + "tr" and table is not None:
+            table["rows"].append(table["row"])
+            table["row"] = None
+        elif tag == W_NS + "tbl" and table is not None:
+            if table["rows"]:
+                yield {"type": "table", "rows": table["rows"]}
+            table = None
+            elem.clear()
+            if body is not None and not paragraphs:
+                body.clear()
+
+def iter_docx_blocks(source):
+    """
+    (V5.4 新增)
+    逐块读取 .docx 正文。source 可以是路径、文件对象或 bytes。
+    Yields: {'type': 'heading'|'paragraph'|'table', ...}
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    try:
+        with zipfile.ZipFile(source) as archive:
+            heading_styles = _read_heading_styles(archive)
+            relationships = _read_relationships(archive)
+            with archive.open("word/document.xml") as stream:
+                yield from _iter_document_blocks(stream, heading_styles, relationships)
+    except (zipfile.BadZipFile, KeyError, ET.ParseError) as e:
+        raise UnsupportedDocxError(f"无法解析 .docx: {e}")
+
+def _escape_table_cell(text):
+    return text.replace("|", "\\|").replace("\n", " ")
+
+def render_blocks_markdown(blocks):
+    """(V5.4 新增) 把提取出的块渲染为适合逐行 diff 的 markdown 文本"""
+    chunks = []
+    for block in blocks:
+        if block["type"] == "heading":
+            chunks.append("#" * block["level"] + " " + block["text"])
+        elif block["type"] == "paragraph":
+            chunks.append(("- " if block["list"] else "") + block["text"])
+        elif block["type"] == "table":
+            width = max(len(row) for row in block["rows"])
+            lines = []
+            for i, row in enumerate(block["rows"]):
+                cells = [_escape_table_cell(c) for c in row] + [""] * (width - len(row))
+                lines.append("| " + " | ".join(cells) + " |")
+                if i == 0:
+                    lines.append("|" + "---|" * width)
+            chunks.append("\n".join(lines))
+    return "\n\n".join(chunks) + "\n" if chunks else ""
+
+def extract_docx_text(source):
+    """(V5.4 新增) 原生提取 .docx 文本。遇到不支持的内容抛出 UnsupportedDocxError"""
+    return render_blocks_markdown(iter_docx_blocks(source))
+
+def convert_docx_text(source):
+    """
+    (V5.4 新增)
+    把 .docx (路径或 bytes) 转为文本: 优先使用原生提取器, 不支持时回退到 pandoc。
+    """
+    try:
+        return extract_docx_text(source)
+    except UnsupportedDocxError:
+        pass
+
+    if isinstance(source, (bytes, bytearray)):
+        tmp_path = _write_pandoc_input(source)
+        try:
+            return convert_with_pandoc(tmp_path)
+        finally:
+            os.unlink(tmp_path)
+    return convert_with_pandoc(source)
+
+def _write_pandoc_input(data):
+    """pandoc needs a real file to read a zip container"""
+    fd, tmp_path = tempfile.mkstemp(suffix=".docx")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    return tmp_path
+
+# --- (V5.3 新增) 转换缓存 ---
+# Derived data lives under .git/ so it never shows up in the worktree or in 'git status'.
+CACHE_DIR_NAME = "wg-cache"
+TEXTCONV_CACHE_MAX_BYTES = 256 * 1024 * 1024
+# Files modified this recently are not trusted by stat alone (same idea as git's "racy" check)
+RACY_WINDOW_SECONDS = 2
+
+def find_project_root(start_path):
+    """(V5.3 新增) 从 start_path 向上查找包含 .git 的项目根目录, 找不到返回 None"""
+    current = Path(start_path).resolve()
+    for candidate in [current] + list(current.parents):
+        if (candidate / ".git").is_dir():
+            return candidate
+    return None
+
+def get_cache_dir(project_path, kind=None):
+    """(V5.3 新增) 返回项目的缓存目录 .git/wg-cache[/kind]"""
+    cache_dir = Path(project_path) / ".git" / CACHE_DIR_NAME
+    if kind:
+        cache_dir = cache_dir / kind
+    return cache_dir
+
+def git_blob_sha(data):
+    """(V5.3 新增) 与 'git hash-object' 相同的 blob SHA, 无需启动 git 进程"""
+    header = f"blob {len(data)}\0".encode()
+    return hashlib.sha1(header + data).hexdigest()
+
+def _atomic_write(target, data):
+    """先写临时文件再 rename, 并发的读者只会看到完整内容"""
+    target = Path(target)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=target.parent, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, target)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+def cache_read(project_path, kind, key):
+    """(V5.3 新增) 读取缓存条目, 命中时刷新 mtime 作为 LRU 时间戳。未命中返回 None"""
+    entry = get_cache_dir(project_path, kind) / key[:2] / key[2:]
+    try:
+        data = entry.read_bytes()
+    except OSError:
+        return None
+    try:
+        os.utime(entry)
+    except OSError:
+        pass
+    return data
+
+def cache_write(project_path, kind, key, data, max_bytes=TEXTCONV_CACHE_MAX_BYTES):
+    """(V5.3 新增) 写入缓存条目, 超出容量时按 LRU 淘汰"""
+    entry = get_cache_dir(project_path, kind) / key[:2] / key[2:]
+    _atomic_write(entry, data)
+    evict_cache(project_path, max_bytes)
+
+def evict_cache(project_path, max_bytes=TEXTCONV_CACHE_MAX_BYTES):
+    """
+    (V5.3 新增)
+    缓存总大小超过 max_bytes 时, 删除最久未使用 (mtime 最旧) 的条目。
+    Returns: 被删除的字节数
+    """
+    cache_root = get_cache_dir(project_path)
+    entries = []
+    total = 0
+    for dirpath, _, filenames in os.walk(cache_root):
+        for name in filenames:
+            if name.startswith(".tmp-") or dirpath == str(cache_root):
+                continue # In-flight writes and top-level index files are not evictable
+            full = os.path.join(dirpath, name)
+            try:
+                st = os.stat(full)
+            except OSError:
+                continue
+            entries.append((st.st_mtime_ns, st.st_size, full))
+            total += st.st_size
+
+    freed = 0
+    if total <= max_bytes:
+        return freed
+    entries.sort()
+    for _, size, full in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.unlink(full)
+        except OSError:
+            continue
+        total -= size
+        freed += size
+    return freed
+
+def _stat_signature(st):
+    return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+STAT_INDEX_FILE = "stat-index.json" # Top-level in wg-cache: never evicted
+_stat_indexes = {} # project root -> StatIndex
+_stat_indexes_lock = threading.Lock()
+
+def _file_stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_size, st.st_mtime_ns, st.st_ino)
+
+class StatIndex:
+    """
+    (V5.3 新增 -> 内存常驻)
+    stat-index.json 的内存副本: path -> [size, mtime_ns, inode, blob sha]。
+    文件本身的 stat 变化 (其他进程写过) 时才重新解析; 新条目在 flush() 时一次写回。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.stamp = _file_stamp(path)
+        self.entries = self._read()
+        self.dirty = False
+        self.lock = threading.Lock()
+
+    def _read(self):
+        try:
+            return json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+
+    def lookup(self, rel_path, signature):
+        cached = self.entries.get(rel_path)
+        return cached[3] if cached and cached[:3] == signature else None
+
+    def record(self, rel_path, signature, sha):
+        with self.lock:
+            self.entries[rel_path] = signature + [sha]
+            self.dirty = True
+
+    def flush(self):
+        """把新条目写回磁盘 (与其他进程在此期间写入的条目合并)"""
+        with self.lock:
+            if not self.dirty:
+                return
+            if _file_stamp(self.path) != self.stamp:
+                self.entries = {**self._read(), **self.entries}
+            _atomic_write(self.path, json.dumps(self.entries, ensure_ascii=False).encode("utf-8"))
+            self.stamp = _file_stamp(self.path)
+            self.dirty = False
+
+def get_stat_index(project_path):
+    """(V5.3 新增) 项目的 StatIndex; 每次调用只需 stat 一次 stat-index.json"""
+    project_root = Path(project_path).resolve()
+    path = get_cache_dir(project_root) / STAT_INDEX_FILE
+    key = str(project_root)
+    with _stat_indexes_lock:
+        index = _stat_indexes.get(key)
+        if index is None or (not index.dirty and _file_stamp(path) != index.stamp):
+            index = _stat_indexes[key] = StatIndex(path)
+        return index
+
+def hash_worktree_file(project_path, file_path, stat_index=None):
+    """
+    (V5.3 新增)
+    计算工作区文件的 blob SHA。
+    (size, mtime_ns, inode) 未变化时直接复用上次的结果, 只需一次 stat。
+    stat_index: 批量调用时传入 get_stat_index() 的结果, 由调用者在最后 flush() 一次;
+    不传时每次未命中都立即写回。
+    """
+    project_root = Path(project_path).resolve()
+    full_path = Path(file_path)
+    if not full_path.is_absolute():
+        full_path = project_root / full_path
+    full_path = full_path.resolve()
+
+    try:
+        rel_path = full_path.relative_to(project_root).as_posix()
+    except ValueError:
+        rel_path = None # Outside the worktree (e.g. a temp file written by git)
+    if rel_path is not None and rel_path.split("/")[0] == ".git":
+        rel_path = None
+
+    st = full_path.stat()
+    signature = _stat_signature(st)
+    index = None
+    if rel_path:
+        index = stat_index or get_stat_index(project_root)
+        sha = index.lookup(rel_path, signature)
+        if sha:
+            return sha
+
+    data = full_path.read_bytes()
+    if uses_canonical_storage(project_root):
+        data = canonicalize_docx(data) # (V5.17) what 'git add' would store
+    sha = git_blob_sha(data)
+    if index is not None and time.time() - st.st_mtime > RACY_WINDOW_SECONDS:
+        index.record(rel_path, signature, sha)
+        if stat_index is None:
+            index.flush()
+    return sha
+
+def convert_with_pandoc(file_path):
+    """(V5.3 新增) 调用 pandoc 把 .docx 转为 markdown 文本"""
+    result = run_command(
+        ["pandoc", "-f", "docx", "-t", "markdown", str(file_path)],
+        capture_output=True,
+        encoding="utf-8",
+        timeout=PANDOC_TIMEOUT
+    )
+    return result.stdout
+
+def get_blob_text(project_path, blob_sha, loader):
+    """
+    (V5.4 新增)
+    取得 blob 的转换文本: 先查缓存, 未命中时用 loader() 取得 路径或 bytes 再转换。
+    Returns: str
+    """
+    cached = cache_read(project_path, "text", blob_sha)
+    if cached is not None:
+        return cached.decode("utf-8")
+
+    text = convert_docx_text(loader())
+    cache_write(project_path, "text", blob_sha, text.encode("utf-8"))
+    return text
+
+def read_blob(project_path, blob_sha):
+    """(V5.4 新增 -> V5.8 进程池) 读取 git 对象库中的 blob 内容 (bytes)"""
+    return read_object(project_path, blob_sha)
+
+@timed_operation("textconv")
+def handle_textconv(project_path, file_path):
+    """
+    (V5.3 新增 -> V5.4 原生提取)
+    Git 'diff.pandoc.textconv' 驱动: 以 blob SHA 为键缓存转换结果。
+    HEAD 一侧的 blob 永远只转换一次; 未修改的工作区文件只需一次 stat。
+    Returns: 转换后的文本 (bytes, UTF-8)
+    """
+    sha = hash_worktree_file(project_path, file_path)
+    return get_blob_text(project_path, sha, lambda: file_path).encode("utf-8")
+
+def get_textconv_command():
+    """(V5.3 新增) 写入 git config 的 textconv 命令, 指向当前解释器和本脚本"""
+    return get_wg_command("textconv")
+
+def get_wg_command(subcommand):
+    """(V5.17 从 get_textconv_command 拆出) 供 git 调用的 wg 子命令"""
+    python_exe = Path(sys.executable).as_posix()
+    script = Path(__file__).resolve().as_posix()
+    return f'"{python_exe}" "{script}" {subcommand}'
+
+# --- (V5.17 新增) 规范化存储模式 ---
+# Opt-in (wg init --canonical-storage). The clean filter stores each .docx as an
+# uncompressed zip with its parts in a fixed order and with fixed timestamps, so
+# the XML inside is visible to git's delta compression. Smudge deflates it again
+# on checkout. Part contents are kept byte for byte; only the container changes.
+STORAGE_FILTER = "wgdocx"
+EMPTY_TREE_SHA = "4b825dc642cb6eb9a060e54bf8d69288fbee4904"
+STORAGE_ATTRIBUTE = f"*.docx filter={STORAGE_FILTER}"
+CANONICAL_ZIP_DATE = (1980, 1, 1, 0, 0, 0)
+PKT_MAX_DATA = 65516
+# project -> (.gitattributes stat, enabled)
+_storage_mode_cache = {}
+
+def _canonical_part_order(name):
+    # [Content_Types].xml first, as Word itself writes it; everything else by name
+    return (name != "[Content_Types].xml", name)
+
+def _rewrite_docx(data, compression):
+    try:
+        with zipfile.ZipFile(io.BytesIO(data)) as source:
+            names = sorted({info.filename for info in source.infolist() if not info.is_dir()}, key=_canonical_part_order)
+            parts = [(name, source.read(name)) for name in names]
+    except (zipfile.BadZipFile, KeyError, EOFError, RuntimeError, NotImplementedError):
+        return data # Not a readable zip (half-written, encrypted): stored as is
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, "w", compression) as target:
+        for name, content in parts:
+            info = zipfile.ZipInfo(name, CANONICAL_ZIP_DATE)
+            info.compress_type = compression
+            info.create_system = 0 # Same bytes whichever OS ran the filter
+            target.writestr(info, content)
+    return out.getvalue()
+
+def canonicalize_docx(data):
+    """(V5.17 新增) clean: 不压缩、部件顺序与时间戳固定的 zip。幂等"""
+    return _rewrite_docx(data, zipfile.ZIP_STORED)
+
+def expand_docx(data):
+    """(V5.17 新增) smudge: 重新压缩为普通大小的 .docx"""
+    return _rewrite_docx(data, zipfile.ZIP_DEFLATED)
+
+def uses_canonical_storage(project_path):
+    """(V5.17 新增) 项目的 .gitattributes 是否启用了规范化存储 (按 stat 缓存)"""
+    attr_file = Path(project_path) / ".gitattributes"
+    try:
+        signature = _stat_signature(attr_file.stat())
+    except OSError:
+        return False
+    cached = _storage_mode_cache.get(str(project_path))
+    if cached and cached[0] == signature:
+        return cached[1]
+    enabled = STORAGE_ATTRIBUTE in attr_file.read_text(encoding="utf-8", errors="replace")
+    _storage_mode_cache[str(project_path)] = (signature, enabled)
+    return enabled
+
+def checkout_bytes(project_path, data):
+    """(V5.17 新增) 从对象库读出的 .docx 内容 -> 写入工作区时的内容"""
+    return expand_docx(data) if uses_canonical_storage(project_path) else data
+
+def _read_pkt(stream):
+    """读取一个 pkt-line; flush 包返回 None"""
+    header = stream.read(4)
+    if len(header) < 4:
+        raise EOFError
+    length = int(header, 16)
+    if length == 0:
+        return None
+    return stream.read(length - 4)
+
+def _read_pkt_text(stream):
+    lines = []
+    while True:
+        packet = _read_pkt(stream)
+        if packet is None:
+            return lines
+        lines.append(packet.decode("utf-8").rstrip("\n"))
+
+def _read_pkt_content(stream):
+    chunks = []
+    while True:
+        packet = _read_pkt(stream)
+        if packet is None:
+            return b"".join(chunks)
+        chunks.append(packet)
+
+def _write_pkt(stream, data):
+    stream.write(b"%04x" % (len(data) + 4) + data)
+
+def _write_pkt_text(stream, *lines):
+    for line in lines:
+        _write_pkt(stream, line.encode("utf-8") + b"\n")
+    stream.write(b"0000")
+
+def handle_filter_process(stdin, stdout):
+    """
+    (V5.17 新增)
+    git 长驻过滤进程协议 (filter.<driver>.process, 协议版本 2)。
+    一个 'git add' / 'git checkout' 只启动一次本进程, 而不是每个文件一次。
+    """
+    welcome = _read_pkt_text(stdin)
+    if welcome[:1] != ["git-filter-client"] or "version=2" not in welcome:
+        raise RuntimeError(f"无法识别的过滤协议: {welcome}")
+    _write_pkt_text(stdout, "git-filter-server", "version=2")
+    capabilities = _read_pkt_text(stdin)
+    _write_pkt_text(stdout, *[c for c in ("capability=clean", "capability=smudge") if c in capabilities])
+    stdout.flush()
+
+    while True:
+        try:
+            headers = _read_pkt_text(stdin)
+        except EOFError:
+            return
+        command = dict(line.split("=", 1) for line in headers if "=" in line).get("command")
+        content = _read_pkt_content(stdin)
+        try:
+            result = canonicalize_docx(content) if command == "clean" else expand_docx(content)
+        except Exception:
+            _write_pkt_text(stdout, "status=error")
+            stdout.flush()
+            continue
+        _write_pkt_text(stdout, "status=success")
+        for offset in range(0, len(result), PKT_MAX_DATA):
+            _write_pkt(stdout, result[offset:offset + PKT_MAX_DATA])
+        stdout.write(b"0000")
+        stdout.write(b"0000") # Empty trailing list: keep status=success
+        stdout.flush()
+
+def configure_canonical_storage(project_path):
+    """(V5.17 新增) 写入过滤器配置并追加 .gitattributes 规则。Returns: 是否新启用"""
+    for key, subcommand in (("process", "filter-process"), ("clean", "clean"), ("smudge", "smudge")):
+        run_command(["git", "config", f"filter.{STORAGE_FILTER}.{key}", get_wg_command(subcommand)], cwd=project_path)
+    run_command(["git", "config", f"filter.{STORAGE_FILTER}.required", "true"], cwd=project_path)
+
+    attr_file = Path(project_path) / ".gitattributes"
+    if STORAGE_ATTRIBUTE in attr_file.read_text(encoding="utf-8", errors="replace"):
+        return False
+    with open(attr_file, "a") as f:
+        f.write(f"{STORAGE_ATTRIBUTE}\n")
+    # Worktree hashes cached by stat were taken without the filter
+    with _stat_indexes_lock:
+        _stat_indexes.pop(str(Path(project_path).resolve()), None)
+    try:
+        (get_cache_dir(project_path) / STAT_INDEX_FILE).unlink()
+    except OSError:
+        pass
+    return True
+
+# --- (V5.25 新增) 共享状态库 (SQLite) ---
+# With several server workers, each process kept its own status / log caches and
+# rewrote projects.json without any locking. The state store is one SQLite database
+# in WAL mode: readers never wait for a writer, every update is a single
+# transaction, and any worker can reuse what another one computed. Conversion
+# results stay in .git/wg-cache: those files are already written atomically.
+STATE_BUSY_TIMEOUT = 10 # Seconds a writer waits for another process's transaction
+STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS projects (
+    path TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    added REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS derived (
+    project TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    updated REAL NOT NULL,
+    PRIMARY KEY (project, kind, key)
+);
+"""
+
+class StateStore:
+    """
+    (V5.25 新增)
+    项目列表与派生数据 (状态快照、日志索引) 的跨进程存储。
+    每个线程一个连接; 写操作使用 BEGIN IMMEDIATE, 多个进程的更新依次原子生效。
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._local = threading.local()
+        with self._transaction() as db:
+            for statement in STATE_SCHEMA.split(";"):
+                if statement.strip():
+                    db.execute(statement)
+
+    def _connection(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            # isolation_level=None: no implicit transactions, we issue BEGIN ourselves
+            db = sqlite3.connect(self.path, timeout=STATE_BUSY_TIMEOUT, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        db = self._connection()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        db.execute("COMMIT")
+
+    def list_projects(self):
+        rows = self._connection().execute("SELECT path FROM projects ORDER BY position")
+        return [path for (path,) in rows]
+
+    def add_project(self, path):
+        """Returns: True 表示新加入, 已存在时为 False"""
+        with self._transaction() as db:
+            cursor = db.execute(
+                "INSERT OR IGNORE INTO projects (path, position, added) "
+                "SELECT ?, COALESCE(MAX(position), -1) + 1, ? FROM projects",
+                (path, time.time())
+            )
+            return cursor.rowcount > 0
+
+    def remove_project(self, path):
+        """移除项目及其派生数据。Returns: 项目原本是否存在"""
+        with self._transaction() as db:
+            db.execute("DELETE FROM derived WHERE project = ?", (path,))
+            return db.execute("DELETE FROM projects WHERE path = ?", (path,)).rowcount > 0
+
+    def import_projects(self, paths):
+        """项目表为空时一次性导入旧的项目列表 (projects.json); 多个进程同时调用只有一个生效"""
+        with self._transaction() as db:
+            if db.execute("SELECT 1 FROM projects LIMIT 1").fetchone():
+                return 0
+            now = time.time()
+            db.executemany(
+                "INSERT OR IGNORE INTO projects (path, position, added) VALUES (?, ?, ?)",
+                [(path, position, now) for position, path in enumerate(paths)]
+            )
+            return len(paths)
+
+    def get(self, project, kind, key=""):
+        row = self._connection().execute(
+            "SELECT value FROM derived WHERE project = ? AND kind = ? AND key = ?", (project, kind, key)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, project, kind, value, key=""):
+        data = json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+        with self._transaction() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO derived (project, kind, key, value, updated) VALUES (?, ?, ?, ?, ?)",
+                (project, kind, key, data, time.time())
+            )
+
+_state_store = None
+
+def configure_state_store(path):
+    """(V5.25 新增) 启用共享状态库 (服务器启动时调用); path 为 None 时关闭。Returns: StateStore"""
+    global _state_store
+    _state_store = StateStore(path) if path else None
+    return _state_store
+
+def state_get(project_path, kind, key=""):
+    """(V5.25 新增) 读取派生数据; 未启用状态库或读取失败时返回 None (派生数据总能重新计算)"""
+    store = _state_store
+    if store is None:
+        return None
+    try:
+        return store.get(str(project_path), kind, key)
+    except (sqlite3.Error, ValueError):
+        return None
+
+def state_put(project_path, kind, value, key=""):
+    """(V5.25 新增) 写入派生数据; 失败时放弃 (下次重新计算)"""
+    store = _state_store
+    if store is None:
+        return
+    try:
+        store.put(str(project_path), kind, value, key)
+    except sqlite3.Error:
+        pass
+
+class FileLock:
+    """
+    (V5.25 新增)
+    跨进程互斥锁 (fcntl.flock / msvcrt.locking)。持有者退出时由操作系统释放,
+    不会因进程崩溃留下死锁。
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._fd = None
+
+    def acquire(self, blocking=True):
+        """Returns: 是否拿到锁 (blocking=True 时总是 True)"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        while True:
+            try:
+                if fcntl:
+                    fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+                else:
+                    msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                self._fd = fd
+                return True
+            except OSError:
+                if not blocking:
+                    os.close(fd)
+                    return False
+                time.sleep(0.05) # msvcrt has no blocking lock without a 10 s give-up
+
+    def release(self):
+        fd, self._fd = self._fd, None
+        if fd is None:
+            return
+        if not fcntl:
+            msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+        os.close(fd) # Closing the descriptor drops the flock
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+def project_lock(project_path, name):
+    """(V5.25 新增) 项目级跨进程锁 .git/wg-cache/<name>.lock (顶层文件, 不参与淘汰)"""
+    return FileLock(get_cache_dir(project_path) / f"{name}.lock")
+
+# --- (V5.6 新增) 状态快照缓存 ---
+STATUS_FORMAT_VERSION = 2 # Bump when parse_status_output changes: stored results and ETags are dropped
+# (project, files) -> (project_stamp, status_list)
+_status_cache = {}
+
+def _cached_status(cache_key, stamp, shared=True):
+    """
+    (V5.25 新增) 先查本进程缓存, shared=True 时再查状态库 (其他 worker 对同一磁盘状态的结果)。
+    Returns: status 列表副本, 未命中返回 None
+    """
+    cached = _status_cache.get(cache_key)
+    if cached and cached[0] == stamp:
+        return [dict(item) for item in cached[1]]
+    if not shared:
+        return None
+    stored = state_get(cache_key[0], "status", "\0".join(cache_key[1]))
+    if stored and stored["stamp"] == make_etag(STATUS_FORMAT_VERSION, stamp):
+        _status_cache[cache_key] = (stamp, stored["status"])
+        return [dict(item) for item in stored["status"]]
+    return None
+
+def _remember_status(cache_key, stamp, status_list):
+    status_list = [dict(item) for item in status_list]
+    _status_cache[cache_key] = (stamp, status_list)
+    state_put(cache_key[0], "status", {"stamp": make_etag(STATUS_FORMAT_VERSION, stamp), "status": status_list}, "\0".join(cache_key[1]))
+
+def make_etag(*parts):
+    """(V5.6 新增) 由任意可 repr 的状态生成 HTTP ETag"""
+    digest = hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()[:20]
+    return f'"{digest}"'
+
+def status_etag(project_path, files=None):
+    """
+    (V5.6 新增)
+    只做 stat 不启动 git, 计算 handle_status 结果的 ETag。
+    Returns: (etag, stamp) — stamp 可传回 handle_status 以免重复 stat
+    """
+    check_init_status(project_path)
+    stamp = project_stamp(project_path)
+    return make_etag(STATUS_FORMAT_VERSION, stamp, tuple(files or ())), stamp
+
 # --- (V4.5 新增) ---
 def get_docx_files(project_path):
     """
     (V4.6 QoL 修复) 
     获取指定目录下的所有 .docx 文件, 忽略 Office 临时文件。
-    返回一个相对路径的字符串列表。
+    (V5.15) 递归扫描子目录, 遵循 .gitignore 规则并跳过 'Restore Copy'。
+    返回一个相对路径的字符串列表 (使用 '/' 分隔)。
     """
     current_dir = Path(project_path)
     if not current_dir.exists():
          raise RuntimeError(f"项目路径不存在: {project_path}")
 
-    all_files = current_dir.glob("*.docx")
-    
-    valid_files = [
-        f for f in all_files 
-        if not f.name.startswith("~$") and not f.name.startswith(".~")
-    ]
-    
-    return [f.name for f in valid_files] # (V4.6 修复) str(f) -> f.name
+    files, _ = refresh_directory_index(current_dir)
+    return files
+
+# --- (V5.15 新增) 递归扫描与目录索引 ---
+# Each directory's raw listing is kept with its mtime. Adding, removing or renaming
+# an entry bumps the mtime of its parent only, so a refresh re-reads just those
+# directories and costs one stat per directory everywhere else.
+IGNORED_DIR_NAMES = {".git", "Restore Copy"}
+# project -> {相对目录: (mtime_ns, [.docx 名称], [子目录名称])}
+_dir_indexes = {}
+_dir_index_lock = threading.Lock()
+# .gitignore 路径 -> ((size, mtime_ns), GitIgnoreRules)
+_ignore_rules_cache = {}
+
+# Above this many files a wildcard pathspec is passed instead of every path, and the
+# output is filtered back down; Windows caps a command line at 32K characters.
+MAX_PATHSPEC_FILES = 200
+DOCX_PATHSPEC = ":(glob)**/*.docx"
+
+def docx_pathspec(files):
+    """(V5.15 新增) git 命令的 pathspec 参数; 文件过多时使用通配"""
+    return list(files) if len(files) <= MAX_PATHSPEC_FILES else [DOCX_PATHSPEC]
+
+def _glob_to_regex(pattern, anchored):
+    """把 gitignore 的 glob 转为正则; 未锚定的模式可匹配任意层级"""
+    out = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            out.append("(?:.*/)?")
+            i += 3
+            continue
+        if pattern.startswith("/**", i) and i + 3 == len(pattern):
+            out.append("/.*")
+            i += 3
+            continue
+        c = pattern[i]
+        if c == "*":
+            out.append("[^/]*")
+        elif c == "?":
+            out.append("[^/]")
+        elif c == "[" and pattern.find("]", i + 2) != -1:
+            end = pattern.find("]", i + 2)
+            body = pattern[i + 1:end]
+            if body.startswith("!"):
+                body = "^" + body[1:]
+            out.append("[" + body.replace("\\", "\\\\") + "]")
+            i = end + 1
+            continue
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return ("" if anchored else "(?:.*/)?") + "".join(out) + r"\Z"
+
+class GitIgnoreRules:
+    """一个 .gitignore 文件的规则 (支持 !取反, 前导 / 锚定, 尾部 / 仅目录, ** 通配)"""
+
+    def __init__(self, base, lines):
+        self.base = base # 相对项目根的目录, 根目录为 ""
+        self.rules = []
+        for line in lines:
+            line = line.rstrip("\r\n").rstrip(" ")
+            if not line or line.startswith("#"):
+                continue
+            negate = line.startswith("!")
+            if negate or line.startswith("\\"):
+                line = line[1:]
+            dir_only = line.endswith("/")
+            line = line.rstrip("/")
+            if not line:
+                continue
+            anchored = "/" in line
+            self.rules.append((re.compile(_glob_to_regex(line.lstrip("/"), anchored)), negate, dir_only))
+
+    def match(self, rel_path, is_dir):
+        """Returns: True 忽略, False 显式保留 (!), None 没有规则命中"""
+        if self.base:
+            if not rel_path.startswith(self.base + "/"):
+                return None
+            rel_path = rel_path[len(self.base) + 1:]
+        result = None
+        for regex, negate, dir_only in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if regex.match(rel_path):
+                result = not negate # Last matching rule wins, as in git
+        return result
+
+def _load_ignore_rules(ignore_path, base):
+    try:
+        st = os.stat(ignore_path)
+    except OSError:
+        return None
+    signature = (st.st_size, st.st_mtime_ns)
+    cached = _ignore_rules_cache.get(str(ignore_path))
+    if cached and cached[0] == signature:
+        return cached[1]
+    try:
+        with open(ignore_path, "r", encoding="utf-8", errors="replace") as f:
+            rules = GitIgnoreRules(base, f.readlines())
+    except OSError:
+        return None
+    _ignore_rules_cache[str(ignore_path)] = (signature, rules)
+    return rules
+
+def is_ignored(rule_stack, rel_path, is_dir):
+    """rule_stack: 从根到当前目录的 GitIgnoreRules; 更深的 .gitignore 优先"""
+    for rules in reversed(rule_stack):
+        result = rules.match(rel_path, is_dir)
+        if result is not None:
+            return result
+    return False
+
+def _scan_directory(full_path):
+    docx_names, subdirs = [], []
+    with os.scandir(full_path) as entries:
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                elif entry.name.endswith(".docx") and entry.is_file():
+                    docx_names.append(entry.name)
+            except OSError:
+                continue
+    return sorted(docx_names), sorted(subdirs)
+
+def refresh_directory_index(project_path):
+    """
+    (V5.15 新增)
+    增量刷新项目的目录索引: 只重新读取 mtime 变化过的目录。
+    Returns: (.docx 相对路径列表, 被扫描的相对目录列表)
+    """
+    root = Path(project_path)
+    key = str(root)
+    now = time.time()
+    with _dir_index_lock:
+        previous = _dir_indexes.get(key, {})
+        index = {}
+        files, scanned = [], []
+        root_rules = _load_ignore_rules(root / ".git" / "info" / "exclude", "")
+        stack = [("", [root_rules] if root_rules else [])]
+        while stack:
+            rel_dir, rule_stack = stack.pop()
+            full_path = root / rel_dir if rel_dir else root
+            try:
+                st = os.stat(full_path)
+            except OSError:
+                continue
+            cached = previous.get(rel_dir)
+            if cached and cached[0] == st.st_mtime_ns:
+                listing = cached
+            else:
+                try:
+                    listing = (st.st_mtime_ns,) + _scan_directory(full_path)
+                except OSError:
+                    continue
+            # A directory changed within the racy window may change again in the same mtime tick
+            index[rel_dir] = listing if now - st.st_mtime > RACY_WINDOW_SECONDS else (None,) + listing[1:]
+            scanned.append(rel_dir)
+
+            local_rules = _load_ignore_rules(full_path / ".gitignore", rel_dir)
+            if local_rules:
+                rule_stack = rule_stack + [local_rules]
+            prefix = rel_dir + "/" if rel_dir else ""
+            for name in listing[1]:
+                rel_path = prefix + name
+                if not is_office_temp_file(name) and not is_ignored(rule_stack, rel_path, False):
+                    files.append(rel_path)
+            for name in reversed(listing[2]):
+                rel_path = prefix + name
+                if name not in IGNORED_DIR_NAMES and not is_ignored(rule_stack, rel_path, True):
+                    stack.append((rel_path, rule_stack))
+        _dir_indexes[key] = index
+    return sorted(files), scanned
 
 # --- (V4.4 修复) ---
-def handle_init(project_path):
+@timed_operation("init")
+def handle_init(project_path, canonical_storage=False):
     """
     (V4.4 核心) 
     初始化 Git 仓库并自动配置 'textconv' 以便 diff .docx。
+    (V5.17) canonical_storage=True 时启用规范化存储 (clean/smudge 过滤器), 已有历史不受影响。
     """
     path_obj = Path(project_path)
     if not path_obj.exists():
@@ -102,14 +1530,21 @@ def handle_init(project_path):
             f.write("\n*.docx diff=pandoc\n")
 
     # 2. Configure git config for textconv
-    # We use 'pandoc -t markdown' to convert docx to text for diffing
-    pandoc_cmd_string = "git config diff.pandoc.textconv \"pandoc -t markdown\""
+    # (V5.3) 'wg textconv' wraps 'pandoc -t markdown' with a blob-SHA keyed cache
     try:
-        run_command(pandoc_cmd_string, shell=True, cwd=project_path)
+        run_command(["git", "config", "diff.pandoc.textconv", get_textconv_command()], cwd=project_path)
         # (V5.1 Fix) Disable quotePath to handle non-ASCII filenames correctly
         run_command(["git", "config", "core.quotePath", "false"], cwd=project_path)
     except Exception as e:
         raise RuntimeError(f"配置 Git 驱动失败: {e}")
+
+    # 3. (V5.17) Opt-in canonical storage
+    storage_enabled = False
+    if canonical_storage:
+        try:
+            storage_enabled = configure_canonical_storage(project_path)
+        except Exception as e:
+            raise RuntimeError(f"配置规范化存储失败: {e}")
     
     # 4. (V4.0 修改) 创建 .gitignore
     gitignore_path = path_obj / ".gitignore"
@@ -138,7 +1573,13 @@ def handle_init(project_path):
     if patterns_added:
         config_files_to_add.append(".gitignore")
 
-    if config_files_to_add:
+    renormalized = False
+    if storage_enabled and run_command(["git", "ls-files", "--", DOCX_PATHSPEC], capture_output=True, check=False, cwd=project_path).stdout:
+        # Re-store already tracked documents through the filter (index content only, worktree edits stay unstaged)
+        run_command(["git", "add", "--renormalize", "--", DOCX_PATHSPEC], cwd=project_path)
+        renormalized = True
+
+    if config_files_to_add or renormalized:
         # print("正在提交 'wg' 配置文件到仓库...")
         is_initial_commit = run_command(["git", "rev-parse", "--verify", "HEAD"], check=False, cwd=project_path).returncode != 0
         
@@ -150,44 +1591,220 @@ def handle_init(project_path):
     return True
 
 # --- (V4.5 修复) ---
-def handle_status(project_path, files=None):
+@timed_operation("status")
+def handle_status(project_path, files=None, stamp=None):
     """
     (V4.5 修复) 运行 'git status'
+    (V5.6) 磁盘状态 (project_stamp) 未变化时直接返回上次的结果, 不启动 git。
     Returns: List of dicts [{'path': 'file.docx', 'status': 'M'}, ...]
     """
     check_init_status(project_path)
+    # Stamp is taken before running git: a change during the run triggers a recompute next time
+    stamp = stamp or project_stamp(project_path)
+    cache_key = (str(project_path), tuple(files or ()))
+    cached = _cached_status(cache_key, stamp)
+    if cached is not None:
+        return cached
+
     # (V4.5 修复) 使用 get_docx_files() 替代 '*.docx'
     files_to_check = files if files else get_docx_files(project_path)
     if not files_to_check:
+        _remember_status(cache_key, stamp, [])
         return []
 
-    # Run git status --short
-    # Output format: " M file.docx", "?? new.docx"
+    # Run git status --porcelain -z
+    # Records: " M file.docx\0", "?? new.docx\0", "R  new.docx\0old.docx\0" (paths never quoted)
     result = run_command(
-        ["git", "status", "--short", "--"] + files_to_check, 
+        ["git", "status", "--porcelain", "-z", "--"] + docx_pathspec(files_to_check), 
         capture_output=True, 
         check=False,
         cwd=project_path
     )
     
+    status_list = parse_status_output(result.stdout, files_to_check)
+    _remember_status(cache_key, stamp, status_list)
+    return status_list
+
+def parse_status_output(output, files=None):
+    """
+    (V5.12 从 handle_status 拆出) 解析 'git status --porcelain -z' 输出
+    (V5.15) 传入 files 时只保留这些文件 (通配 pathspec 可能多匹配)
+    -z 的路径不加引号 (--short 会给含空格的路径加引号, 无法与文件名比较);
+    重命名 / 复制的原路径是下一条记录, 结果中仍写作 'old -> new'。
+    """
+    wanted = set(files) if files else None
     status_list = []
-    if result.stdout:
-        lines = result.stdout.split('\n')
-        for line in lines:
-            if not line: continue
-            # XY Path
-            # X: index status, Y: worktree status
-            status_code = line[:2].strip()
-            file_path = line[3:].strip()
-            # 简单映射：如果有任何修改，就显示状态
-            status_list.append({"path": file_path, "status": status_code})
-            
+    records = iter(output.split("\0")) if output else iter(())
+    for record in records:
+        if not record: continue
+        # XY Path
+        # X: index status, Y: worktree status
+        status_code = record[:2].strip()
+        file_path = record[3:]
+        display_path = file_path
+        if "R" in record[:2] or "C" in record[:2]:
+            display_path = f"{next(records, '')} -> {file_path}"
+        if wanted is not None and file_path not in wanted:
+            continue
+        # 简单映射：如果有任何修改，就显示状态
+        status_list.append({"path": display_path, "status": status_code})
     return status_list
 
-# --- (V4.5 修复) ---
-def handle_diff(project_path, files=None):
+def list_index_entries(project_path, files):
+    """
+    (V5.4 新增) 读取暂存区中文件的 (mode, blob SHA)。
+    Returns: dict {path: (mode, sha)}
+    """
+    result = run_command(
+        ["git", "ls-files", "-s", "-z", "--"] + docx_pathspec(files),
+        capture_output=True,
+        check=False,
+        cwd=project_path
+    )
+    return parse_ls_files_output(result.stdout, files)
+
+def parse_ls_files_output(output, files=None):
+    """(V5.12 从 list_index_entries 拆出) 解析 'git ls-files -s -z' 输出; 传入 files 时只保留这些文件"""
+    wanted = set(files) if files else None
+    entries = {}
+    for record in output.split("\0"):
+        if not record:
+            continue
+        meta, path = record.split("\t", 1)
+        mode, sha, stage = meta.split()
+        if wanted is not None and path not in wanted:
+            continue
+        if stage == "0": # Unmerged paths are left to git itself
+            entries[path] = (mode, sha)
+    return entries
+
+def format_unified_diff(path, old_sha, new_sha, mode, old_text, new_text):
+    """(V5.4 新增) 生成与 'git diff' (textconv) 相同格式的统一 diff 文本"""
+    hunks = ["\n".join(hunk) + "\n" for hunk in iter_unified_hunks(old_text, new_text)]
+    if not hunks:
+        return ""
+    return unified_diff_header(path, old_sha, new_sha, mode) + "".join(hunks)
+
+def unified_diff_header(path, old_sha, new_sha, mode):
+    """(V5.26 从 format_unified_diff 拆出) 'diff --git' 头部以及 ---/+++ 行"""
+    header = [f"diff --git a/{path} b/{path}\n"]
+    if new_sha is None:
+        header.append(f"deleted file mode {mode}\n")
+        header.append(f"index {old_sha[:7]}..0000000\n")
+    elif old_sha is None:
+        # (V5.10) File missing on the old side of a revision diff
+        header.append(f"new file mode {mode}\n")
+        header.append(f"index 0000000..{new_sha[:7]}\n")
+    else:
+        header.append(f"index {old_sha[:7]}..{new_sha[:7]} {mode}\n")
+    header.append(f"--- a/{path}\n" if old_sha is not None else "--- /dev/null\n")
+    header.append(f"+++ b/{path}\n" if new_sha is not None else "+++ /dev/null\n")
+    return "".join(header)
+
+def iter_unified_hunks(old_text, new_text):
+    """(V5.26 新增) 逐个产生 unified diff 的 hunk (行列表, 首行为 '@@'); 已产生的 hunk 不再保留"""
+    hunk = None
+    lines = difflib.unified_diff(old_text.splitlines(), new_text.splitlines(), lineterm="")
+    for line in lines:
+        # Body lines start with ' ', '+' or '-', so only hunk headers start with '@@'
+        if line.startswith("@@"):
+            if hunk:
+                yield hunk
+            hunk = [line]
+        elif hunk is not None:
+            hunk.append(line)
+    if hunk:
+        yield hunk
+
+# --- (V5.10 新增) 任意版本之间的 diff ---
+# Pseudo revisions accepted wherever a diff side is expected
+WORKTREE_REV = "WORKTREE"
+INDEX_REV = "INDEX"
+
+def resolve_revisions(project_path, *revs):
+    """
+    (V5.10 修复)
+    把 diff 两侧的版本名解析为提交 SHA (None / INDEX / WORKTREE 原样保留)。
+    未知的版本抛出 ValueError, 而不是被当作空树 (所有文档都显示为新增)。
+    Returns: 与 revs 对应的 list
+    """
+    resolved = []
+    for rev in revs:
+        if rev not in (None, INDEX_REV, WORKTREE_REV):
+            sha = resolve_commit(project_path, rev)
+            if sha is None:
+                raise ValueError(f"未知的版本: {rev}")
+            rev = sha
+        resolved.append(rev)
+    return resolved
+
+def resolve_side(project_path, rev, files):
     """
-    (V4.5 修复) 运行 'git diff'
+    (V5.10 新增)
+    取得某一侧 (commit / INDEX / WORKTREE) 中各文件的 blob。
+    Returns: dict {path: (mode, sha)} — 该侧不存在的文件不出现; 未知的版本抛出 ValueError
+    """
+    if rev == WORKTREE_REV:
+        entries = {}
+        stat_index = get_stat_index(project_path)
+        for file_path in files:
+            worktree_file = Path(project_path) / file_path
+            if worktree_file.is_file():
+                entries[file_path] = ("100644", hash_worktree_file(project_path, worktree_file, stat_index))
+        stat_index.flush()
+        return entries
+    if rev == INDEX_REV:
+        return list_index_entries(project_path, files)
+
+    rev, = resolve_revisions(project_path, rev)
+    entries = {}
+    for file_path in files:
+        # batch-check goes through the shared pool: no process per file or per revision
+        info = object_info(project_path, f"{rev}:{file_path}")
+        if info and info[1] == "blob":
+            entries[file_path] = ("100644", info[0])
+    return entries
+
+def side_loader(project_path, rev, file_path, sha):
+    """(V5.10 新增) 返回读取该侧内容的 loader (工作区直接给路径, 其余从对象库读取)"""
+    if rev == WORKTREE_REV:
+        return lambda: Path(project_path) / file_path
+    return lambda: read_blob(project_path, sha)
+
+def iter_changes(project_path, files, rev_from=INDEX_REV, rev_to=WORKTREE_REV):
+    """
+    (V5.9 新增 -> V5.10 任意版本)
+    找出两侧内容不同的文件。默认比较暂存区与工作区 (等同 'git diff', 不含未跟踪文件)。
+    Yields: (path, mode, old_sha, new_sha, old_loader, new_loader) — 缺失的一侧 sha 为 None
+    """
+    rev_from, rev_to = resolve_revisions(project_path, rev_from, rev_to) # Fail before reading either side
+    old_entries = resolve_side(project_path, rev_from, files)
+    new_entries = resolve_side(project_path, rev_to, files)
+    return pair_changes(project_path, files, rev_from, rev_to, old_entries, new_entries)
+
+def pair_changes(project_path, files, rev_from, rev_to, old_entries, new_entries):
+    """(V5.12 从 iter_changes 拆出) 对比两侧已解析的 blob"""
+    for file_path in files:
+        if rev_from == INDEX_REV and file_path not in old_entries:
+            continue # Untracked: 'git diff' does not show it either
+        old_mode, old_sha = old_entries.get(file_path, (None, None))
+        new_mode, new_sha = new_entries.get(file_path, (None, None))
+        if old_sha == new_sha:
+            continue
+        yield (
+            file_path, old_mode or new_mode, old_sha, new_sha,
+            side_loader(project_path, rev_from, file_path, old_sha),
+            side_loader(project_path, rev_to, file_path, new_sha)
+        )
+
+# --- (V4.5 修复 -> V5.4 进程内 diff) ---
+@timed_operation("diff")
+def handle_diff(project_path, files=None, rev_from=None, rev_to=None):
+    """
+    (V4.5 修复) 比较工作区与暂存区 (等同 'git diff')
+    (V5.4) 在进程内提取文本并生成 diff, 不再为每个文件启动 textconv/pandoc 进程。
+    (V5.10) rev_from / rev_to 可指定任意 commit 或 INDEX / WORKTREE。
+            只给 rev_from 时与工作区比较; 都不给时为暂存区 -> 工作区。
     Returns: String (diff output)
     """
     check_init_status(project_path)
@@ -196,100 +1813,1364 @@ def handle_diff(project_path, files=None):
     if not files_to_check:
         return "No .docx files found."
 
-    # Capture output instead of printing
+    page = DiffPage()
+    collect_diff(project_path, files_to_check, rev_from, rev_to, page)
+    return page.text()
+
+# --- (V5.9 新增) 段落级结构化 diff ---
+PARAGRAPH_DIFF_VERSION = 1
+PARAGRAPH_DIFF_CONTEXT = 3
+# Below this token similarity a replaced pair is shown as delete + insert, not a word-level edit
+MODIFY_SIMILARITY_THRESHOLD = 0.3
+WORD_TOKEN_RE = re.compile(r"[A-Za-z0-9_\u00C0-\u024F]+|\s+|.", re.S)
+
+def split_paragraphs(text):
+    """(V5.9 新增) 把转换文本按空行切分为段落 (表格整体算一段)"""
+    return [p.strip() for p in re.split(r"\n\s*\n", text) if p.strip()]
+
+DIFF_COST_MIN = 100000 # Myers search steps allowed per diff, at least
+DIFF_COST_PER_ITEM = 20 # ... and per compared item on larger inputs
+
+def _middle_snake(a, alo, ahi, b, blo, bhi, max_cost):
+    """
+    Myers 1986 的 middle snake: 在 O(N+M) 空间内找到最短编辑路径中间的对角线段。
+    Returns: ((x, y, u, v), cost); 搜索步数超过 max_cost 时为 (None, cost)
+    """
+    n = ahi - alo
+    m = bhi - blo
+    delta = n - m
+    odd = delta & 1
+    max_d = (n + m + 1) // 2
+    offset = max_d + 1
+    vf = [0] * (2 * max_d + 3)
+    vb = [0] * (2 * max_d + 3)
+
+    cost = 0
+    for d in range(max_d + 1):
+        cost += 2 * (d + 1) # Diagonals visited at this d, forward and backward
+        if cost > max_cost:
+            return None, cost
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and vf[offset + k - 1] < vf[offset + k + 1]):
+                x = vf[offset + k + 1]
+            else:
+                x = vf[offset + k - 1] + 1
+            y = x - k
+            x0, y0 = x, y
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+            vf[offset + k] = x
+            back_k = delta - k
+            if odd and -(d - 1) <= back_k <= d - 1 and x + vb[offset + back_k] >= n:
+                return (alo + x0, blo + y0, alo + x, blo + y), cost
+
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and vb[offset + k - 1] < vb[offset + k + 1]):
+                x = vb[offset + k + 1]
+            else:
+                x = vb[offset + k - 1] + 1
+            y = x - k
+            x0, y0 = x, y
+            while x < n and y < m and a[ahi - 1 - x] == b[bhi - 1 - y]:
+                x += 1
+                y += 1
+            vb[offset + k] = x
+            forward_k = delta - k
+            if not odd and -d <= forward_k <= d and x + vf[offset + forward_k] >= n:
+                return (alo + n - x, blo + m - y, alo + n - x0, blo + m - y0), cost
+    raise AssertionError("middle snake not found")
+
+def _unique_anchors(a, alo, ahi, b, blo, bhi):
+    """
+    两侧各只出现一次的元素中, 顺序一致的最长一组 (patience diff 的锚点)。
+    O(n log n), 不保证最短编辑; Returns: [(i, j), ...] 递增
+    """
+    count_a, count_b = {}, {}
+    for item in a[alo:ahi]:
+        count_a[item] = count_a.get(item, 0) + 1
+    for item in b[blo:bhi]:
+        count_b[item] = count_b.get(item, 0) + 1
+    b_index = {b[j]: j for j in range(blo, bhi) if count_b[b[j]] == 1 and count_a.get(b[j]) == 1}
+    pairs = [(i, b_index[a[i]]) for i in range(alo, ahi) if a[i] in b_index]
+
+    # Longest increasing run of j over pairs ordered by i
+    tails, tail_pairs = [], []
+    previous = [None] * len(pairs)
+    for p, (_, j) in enumerate(pairs):
+        pos = bisect.bisect_left(tails, j)
+        if pos == len(tails):
+            tails.append(j)
+            tail_pairs.append(p)
+        else:
+            tails[pos] = j
+            tail_pairs[pos] = p
+        previous[p] = tail_pairs[pos - 1] if pos else None
+    anchors = []
+    p = tail_pairs[-1] if tail_pairs else None
+    while p is not None:
+        anchors.append(pairs[p])
+        p = previous[p]
+    return anchors[::-1]
+
+def diff_sequences(a, b):
+    """
+    (V5.9 新增)
+    线性空间的 Myers diff。a / b 为可哈希元素的序列。
+    搜索步数以 DIFF_COST_MIN / DIFF_COST_PER_ITEM 为上限 (类似 git xdiff 的
+    代价限制): 超出的区间改用 patience 锚点, 结果不一定最短, 但成本有界。
+    Returns: difflib 风格的 opcodes [(tag, i1, i2, j1, j2)], tag 为 equal/replace/delete/insert
+    """
+    # Compare small ints instead of long paragraph strings
+    symbols = {}
+    a_full = [symbols.setdefault(item, len(symbols)) for item in a]
+    b_full = [symbols.setdefault(item, len(symbols)) for item in b]
+
+    # Items present on one side only can never match: dropping them first keeps a
+    # rewritten document from costing O((N+M)^2) while leaving the LCS unchanged
+    in_b = set(b_full)
+    in_a = set(a_full)
+    a_pos = [i for i, item in enumerate(a_full) if item in in_b]
+    b_pos = [j for j, item in enumerate(b_full) if item in in_a]
+    a = [a_full[i] for i in a_pos]
+    b = [b_full[j] for j in b_pos]
+
+    budget = max(DIFF_COST_MIN, DIFF_COST_PER_ITEM * (len(a) + len(b)))
+    matches = []
+    stack = [(0, len(a), 0, len(b))]
+    while stack:
+        alo, ahi, blo, bhi = stack.pop()
+        while alo < ahi and blo < bhi and a[alo] == b[blo]:
+            matches.append((alo, blo))
+            alo += 1
+            blo += 1
+        while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+            ahi -= 1
+            bhi -= 1
+            matches.append((ahi, bhi))
+        if alo == ahi or blo == bhi:
+            continue
+        snake = None
+        if budget > 0:
+            snake, cost = _middle_snake(a, alo, ahi, b, blo, bhi, budget)
+            budget -= cost
+        if snake:
+            x, y, u, v = snake
+            matches.extend((x + i, y + i) for i in range(u - x))
+            stack.append((alo, x, blo, y))
+            stack.append((u, ahi, v, bhi))
+            continue
+        # Too costly for a minimal diff (moved or reordered blocks): match the
+        # unique items in order; gaps are diffed again while budget remains,
+        # otherwise they stay one replace each
+        anchors = _unique_anchors(a, alo, ahi, b, blo, bhi)
+        budget -= (ahi - alo) + (bhi - blo)
+        matches.extend(anchors)
+        if anchors and budget > 0:
+            i0, j0 = alo, blo
+            for i, j in anchors + [(ahi, bhi)]:
+                stack.append((i0, i, j0, j))
+                i0, j0 = i + 1, j + 1
+    matches = sorted((a_pos[i], b_pos[j]) for i, j in matches)
+
+    opcodes = []
+    i = j = 0
+    for mi, mj in matches + [(len(a_full), len(b_full))]:
+        if i < mi and j < mj:
+            opcodes.append(("replace", i, mi, j, mj))
+        elif i < mi:
+            opcodes.append(("delete", i, mi, j, j))
+        elif j < mj:
+            opcodes.append(("insert", i, i, j, mj))
+        if mi < len(a_full):
+            if opcodes and opcodes[-1][0] == "equal":
+                opcodes[-1] = ("equal", opcodes[-1][1], mi + 1, opcodes[-1][3], mj + 1)
+            else:
+                opcodes.append(("equal", mi, mi + 1, mj, mj + 1))
+        i, j = mi + 1, mj + 1
+    return opcodes
+
+def diff_words(old_text, new_text):
+    """
+    (V5.9 新增)
+    段落内的词级 diff (中文按字, 西文按词)。
+    Returns: (old_ranges, new_ranges, similarity) — ranges 为被删除/插入文字的 [start, end) 字符区间
+    """
+    old_tokens = WORD_TOKEN_RE.findall(old_text)
+    new_tokens = WORD_TOKEN_RE.findall(new_text)
+    old_offsets = [0]
+    for token in old_tokens:
+        old_offsets.append(old_offsets[-1] + len(token))
+    new_offsets = [0]
+    for token in new_tokens:
+        new_offsets.append(new_offsets[-1] + len(token))
+
+    old_ranges, new_ranges = [], []
+    same = 0
+    for tag, i1, i2, j1, j2 in diff_sequences(old_tokens, new_tokens):
+        if tag == "equal":
+            same += sum(len(t) for t in old_tokens[i1:i2] if not t.isspace())
+            continue
+        if i2 > i1:
+            old_ranges.append([old_offsets[i1], old_offsets[i2]])
+        if j2 > j1:
+            new_ranges.append([new_offsets[j1], new_offsets[j2]])
+
+    visible = max(len("".join(old_text.split())), len("".join(new_text.split())), 1)
+    return old_ranges, new_ranges, same / visible
+
+def _paragraph_ops(tag, old, new, i1, i2, j1, j2):
+    if tag == "equal":
+        return [{"op": "equal", "old_index": i, "new_index": j, "text": old[i]}
+                for i, j in zip(range(i1, i2), range(j1, j2))]
+    if tag == "delete":
+        return [{"op": "delete", "old_index": i, "text": old[i]} for i in range(i1, i2)]
+    if tag == "insert":
+        return [{"op": "insert", "new_index": j, "text": new[j]} for j in range(j1, j2)]
+
+    # replace: pair paragraphs positionally, keep word-level edits only when they are similar
+    ops, deletes, inserts = [], [], []
+    pairs = min(i2 - i1, j2 - j1)
+    for offset in range(pairs):
+        i, j = i1 + offset, j1 + offset
+        old_ranges, new_ranges, similarity = diff_words(old[i], new[j])
+        if similarity >= MODIFY_SIMILARITY_THRESHOLD:
+            ops.append({
+                "op": "modify", "old_index": i, "new_index": j,
+                "old_text": old[i], "new_text": new[j],
+                "old_ranges": old_ranges, "new_ranges": new_ranges
+            })
+        else:
+            deletes.append({"op": "delete", "old_index": i, "text": old[i]})
+            inserts.append({"op": "insert", "new_index": j, "text": new[j]})
+    deletes += [{"op": "delete", "old_index": i, "text": old[i]} for i in range(i1 + pairs, i2)]
+    inserts += [{"op": "insert", "new_index": j, "text": new[j]} for j in range(j1 + pairs, j2)]
+    return ops + deletes + inserts
+
+def diff_paragraphs(old_text, new_text, context=PARAGRAPH_DIFF_CONTEXT):
+    """
+    (V5.9 新增)
+    段落级 diff。
+    Returns: {'hunks': [{'old_start', 'old_count', 'new_start', 'new_count', 'ops': [...]}],
+              'stats': {'inserted', 'deleted', 'modified'}}
+    op 为 equal / insert / delete / modify; modify 带有 old_ranges / new_ranges 词级区间。
+    """
+    old = split_paragraphs(old_text)
+    new = split_paragraphs(new_text)
+
+    hunks = []
+    stats = {"inserted": 0, "deleted": 0, "modified": 0}
+    for group in _group_opcodes(diff_sequences(old, new), context):
+        ops = []
+        for tag, i1, i2, j1, j2 in group:
+            ops.extend(_paragraph_ops(tag, old, new, i1, i2, j1, j2))
+        for op in ops:
+            if op["op"] == "insert":
+                stats["inserted"] += 1
+            elif op["op"] == "delete":
+                stats["deleted"] += 1
+            elif op["op"] == "modify":
+                stats["modified"] += 1
+        hunks.append({
+            "old_start": group[0][1] + 1, "old_count": group[-1][2] - group[0][1],
+            "new_start": group[0][3] + 1, "new_count": group[-1][4] - group[0][3],
+            "ops": ops
+        })
+    return {"hunks": hunks, "stats": stats}
+
+def _group_opcodes(opcodes, context):
+    """与 difflib.SequenceMatcher.get_grouped_opcodes 相同: 按上下文把 opcodes 分成 hunk"""
+    codes = list(opcodes)
+    if not codes or (len(codes) == 1 and codes[0][0] == "equal"):
+        return
+    if codes[0][0] == "equal":
+        tag, i1, i2, j1, j2 = codes[0]
+        codes[0] = tag, max(i1, i2 - context), i2, max(j1, j2 - context), j2
+    if codes[-1][0] == "equal":
+        tag, i1, i2, j1, j2 = codes[-1]
+        codes[-1] = tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context)
+
+    group = []
+    for tag, i1, i2, j1, j2 in codes:
+        if tag == "equal" and i2 - i1 > 2 * context:
+            group.append((tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context)))
+            yield group
+            group = []
+            i1, j1 = max(i1, i2 - context), max(j1, j2 - context)
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == "equal"):
+        yield group
+
+def paragraph_diff_key(old_sha, new_sha):
+    return hashlib.sha1(f"{PARAGRAPH_DIFF_VERSION}:{old_sha}:{new_sha}".encode()).hexdigest()
+
+def get_paragraph_diff(project_path, old_sha, new_sha, old_loader, new_loader):
+    """
+    (V5.9 新增)
+    以 (old blob, new blob) 为键缓存的段落 diff。sha 为 None 表示空文档。
+    """
+    key = paragraph_diff_key(old_sha, new_sha)
+    cached = cache_read(project_path, "pdiff", key)
+    if cached is not None:
+        return json.loads(cached.decode("utf-8"))
+
+    old_text = get_blob_text(project_path, old_sha, old_loader) if old_sha else ""
+    new_text = get_blob_text(project_path, new_sha, new_loader) if new_sha else ""
+    result = diff_paragraphs(old_text, new_text)
+    cache_write(project_path, "pdiff", key, json.dumps(result, ensure_ascii=False).encode("utf-8"))
+    return result
+
+@timed_operation("diff")
+def handle_paragraph_diff(project_path, files=None, rev_from=None, rev_to=None):
+    """
+    (V5.9 新增)
+    结构化 diff, 比较的两侧与 handle_diff 相同。
+    Returns: List of dicts [{'path', 'old', 'new', 'hunks', 'stats'}] — 只包含有变化的文件
+    """
+    check_init_status(project_path)
+    files_to_check = files if files else get_docx_files(project_path)
+    results = []
+    changes = iter_changes(project_path, files_to_check, rev_from or INDEX_REV, rev_to or WORKTREE_REV)
+    for file_path, _, old_sha, new_sha, old_loader, new_loader in changes:
+        diff = get_paragraph_diff(project_path, old_sha, new_sha, old_loader, new_loader)
+        results.append({"path": file_path, "old": old_sha, "new": new_sha, **diff})
+    return results
+
+# --- (V5.26 新增) 大文档的有界 diff ---
+# The diff of a 1,000-page manual can run to many megabytes. Hunks are generated
+# lazily and only those in the requested range are kept, up to max_bytes; every
+# other hunk is just counted. What a request holds and sends is bounded by the
+# range and the cap, while the counts still describe the whole diff, so a client
+# can fetch a summary first and then only the hunks it shows.
+DIFF_MAX_BYTES = 4 * 1024 * 1024
+DIFF_TRUNCATED_NOTE = "\n[wg] diff truncated after {} bytes; request a summary or a hunk range\n"
+
+class DiffPage:
+    """
+    (V5.26 新增)
+    逐个文件收集 unified diff 的一页: 保留全局序号在 [hunk_start, hunk_start + hunk_limit)
+    内的 hunk, 保留的文本超过 max_bytes 时截断 (至少保留一个 hunk, 分页总能前进);
+    其余 hunk 只计入 hunk 数、字节数和增删行数。hunk_limit=0 即只要摘要。
+    """
+
+    def __init__(self, hunk_start=0, hunk_limit=None, max_bytes=None):
+        self.hunk_start = hunk_start
+        self.hunk_limit = hunk_limit
+        self.max_bytes = max_bytes
+        self.parts = []
+        self.kept_bytes = 0
+        self.kept_hunks = 0
+        self.total_hunks = 0
+        self.total_bytes = 0
+        self.truncated = False
+        self.files = [] # [{'path', 'hunks', 'bytes', 'added', 'removed'}] for files with changes
+
+    def _wanted(self, index):
+        if index < self.hunk_start or self.truncated:
+            return False
+        return self.hunk_limit is None or index < self.hunk_start + self.hunk_limit
+
+    def add_file(self, path, old_sha, new_sha, mode, old_text, new_text):
+        header = unified_diff_header(path, old_sha, new_sha, mode)
+        summary = {"path": path, "hunks": 0, "bytes": 0, "added": 0, "removed": 0}
+        header_kept = False
+        for hunk in iter_unified_hunks(old_text, new_text):
+            text = "\n".join(hunk) + "\n"
+            if not summary["hunks"]:
+                summary["bytes"] += len(header.encode("utf-8"))
+            size = len(text.encode("utf-8"))
+            summary["hunks"] += 1
+            summary["bytes"] += size
+            summary["added"] += sum(1 for line in hunk if line.startswith("+"))
+            summary["removed"] += sum(1 for line in hunk if line.startswith("-"))
+            if self._wanted(self.total_hunks):
+                piece = text if header_kept else header + text
+                piece_size = size if header_kept else size + len(header.encode("utf-8"))
+                if self.max_bytes is not None and self.kept_hunks and self.kept_bytes + piece_size > self.max_bytes:
+                    self.truncated = True
+                else:
+                    self.parts.append(piece)
+                    self.kept_bytes += piece_size
+                    self.kept_hunks += 1
+                    header_kept = True
+            self.total_hunks += 1
+        if summary["hunks"]:
+            self.files.append(summary)
+            self.total_bytes += summary["bytes"]
+
+    def text(self):
+        text = "".join(self.parts)
+        if self.truncated:
+            text += DIFF_TRUNCATED_NOTE.format(self.kept_bytes)
+        return text
+
+    def result(self):
+        """Returns: {'diff', 'truncated', 'hunk_start', 'hunk_count', 'total_hunks', 'bytes', 'files'}"""
+        return {
+            "diff": self.text(),
+            "truncated": self.truncated,
+            "hunk_start": self.hunk_start,
+            "hunk_count": self.kept_hunks,
+            "total_hunks": self.total_hunks,
+            "bytes": self.total_bytes,
+            "files": self.files,
+        }
+
+def collect_diff(project_path, files, rev_from, rev_to, page):
+    """(V5.26 新增) 把 rev_from -> rev_to 之间各文件的 diff 依次交给 DiffPage"""
+    changes = iter_changes(project_path, files, rev_from or INDEX_REV, rev_to or WORKTREE_REV)
+    for file_path, mode, old_sha, new_sha, old_loader, new_loader in changes:
+        # Texts are cached by blob SHA, so stepping through versions converts each one once
+        old_text = get_blob_text(project_path, old_sha, old_loader) if old_sha else ""
+        new_text = get_blob_text(project_path, new_sha, new_loader) if new_sha else ""
+        page.add_file(file_path, old_sha, new_sha, mode, old_text, new_text)
+    return page
+
+@timed_operation("diff")
+def handle_diff_page(project_path, files=None, rev_from=None, rev_to=None,
+                     hunk_start=0, hunk_limit=None, max_bytes=DIFF_MAX_BYTES):
+    """
+    (V5.26 新增)
+    handle_diff 的分页 / 限长版本。hunk 按文件顺序全局编号。
+    Returns: DiffPage.result()
+    """
+    check_init_status(project_path)
+    files_to_check = files if files else get_docx_files(project_path)
+    page = DiffPage(hunk_start, hunk_limit, max_bytes)
+    if files_to_check:
+        collect_diff(project_path, files_to_check, rev_from, rev_to, page)
+    return page.result()
+
+def page_paragraph_diff(result, hunk_start=0, hunk_limit=None, max_bytes=None):
+    """
+    (V5.26 新增)
+    只保留段落 diff 中 [hunk_start, hunk_start + hunk_limit) 的 hunk, 超过 max_bytes 时截断
+    (至少保留一个)。Returns: 原结果加 'hunk_start', 'total_hunks', 'truncated'
+    """
+    hunks = result["hunks"]
+    end = len(hunks) if hunk_limit is None else min(len(hunks), hunk_start + hunk_limit)
+    page, size, truncated = [], 0, False
+    for index in range(hunk_start, end):
+        hunk_size = len(json.dumps(hunks[index], ensure_ascii=False).encode("utf-8"))
+        if max_bytes is not None and page and size + hunk_size > max_bytes:
+            truncated = True
+            break
+        page.append(hunks[index])
+        size += hunk_size
+    return {**result, "hunks": page, "hunk_start": hunk_start, "total_hunks": len(hunks), "truncated": truncated}
+
+def summarize_paragraph_page(result):
+    """(V5.26 新增) 段落 diff 的摘要: hunk 数与 JSON 字节数, 不含 hunk 内容"""
+    size = sum(len(json.dumps(hunk, ensure_ascii=False).encode("utf-8")) for hunk in result["hunks"])
+    return {
+        "path": result["path"], "old": result["old"], "new": result["new"], "stats": result["stats"],
+        "total_hunks": len(result["hunks"]), "bytes": size,
+    }
+
+# --- (V4.5 修复) ---
+@timed_operation("commit")
+def handle_commit(project_path, message, files=None):
+    """
+    (V4.5 修复) 'git add' 并 'git commit'
+    Returns: True if committed, False if nothing to commit. Raises exception on error.
+    """
+    check_init_status(project_path)
+    
+    # (V4.5 修复) 使用 get_docx_files() 替代 '*.docx'
+    files_to_add = files if files else get_docx_files(project_path)
+    if not files_to_add:
+        raise RuntimeError("未找到要提交的 .docx 文件。")
+    
+    # (V5.15) 路径经 stdin 传入, 不受命令行长度限制
+    run_command(
+        ["git", "add", "--pathspec-from-file=-", "--pathspec-file-nul"],
+        cwd=project_path,
+        input="\0".join(files_to_add)
+    )
+    
+    # (V4.1 修复) 检查是否有实际变更或错误
+    # (V5.17) diff-index does not refresh the index, so the clean filter is not run a second time
+    base = "HEAD" if read_head_sha(project_path) else EMPTY_TREE_SHA
+    check_cmd = run_command(["git", "diff-index", "--cached", "--quiet", base, "--"], check=False, cwd=project_path)
+    
+    if check_cmd.returncode == 0:
+        return False # Nothing to commit
+    elif check_cmd.returncode == 1:
+        run_command(["git", "commit", "-m", message], cwd=project_path)
+        return True
+    else:
+        raise RuntimeError("git diff 检查失败 (可能由 pandoc 引起)。")
+
+# --- (V5.7 新增) 提交日志索引 ---
+# project -> {"head": sha, "entries": [...]} (newest first, every commit, unfiltered)
+_log_indexes = {}
+_log_index_lock = threading.Lock()
+LOG_RECORD_START = "\x1e"
+LOG_FIELD_SEP = "\x1f"
+
+def read_head_sha(project_path):
+    """
+    (V5.7 新增)
+    不启动 git, 直接读取 .git/HEAD (以及 loose ref / packed-refs) 得到当前提交。
+    Returns: 完整 SHA, 空仓库返回 None
+    """
+    git_dir = Path(project_path) / ".git"
+    head = (git_dir / "HEAD").read_text(encoding="utf-8").strip()
+    if not head.startswith("ref:"):
+        return head or None
+    return read_ref_sha(project_path, head[4:].strip())
+
+def read_ref_sha(project_path, ref):
+    """(V5.22 从 read_head_sha 拆出) 读取一个完整引用名 (loose 或 packed-refs)。不存在时返回 None"""
+    git_dir = Path(project_path) / ".git"
+    try:
+        return (git_dir / ref).read_text(encoding="utf-8").strip() or None
+    except OSError:
+        pass
+    try:
+        packed = (git_dir / "packed-refs").read_text(encoding="utf-8")
+    except OSError:
+        return None
+    for line in packed.splitlines():
+        if line.endswith(" " + ref) and not line.startswith(("#", "^")):
+            return line.split(" ", 1)[0]
+    return None
+
+def _log_command(revision_range):
+    # %x1e / %x1f never appear in subjects or file names, unlike the old '|' delimiter
+    fmt = "%x1e%H%x1f%h%x1f%s%x1f%an%x1f%ad"
+    return ["git", "log", f"--format={fmt}", "--date=short", "--name-only", revision_range, "--"]
+
+def _read_log_entries(project_path, revision_range):
+    """Returns: [entry, ...] (新 -> 旧)"""
     result = run_command(
-        ["git", "diff", "--"] + files_to_check, 
-        capture_output=True, 
+        _log_command(revision_range),
+        capture_output=True,
         check=False,
         cwd=project_path
     )
-    return result.stdout
+    return parse_log_output(result.stdout)
 
-# --- (V4.5 修复) ---
-def handle_commit(project_path, message, files=None):
+def parse_log_output(output):
+    """解析 'git log --name-only' 输出。Returns: [entry, ...] (新 -> 旧)"""
+    entries = []
+    for record in output.split(LOG_RECORD_START):
+        if not record.strip():
+            continue
+        header, _, names = record.partition("\n")
+        parts = header.split(LOG_FIELD_SEP)
+        if len(parts) < 5:
+            continue
+        entries.append({
+            "sha": parts[0],
+            "id": parts[1],
+            "message": parts[2],
+            "author": parts[3],
+            "date": parts[4],
+            "files": [line.strip() for line in names.split("\n") if line.strip()]
+        })
+    return entries
+
+def _stored_log_index(project_path, head, index):
+    """
+    (V5.25 新增)
+    本进程的索引缺失或过期时, 改用其他 worker 存入状态库的索引:
+    它的 HEAD 就是当前 HEAD 时直接采用, 否则 (本进程没有索引时) 作为增量更新的起点。
+    """
+    stored = state_get(project_path, "log-index")
+    if stored and (stored["head"] == head or index is None):
+        return stored
+    return index
+
+def get_log_index(project_path):
+    """
+    (V5.7 新增)
+    返回项目的全量提交索引, 按 HEAD 增量更新:
+    HEAD 未变直接复用; 新 HEAD 是旧 HEAD 的后代时只解析 old..new;
+    reset / rebase 等改写历史时整体重建。
+    (V5.25) 重建结果写入共享状态库, 其他 worker 不必再次运行 git log。
+    """
+    key = str(project_path)
+    head = read_head_sha(project_path)
+    with _log_index_lock:
+        index = _log_indexes.get(key)
+        if index and index["head"] == head:
+            return index
+        index = _stored_log_index(project_path, head, index)
+        if index and index["head"] == head:
+            _log_indexes[key] = index
+            return index
+        if head is None:
+            index = {"head": None, "entries": []}
+        elif index and index["head"] and run_command(
+            ["git", "merge-base", "--is-ancestor", index["head"], head],
+            check=False,
+            cwd=project_path
+        ).returncode == 0:
+            new_entries = _read_log_entries(project_path, f"{index['head']}..{head}")
+            index = {"head": head, "entries": new_entries + index["entries"]}
+        else:
+            index = {"head": head, "entries": _read_log_entries(project_path, head)}
+        _log_indexes[key] = index
+        state_put(project_path, "log-index", index)
+        return index
+
+@timed_operation("log")
+def query_log(project_path, files=None, cursor=None, limit=None):
+    """
+    (V5.7 新增)
+    从日志索引中按文件过滤并分页。
+    cursor: 上一页最后一条的 id, 从它之后开始; limit: 每页条数 (None 为不限)。
+    Returns: (entries, next_cursor) — 没有更多时 next_cursor 为 None
+    """
+    check_init_status(project_path)
+    # (V4.5 修复) 使用 get_docx_files() 替代 '*.docx'
+    files_to_log = files if files else get_docx_files(project_path)
+    if not files_to_log:
+        return [], None
+    wanted = set(files_to_log)
+
+    entries = get_log_index(project_path)["entries"]
+    return page_log_entries(entries, wanted, cursor, limit, get_commit_stats(project_path))
+
+def page_log_entries(entries, wanted, cursor=None, limit=None, stats=None):
+    """
+    (V5.12 从 query_log 拆出) 按文件集合过滤索引条目并分页
+    (V5.22) stats: get_commit_stats() 的结果, 附加到每一条 (尚未统计的为 None)
+    """
+    start = 0
+    if cursor:
+        for i, entry in enumerate(entries):
+            if entry["id"] == cursor or entry["sha"].startswith(cursor):
+                start = i + 1
+                break
+        else:
+            raise ValueError(f"无效的分页游标: {cursor}")
+
+    page = []
+    next_cursor = None
+    for entry in entries[start:]:
+        # Same as 'git log --name-only -- <files>': only commits touching them, only their names
+        touched = [f for f in entry["files"] if f in wanted]
+        if not touched:
+            continue
+        if limit is not None and len(page) >= limit:
+            next_cursor = page[-1]["id"]
+            break
+        page.append({
+            "id": entry["id"],
+            "message": entry["message"],
+            "author": entry["author"],
+            "date": entry["date"],
+            "files": touched,
+            "stats": stats.get(entry["sha"]) if stats is not None else None
+        })
+    return page, next_cursor
+
+# --- (V4.5 修复 -> V5.7 日志索引) ---
+def handle_log(project_path, files=None):
+    """
+    (V4.5 修复) 显示 .docx 文件的 'git log'
+    (V5.7) 由日志索引提供, 不再每次解析全部历史。
+    Returns: List of dicts [{'id': '...', 'message': '...', 'author': '...', 'date': '...'}]
+    """
+    entries, _ = query_log(project_path, files)
+    return entries
+
+# --- (V5.22 新增) 提交变更统计 (git notes) ---
+# "+120 / -45 字, 3 段" per commit, computed once from the paragraph diff and kept as
+# a JSON note under refs/notes/wg-stats, so it survives cache eviction and travels
+# with the repository. Notes are written in batches through one 'git fast-import'
+# run; the in-memory map is reloaded only when the notes ref moves.
+STATS_NOTES_REF = "refs/notes/wg-stats"
+STATS_VERSION = 1
+STATS_BATCH_SIZE = 32
+STATS_WORKERS = 4
+
+# project -> {"ref": notes sha, "notes": {commit: note blob}, "stats": {commit: dict}}
+_commit_stats = {}
+_commit_stats_lock = threading.Lock()
+# Serializes note writers per project (the ref update must be a fast-forward)
+_stats_write_locks = {}
+
+def count_words(text):
+    """西文按词, 中文按字计数 (不含空白和标点)"""
+    return sum(1 for token in WORD_TOKEN_RE.findall(text) if token[0].isalnum() or token[0] == "_")
+
+def summarize_paragraph_diff(diff):
+    """(V5.22 新增) 段落 diff -> {'words_added', 'words_removed', 'inserted', 'deleted', 'modified'}"""
+    added = removed = 0
+    for hunk in diff["hunks"]:
+        for op in hunk["ops"]:
+            if op["op"] == "insert":
+                added += count_words(op["text"])
+            elif op["op"] == "delete":
+                removed += count_words(op["text"])
+            elif op["op"] == "modify":
+                added += sum(count_words(op["new_text"][a:b]) for a, b in op["new_ranges"])
+                removed += sum(count_words(op["old_text"][a:b]) for a, b in op["old_ranges"])
+    return {"words_added": added, "words_removed": removed, **diff["stats"]}
+
+def compute_commit_stats(project_path, entry):
+    """
+    (V5.22 新增)
+    一个提交相对第一父提交的变更统计 (段落 diff 走 pdiff 缓存)。
+    entry: 日志索引条目 (需要 'sha' 和 'files')
+    Returns: {'v', 'files', 'words_added', 'words_removed', 'inserted', 'deleted', 'modified'}
+    """
+    totals = {"v": STATS_VERSION, "files": 0, "words_added": 0, "words_removed": 0,
+              "inserted": 0, "deleted": 0, "modified": 0}
+    for file_path in entry["files"]:
+        if not file_path.endswith(".docx"):
+            continue
+        new_info = object_info(project_path, f"{entry['sha']}:{file_path}")
+        old_info = object_info(project_path, f"{entry['sha']}^:{file_path}")
+        new_sha = new_info[0] if new_info and new_info[1] == "blob" else None
+        old_sha = old_info[0] if old_info and old_info[1] == "blob" else None
+        if old_sha == new_sha:
+            continue
+        diff = get_paragraph_diff(
+            project_path, old_sha, new_sha,
+            lambda: read_blob(project_path, old_sha), lambda: read_blob(project_path, new_sha)
+        )
+        totals["files"] += 1
+        for key, value in summarize_paragraph_diff(diff).items():
+            totals[key] += value
+    return totals
+
+def get_commit_stats(project_path):
+    """
+    (V5.22 新增)
+    读取 refs/notes/wg-stats 中的全部统计。notes 引用未变时直接返回缓存;
+    变化时只读取新增 / 变化的 note。
+    Returns: dict {commit sha: stats}
+    """
+    key = str(project_path)
+    notes_sha = read_ref_sha(project_path, STATS_NOTES_REF)
+    with _commit_stats_lock:
+        cached = _commit_stats.get(key)
+        if cached and cached["ref"] == notes_sha:
+            return cached["stats"]
+    if notes_sha is None:
+        loaded = {"ref": None, "notes": {}, "stats": {}}
+    else:
+        result = run_command(
+            ["git", "notes", f"--ref={STATS_NOTES_REF}", "list"],
+            capture_output=True,
+            cwd=project_path
+        )
+        old_notes = cached["notes"] if cached else {}
+        old_stats = cached["stats"] if cached else {}
+        loaded = {"ref": notes_sha, "notes": {}, "stats": {}}
+        for line in result.stdout.splitlines():
+            blob_sha, _, commit_sha = line.partition(" ")
+            if old_notes.get(commit_sha) == blob_sha and commit_sha in old_stats:
+                stats = old_stats[commit_sha]
+            else:
+                try:
+                    stats = json.loads(read_object(project_path, blob_sha).decode("utf-8"))
+                except (RuntimeError, ValueError):
+                    continue
+            loaded["notes"][commit_sha] = blob_sha
+            if stats.get("v") == STATS_VERSION:
+                loaded["stats"][commit_sha] = stats
+    with _commit_stats_lock:
+        _commit_stats[key] = loaded
+    return loaded["stats"]
+
+def write_commit_stats(project_path, stats_by_commit):
+    """(V5.22 新增) 把一批统计写为 refs/notes/wg-stats 上的一个 notes 提交"""
+    if not stats_by_commit:
+        return
+    # (V5.25) The file lock also covers other server workers backfilling the same project
+    with _stats_write_locks.setdefault(str(project_path), threading.Lock()), project_lock(project_path, "stats"):
+        parent = read_ref_sha(project_path, STATS_NOTES_REF)
+        message = f"wg-stats: {len(stats_by_commit)} commits".encode("utf-8")
+        stream = io.BytesIO()
+        stream.write(f"commit {STATS_NOTES_REF}\n".encode("utf-8"))
+        stream.write(f"committer {_author_ident(project_path)} {int(time.time())} +0000\n".encode("utf-8"))
+        stream.write(b"data %d\n" % len(message) + message + b"\n")
+        if parent:
+            stream.write(f"from {parent}\n".encode("utf-8"))
+        for commit_sha, stats in stats_by_commit.items():
+            note = json.dumps(stats, separators=(",", ":")).encode("utf-8")
+            stream.write(f"N inline {commit_sha}\n".encode("utf-8"))
+            stream.write(b"data %d\n" % len(note) + note + b"\n")
+        stream.write(b"done\n")
+        run_command(
+            ["git", "fast-import", "--quiet", "--date-format=raw"],
+            cwd=project_path,
+            text=False,
+            input=stream.getvalue()
+        )
+
+def pending_stats_commits(project_path):
+    """(V5.22 新增) 还没有统计的提交 (新 -> 旧)"""
+    stats = get_commit_stats(project_path)
+    return [entry for entry in get_log_index(project_path)["entries"] if entry["sha"] not in stats]
+
+@timed_operation("stats")
+def backfill_commit_stats(project_path, workers=STATS_WORKERS, limit=None, should_stop=None):
+    """
+    (V5.22 新增)
+    为缺少统计的提交补算并写入 notes, 最新的提交优先。
+    每 STATS_BATCH_SIZE 个提交落盘一次, 中断后再次调用从剩余的提交继续。
+    should_stop: 可选回调, 返回 True 时在当前批次写入后停止
+    Returns: {'computed': n, 'remaining': m}
+    """
+    check_init_status(project_path)
+    pending = pending_stats_commits(project_path)
+    if limit is not None:
+        pending = pending[:limit]
+    computed = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for start in range(0, len(pending), STATS_BATCH_SIZE):
+            batch = pending[start:start + STATS_BATCH_SIZE]
+            results = executor.map(lambda entry: compute_commit_stats(project_path, entry), batch)
+            write_commit_stats(project_path, {entry["sha"]: stats for entry, stats in zip(batch, results)})
+            computed += len(batch)
+            if should_stop and should_stop():
+                break
+    return {"computed": computed, "remaining": len(pending_stats_commits(project_path))}
+
+# --- (V5.16 新增) 历史全文搜索 ---
+# Inverted index over the paragraphs of every .docx blob ever committed. Blobs are
+# content-addressed, so a version shared by several commits is extracted and indexed
+# once; new commits from the log index only add the blobs not seen before.
+# Searching only reads the index; new commits are added by update_search_index,
+# which the server runs in the background after commits, never in a request.
+SEARCH_INDEX_FILE = "search-index.wgs" # Top-level in wg-cache: never evicted
+SEARCH_SAVE_EVERY = 200 # Commits indexed between saves, so an interrupted update keeps its progress
+SEARCH_INDEX_MAGIC = b"WGS1"
+SEARCH_TOKEN_RE = re.compile(r"[a-z0-9_\u00C0-\u024F]+|[\u3400-\u9FFF\uF900-\uFAFF]")
+SEARCH_SNIPPET_CHARS = 120
+
+_search_indexes = {}
+_search_index_lock = threading.Lock()
+
+def search_tokens(text):
+    """拉丁字母/数字按词, 中日韩文字按单字切分 (统一小写)"""
+    return SEARCH_TOKEN_RE.findall(text.lower())
+
+def _collapse_whitespace(text):
+    return re.sub(r"\s+", " ", text).strip()
+
+def _write_varint(buf, value):
+    while value >= 0x80:
+        buf.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buf.append(value)
+
+def _read_varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+class SearchIndex:
+    """
+    (V5.16 新增)
+    一个项目的全文倒排索引。
+    磁盘格式: magic + zlib( varint 头长度 + JSON 头 + 每个词: varint 长度, 词, varint 长度, postings )
+    postings 按 blob 分组: blob_id, 段落数, 第一个段落号, 之后为段落号差值 (均为 varint)
+    """
+
+    def __init__(self, project_path):
+        self.project_path = project_path
+        self.path = get_cache_dir(project_path) / SEARCH_INDEX_FILE
+        self.commits = [] # [{sha, id, message, author, date}], 按索引顺序
+        self.commit_shas = set()
+        self.blobs = [] # blob_id -> sha
+        self.blob_ids = {}
+        self.occurrences = [] # blob_id -> [[commit 序号, path], ...]
+        self.postings = {} # token -> bytearray
+        self.lock = threading.Lock() # Guards the structures; held briefly by searches and per indexed commit
+        self.update_lock = threading.Lock() # One updater per project; text extraction runs outside self.lock
+        self.file_stamp = None # mtime of the file as last loaded / saved
+
+    def _stat_file(self):
+        try:
+            return self.path.stat().st_mtime_ns
+        except OSError:
+            return None
+
+    def file_changed(self):
+        """另一个进程 (server worker 或 CLI) 保存过索引文件"""
+        return self._stat_file() != self.file_stamp
+
+    def load(self):
+        self.file_stamp = self._stat_file()
+        try:
+            raw = self.path.read_bytes()
+        except OSError:
+            return self
+        if not raw.startswith(SEARCH_INDEX_MAGIC):
+            return self
+        try:
+            data = zlib.decompress(raw[len(SEARCH_INDEX_MAGIC):])
+            header_len, pos = _read_varint(data, 0)
+            header = json.loads(data[pos:pos + header_len].decode("utf-8"))
+            pos += header_len
+            postings = {}
+            while pos < len(data):
+                token_len, pos = _read_varint(data, pos)
+                token = data[pos:pos + token_len].decode("utf-8")
+                pos += token_len
+                size, pos = _read_varint(data, pos)
+                postings[token] = bytearray(data[pos:pos + size])
+                pos += size
+        except (zlib.error, ValueError, IndexError, UnicodeDecodeError):
+            return self # Corrupt or from an older format: rebuilt from scratch
+        self.commits = header["commits"]
+        self.commit_shas = {c["sha"] for c in self.commits}
+        self.blobs = header["blobs"]
+        self.blob_ids = {sha: i for i, sha in enumerate(self.blobs)}
+        self.occurrences = header["occurrences"]
+        self.postings = postings
+        return self
+
+    def save(self):
+        with self.lock:
+            header = json.dumps({
+                "commits": self.commits,
+                "blobs": self.blobs,
+                "occurrences": self.occurrences,
+            }, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            buf = bytearray()
+            _write_varint(buf, len(header))
+            buf += header
+            for token in sorted(self.postings):
+                encoded = token.encode("utf-8")
+                _write_varint(buf, len(encoded))
+                buf += encoded
+                _write_varint(buf, len(self.postings[token]))
+                buf += self.postings[token]
+        _atomic_write(self.path, SEARCH_INDEX_MAGIC + zlib.compress(bytes(buf), 6))
+        self.file_stamp = self._stat_file()
+
+    def _extract_tokens(self, blob_sha):
+        """Returns: {词: [段落号, ...]}; 无法提取时为空 (记录到指标与慢操作日志)"""
+        try:
+            text = get_blob_text(self.project_path, blob_sha, lambda: read_object(self.project_path, blob_sha))
+        except Exception as e:
+            record_extraction_failure(self.project_path, blob_sha, e)
+            return {}
+        paragraphs_by_token = {}
+        for number, paragraph in enumerate(split_paragraphs(text)):
+            for token in set(search_tokens(paragraph)):
+                paragraphs_by_token.setdefault(token, []).append(number)
+        return paragraphs_by_token
+
+    def _add_blob(self, blob_sha, paragraphs_by_token):
+        blob_id = len(self.blobs)
+        self.blobs.append(blob_sha)
+        self.blob_ids[blob_sha] = blob_id
+        self.occurrences.append([])
+        for token, numbers in paragraphs_by_token.items():
+            buf = self.postings.setdefault(token, bytearray())
+            _write_varint(buf, blob_id)
+            _write_varint(buf, len(numbers))
+            previous = 0
+            for number in numbers:
+                _write_varint(buf, number - previous)
+                previous = number
+        return blob_id
+
+    def pending(self, entries):
+        """尚未索引的提交数"""
+        return sum(1 for entry in entries if entry["sha"] not in self.commit_shas)
+
+    def update(self, entries, should_stop=None):
+        """
+        entries: 日志索引条目 (新 -> 旧), 从最旧的未索引提交开始加入。
+        文本提取不持有 self.lock, 同时进行的搜索只在每个提交写入时短暂等待。
+        每 SEARCH_SAVE_EVERY 个提交保存一次; should_stop 返回 True 时保存后停止。
+        Returns: 新索引的提交数
+        """
+        added = 0
+        for entry in reversed(entries):
+            if entry["sha"] in self.commit_shas:
+                continue
+            versions = [] # (path, blob sha)
+            extracted = {} # blob sha -> tokens, for blobs not indexed yet
+            for path in entry["files"]:
+                if not path.endswith(".docx"):
+                    continue
+                info = object_info(self.project_path, f"{entry['sha']}:{path}")
+                if not info or info[1] != "blob":
+                    continue # Deleted in this commit
+                versions.append((path, info[0]))
+                if info[0] not in self.blob_ids and info[0] not in extracted:
+                    extracted[info[0]] = self._extract_tokens(info[0])
+            with self.lock:
+                commit_no = len(self.commits)
+                self.commits.append({k: entry[k] for k in ("sha", "id", "message", "author", "date")})
+                self.commit_shas.add(entry["sha"])
+                for path, blob_sha in versions:
+                    blob_id = self.blob_ids.get(blob_sha)
+                    if blob_id is None:
+                        blob_id = self._add_blob(blob_sha, extracted[blob_sha])
+                    self.occurrences[blob_id].append([commit_no, path])
+            added += 1
+            if added % SEARCH_SAVE_EVERY == 0:
+                self.save()
+            if should_stop and should_stop():
+                break
+        return added
+
+    def _matching_paragraphs(self, token):
+        data = self.postings.get(token)
+        matches = set()
+        if not data:
+            return matches
+        pos = 0
+        while pos < len(data):
+            blob_id, pos = _read_varint(data, pos)
+            count, pos = _read_varint(data, pos)
+            number = 0
+            for _ in range(count):
+                delta, pos = _read_varint(data, pos)
+                number += delta
+                matches.add((blob_id, number))
+        return matches
+
+    def search(self, query, limit=50, reachable=None):
+        """
+        查找包含 query (忽略大小写与空白差异) 的段落。
+        reachable: 当前历史中的提交 sha 集合; reset 掉的提交不再返回。
+        Returns: [{commit, path, paragraph, snippet, match}] (新 -> 旧)
+        """
+        with self.lock:
+            # Only the posting lookups hold the lock; snippets are read without it
+            tokens = sorted(set(search_tokens(query)), key=lambda t: len(self.postings.get(t, b"")))
+            if not tokens:
+                return []
+            candidates = self._matching_paragraphs(tokens[0])
+            for token in tokens[1:]:
+                if not candidates:
+                    break
+                candidates &= self._matching_paragraphs(token)
+            by_blob = {}
+            for blob_id, number in candidates:
+                by_blob.setdefault(blob_id, []).append(number)
+            blobs = {
+                blob_id: (self.blobs[blob_id], [(c, self.commits[c], path) for c, path in self.occurrences[blob_id]])
+                for blob_id in by_blob
+            }
+
+        needle = _collapse_whitespace(query).lower()
+        hits = []
+        for blob_id, numbers in by_blob.items():
+            blob_sha, occurrences = blobs[blob_id]
+            paragraphs = split_paragraphs(get_blob_text(
+                self.project_path, blob_sha, lambda: read_object(self.project_path, blob_sha)
+            ))
+            for number in sorted(numbers):
+                if number >= len(paragraphs):
+                    continue
+                paragraph = _collapse_whitespace(paragraphs[number])
+                folded = paragraph.lower()
+                if len(folded) != len(paragraph):
+                    paragraph = folded # Case folding changed the length: keep offsets consistent
+                start = folded.find(needle)
+                if start < 0:
+                    continue # All words present, but not as this phrase
+                for commit_no, commit, path in occurrences:
+                    if reachable is not None and commit["sha"] not in reachable:
+                        continue
+                    hits.append((commit_no, commit, path, number, paragraph, start))
+
+        hits.sort(key=lambda h: (-h[0], h[2], h[3]))
+        results = []
+        for commit_no, commit, path, number, paragraph, start in hits[:limit]:
+            snippet_start = max(0, start - SEARCH_SNIPPET_CHARS // 2)
+            snippet = paragraph[snippet_start:start + len(needle) + SEARCH_SNIPPET_CHARS // 2]
+            results.append({
+                "commit": {k: v for k, v in commit.items() if k != "sha"},
+                "path": path,
+                "paragraph": number,
+                "snippet": snippet,
+                "match": [start - snippet_start, start - snippet_start + len(needle)],
+            })
+        return results
+
+def get_search_index(project_path):
+    """
+    (V5.16 新增)
+    返回项目的搜索索引: 首次从磁盘加载, 其他进程保存过文件时重新加载。不做更新。
+    """
+    key = str(project_path)
+    with _search_index_lock:
+        index = _search_indexes.get(key)
+        if index is None or (not index.update_lock.locked() and index.file_changed()):
+            index = _search_indexes[key] = SearchIndex(project_path).load()
+        return index
+
+def search_index_pending(project_path):
+    """(V5.16 新增) 搜索索引落后于历史的提交数 (0 表示已是最新)"""
+    return get_search_index(project_path).pending(get_log_index(project_path)["entries"])
+
+@timed_operation("search-index")
+def update_search_index(project_path, should_stop=None):
+    """
+    (V5.16 新增)
+    把日志索引中尚未索引的提交加入搜索索引并保存。提取文本可能很慢,
+    server 在后台调用 (不持有项目的读写锁); 同一项目同时只有一个更新者 (跨进程)。
+    Returns: {'indexed': 新索引的提交数, 'pending': 仍未索引的提交数}
+    """
+    check_init_status(project_path)
+    with project_lock(project_path, "search"):
+        index = get_search_index(project_path)
+        with index.update_lock:
+            entries = get_log_index(project_path)["entries"]
+            added = index.update(entries, should_stop)
+            if added:
+                index.save()
+            return {"indexed": added, "pending": index.pending(entries)}
+
+@timed_operation("search")
+def handle_search(project_path, query, limit=50):
+    """
+    (V5.16 新增)
+    在所有历史版本中搜索一段文字。只查询现有索引, 尚未索引的提交不在结果中 (见 update_search_index)。
+    Returns: [{'commit': {...}, 'path': 'a.docx', 'paragraph': 3, 'snippet': '...', 'match': [s, e]}]
+    """
+    check_init_status(project_path)
+    index = get_search_index(project_path)
+    reachable = {entry["sha"] for entry in get_log_index(project_path)["entries"]}
+    return index.search(query, limit, reachable)
+
+# --- (V5.23 新增) HTML 预览 ---
+# Historical versions rendered to HTML for reading in the browser. The rendering is
+# cached by blob SHA ('preview' kind) and images are stored once by content hash
+# ('img' kind); cached HTML refers to them as 'wg-image:<key>' and the server fills
+# in the URL when it sends the page.
+PREVIEW_VERSION = 2 # 2: SVG images no longer extracted
+PREVIEW_IMAGE_PREFIX = "wg-image:"
+PREVIEW_IMAGE_KEY_RE = re.compile(r"[0-9a-f]{40}\.[a-z0-9]{1,5}")
+IMAGE_MARKER_RE = re.compile(r"!\[\]\(([^)\s]+)\)")
+PREVIEW_IMAGE_TYPES = {
+    "png": "image/png", "jpg": "image/jpeg", "jpeg": "image/jpeg", "gif": "image/gif",
+    "bmp": "image/bmp", "tif": "image/tiff", "tiff": "image/tiff",
+    "emf": "image/emf", "wmf": "image/wmf", "webp": "image/webp",
+} # No SVG: it can carry script, and images are served from the app's own origin
+PREVIEW_PAGE = """<!DOCTYPE html>
+<html lang="zh-CN">
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+body {{ max-width: 52rem; margin: 2rem auto; padding: 0 1.5rem; font: 16px/1.7 -apple-system, "Segoe UI", "PingFang SC", "Microsoft YaHei", sans-serif; color: #222; }}
+table {{ border-collapse: collapse; margin: 1rem 0; }}
+th, td {{ border: 1px solid #ccc; padding: 0.3rem 0.6rem; vertical-align: top; }}
+img {{ max-width: 100%; }}
+</style>
+</head>
+<body>
+{body}
+</body>
+</html>
+"""
+
+def preview_cache_key(blob_sha):
+    return hashlib.sha1(f"{PREVIEW_VERSION}:{blob_sha}".encode()).hexdigest()
+
+def _zip_media_path(target):
+    """关系目标 (相对 word/ 或以 / 开头的绝对路径) -> zip 内路径"""
+    if target.startswith("/"):
+        return target.lstrip("/")
+    return posixpath.normpath(posixpath.join("word", target))
+
+def _store_preview_images(project_path, archive, targets):
+    """把引用到的图片按内容哈希写入缓存。Returns: {引用路径: 缓存键}"""
+    keys = {}
+    for target in targets:
+        try:
+            data = archive.read(_zip_media_path(target))
+        except KeyError:
+            continue # External link or missing part
+        ext = target.rsplit(".", 1)[-1].lower() if "." in target else ""
+        if ext not in PREVIEW_IMAGE_TYPES:
+            continue # Only known raster / metafile formats are ever served back
+        key = f"{hashlib.sha1(data).hexdigest()}.{ext}"
+        if cache_read(project_path, "img", key) is None:
+            cache_write(project_path, "img", key, data)
+        keys[target] = key
+    return keys
+
+def _render_inline_html(text, image_keys):
+    parts = []
+    pos = 0
+    for match in IMAGE_MARKER_RE.finditer(text):
+        parts.append(html.escape(text[pos:match.start()]).replace("\n", "<br>"))
+        key = image_keys.get(match.group(1))
+        if key:
+            parts.append(f'<img src="{PREVIEW_IMAGE_PREFIX}{key}" alt="">')
+        else:
+            parts.append(html.escape(match.group(0)))
+        pos = match.end()
+    parts.append(html.escape(text[pos:]).replace("\n", "<br>"))
+    return "".join(parts)
+
+def render_blocks_html(blocks, image_keys):
+    """(V5.23 新增) 把提取出的块渲染为 HTML 片段 (与 render_blocks_markdown 对应)"""
+    chunks = []
+    in_list = False
+    for block in blocks:
+        is_item = block["type"] == "paragraph" and block["list"]
+        if in_list and not is_item:
+            chunks.append("</ul>")
+        elif is_item and not in_list:
+            chunks.append("<ul>")
+        in_list = is_item
+
+        if block["type"] == "heading":
+            level = min(block["level"], 6)
+            chunks.append(f"<h{level}>{_render_inline_html(block['text'], image_keys)}</h{level}>")
+        elif block["type"] == "paragraph":
+            tag = "li" if is_item else "p"
+            chunks.append(f"<{tag}>{_render_inline_html(block['text'], image_keys)}</{tag}>")
+        elif block["type"] == "table":
+            rows = []
+            for i, row in enumerate(block["rows"]):
+                cell = "th" if i == 0 else "td"
+                rows.append("<tr>" + "".join(
+                    f"<{cell}>{_render_inline_html(text, image_keys)}</{cell}>" for text in row
+                ) + "</tr>")
+            chunks.append("<table>" + "".join(rows) + "</table>")
+    if in_list:
+        chunks.append("</ul>")
+    return "\n".join(chunks)
+
+def convert_docx_html(project_path, data):
+    """
+    (V5.23 新增)
+    把 .docx 内容转为 HTML 片段, 图片写入缓存并以 'wg-image:<key>' 引用。
+    优先使用原生提取器, 不支持时回退到 'pandoc -t html'。
+    Returns: (html, 图片缓存键列表)
+    """
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        targets = set(_read_relationships(archive).values())
+        try:
+            blocks = list(iter_docx_blocks(data))
+        except UnsupportedDocxError:
+            blocks = None
+        if blocks is not None:
+            used = {m.group(1) for b in blocks for m in IMAGE_MARKER_RE.finditer(b.get("text", ""))}
+            image_keys = _store_preview_images(project_path, archive, used & targets)
+            return render_blocks_html(blocks, image_keys), sorted(set(image_keys.values()))
+
+        tmp_path = _write_pandoc_input(data)
+        try:
+            body = run_command(
+                ["pandoc", "-f", "docx", "-t", "html", tmp_path],
+                capture_output=True,
+                timeout=PANDOC_TIMEOUT
+            ).stdout
+        finally:
+            os.unlink(tmp_path)
+        # pandoc keeps the package-internal media paths as <img src>
+        image_keys = _store_preview_images(project_path, archive, targets)
+        for target, key in image_keys.items():
+            for src in {target, _zip_media_path(target)}:
+                body = body.replace(f'src="{html.escape(src)}"', f'src="{PREVIEW_IMAGE_PREFIX}{key}"')
+        return body, sorted(set(image_keys.values()))
+
+def get_preview(project_path, blob_sha, loader=None):
+    """
+    (V5.23 新增)
+    以 blob SHA 为键缓存的 HTML 预览。缓存中引用的图片已被淘汰时重新渲染。
+    loader: 返回 .docx bytes 的函数, 默认从对象库读取
+    Returns: HTML 片段 (图片为 'wg-image:<key>')
+    """
+    key = preview_cache_key(blob_sha)
+    cached = cache_read(project_path, "preview", key)
+    if cached is not None:
+        entry = json.loads(cached.decode("utf-8"))
+        if all((get_cache_dir(project_path, "img") / k[:2] / k[2:]).exists() for k in entry["images"]):
+            return entry["html"]
+
+    data = loader() if loader else read_blob(project_path, blob_sha)
+    body, images = convert_docx_html(project_path, data)
+    payload = json.dumps({"html": body, "images": images}, ensure_ascii=False).encode("utf-8")
+    cache_write(project_path, "preview", key, payload)
+    return body
+
+def has_preview(project_path, blob_sha):
+    """(V5.23 新增) 预览是否已在缓存中 (不刷新 LRU 时间)"""
+    key = preview_cache_key(blob_sha)
+    return (get_cache_dir(project_path, "preview") / key[:2] / key[2:]).exists()
+
+def resolve_preview(project_path, commit_id, file_name):
     """
-    (V4.5 修复) 'git add' 并 'git commit'
-    Returns: True if committed, False if nothing to commit. Raises exception on error.
+    (V5.23 新增)
+    Returns: 'commit:file' 的 blob SHA; 版本或文件不存在时返回 None
     """
     check_init_status(project_path)
-    
-    # (V4.5 修复) 使用 get_docx_files() 替代 '*.docx'
-    files_to_add = files if files else get_docx_files(project_path)
-    if not files_to_add:
-        raise RuntimeError("未找到要提交的 .docx 文件。")
-    
-    run_command(["git", "add"] + files_to_add, cwd=project_path)
-    
-    # (V4.1 修复) 检查是否有实际变更或错误
-    check_cmd = run_command(["git", "diff", "--staged", "--quiet"], check=False, cwd=project_path)
-    
-    if check_cmd.returncode == 0:
-        return False # Nothing to commit
-    elif check_cmd.returncode == 1:
-        run_command(["git", "commit", "-m", message], cwd=project_path)
-        return True
-    else:
-        raise RuntimeError("git diff 检查失败 (可能由 pandoc 引起)。")
+    if not file_name.endswith(".docx"):
+        raise ValueError(f"文件 {file_name} 不是 .docx 文件")
+    commit_sha = resolve_commit(project_path, commit_id)
+    info = object_info(project_path, f"{commit_sha}:{file_name}") if commit_sha else None
+    return info[0] if info and info[1] == "blob" else None
 
-# --- (V4.5 修复) ---
-def handle_log(project_path, files=None):
+@timed_operation("preview")
+def handle_preview(project_path, commit_id, file_name):
     """
-    (V4.5 修复) 显示 .docx 文件的 'git log'
-    Returns: List of dicts [{'id': '...', 'message': '...', 'author': '...', 'date': '...'}]
+    (V5.23 新增)
+    Returns: (blob SHA, HTML 片段); 不存在时返回 None
     """
-    check_init_status(project_path)
-    # (V4.5 修复) 使用 get_docx_files() 替代 '*.docx'
-    files_to_log = files if files else get_docx_files(project_path)
-    if not files_to_log:
-        return []
+    blob_sha = resolve_preview(project_path, commit_id, file_name)
+    if blob_sha is None:
+        return None
+    return blob_sha, get_preview(project_path, blob_sha)
 
-    # Custom format for parsing
-    # %h: short hash, %s: subject, %an: author name, %ad: author date
-    # We use a special delimiter that is unlikely to be in filenames or messages
-    # But wait, --name-only puts files on new lines.
-    fmt = "COMMIT_START|%h|%s|%an|%ad"
-    result = run_command(
-        ["git", "log", f"--format={fmt}", "--date=short", "--name-only", "--"] + files_to_log, 
-        capture_output=True, 
-        check=False,
-        cwd=project_path
+def read_preview_image(project_path, key):
+    """
+    (V5.23 新增)
+    Returns: (bytes, content type); 键无效或已被淘汰时返回 None
+    """
+    ext = key.rsplit(".", 1)[-1]
+    if not PREVIEW_IMAGE_KEY_RE.fullmatch(key) or ext not in PREVIEW_IMAGE_TYPES:
+        return None # Also refuses entries cached before SVG was dropped
+    data = cache_read(project_path, "img", key)
+    if data is None:
+        return None
+    return data, PREVIEW_IMAGE_TYPES[ext]
+
+def render_preview_page(body, title, image_url):
+    """(V5.23 新增) 完整的 HTML 页面; image_url(key) 给出图片的访问地址"""
+    body = re.sub(
+        re.escape(PREVIEW_IMAGE_PREFIX) + r"([0-9a-f]{40}\.[a-z0-9]{1,5})",
+        lambda m: html.escape(image_url(m.group(1))),
+        body
     )
-    
-    logs = []
-    if result.stdout:
-        lines = result.stdout.strip().split('\n')
-        current_commit = None
-        
-        for line in lines:
-            line = line.strip()
-            if not line: continue
-            
-            if line.startswith("COMMIT_START|"):
-                # Save previous commit if exists
-                if current_commit:
-                    logs.append(current_commit)
-                
-                parts = line.split('|')
-                if len(parts) >= 5:
-                    current_commit = {
-                        "id": parts[1],
-                        "message": parts[2],
-                        "author": parts[3],
-                        "date": parts[4],
-                        "files": []
-                    }
-            else:
-                # It's a filename (if we have a current commit)
-                if current_commit:
-                    current_commit["files"].append(line)
-        
-        # Append the last commit
-        if current_commit:
-            logs.append(current_commit)
-            
-    return logs
+    return PREVIEW_PAGE.format(title=html.escape(title), body=body)
+
+def pending_previews(project_path, commit_id="HEAD"):
+    """
+    (V5.23 新增)
+    一个提交改动的 .docx 中还没有缓存预览的版本。
+    Returns: [(path, blob SHA)]
+    """
+    commit_sha = resolve_commit(project_path, commit_id)
+    if not commit_sha:
+        return []
+    entry = next((e for e in get_log_index(project_path)["entries"] if e["sha"] == commit_sha), None)
+    pending = []
+    for file_path in (entry["files"] if entry else []):
+        if not file_path.endswith(".docx"):
+            continue
+        info = object_info(project_path, f"{commit_sha}:{file_path}")
+        if info and info[1] == "blob" and not has_preview(project_path, info[0]):
+            pending.append((file_path, info[0]))
+    return pending
 
 # --- (V4.0 重大简化) ---
+@timed_operation("restore")
 def handle_restore(project_path, commit_id, docx_file_name):
     """
     (V4.0 简化 -> V5.1 安全优化)
@@ -318,14 +3199,12 @@ def handle_restore(project_path, commit_id, docx_file_name):
     restored_docx_path = restore_dir / restored_docx_name
 
     try:
-        # Use git show <commit>:<file> to stream content directly to new file
+        # Read <commit>:<file> through the shared cat-file pool and write it to a new file
         # This is much safer than checkout + rename
+        # (V5.8) no git process is spawned per restored version
+        data = checkout_bytes(project_path, read_object(project_path, f"{commit_id}:{docx_file_name}"))
         with open(restored_docx_path, "wb") as f:
-            run_command(
-                ["git", "show", f"{commit_id}:{docx_file_name}"], 
-                cwd=project_path, 
-                stdout=f
-            )
+            f.write(data)
         
         return str(restored_docx_path)
         
@@ -336,6 +3215,7 @@ def handle_restore(project_path, commit_id, docx_file_name):
         raise RuntimeError(f"恢复副本失败: {e}")
 
 # --- (V5.0 新增) ---
+@timed_operation("reset")
 def handle_reset(project_path, commit_id):
     """
     (V5.0 新增)
@@ -349,6 +3229,7 @@ def handle_reset(project_path, commit_id):
     except Exception as e:
         raise RuntimeError(f"重置失败: {e}")
 
+@timed_operation("revert")
 def handle_revert_commit(project_path, commit_id):
     """
     (V5.0 新增)
@@ -374,6 +3255,1061 @@ def handle_revert_commit(project_path, commit_id):
         
         raise RuntimeError(f"撤销失败: {e}")
 
+# --- (V5.20 新增) 批量导入旧版本文件 ---
+# Turns piles like '终稿_v1.docx', '终稿_v2.docx', '终稿_打死不改版.docx' into the history
+# of one '终稿.docx'. All versions go through a single 'git fast-import' run, so there
+# is no add / commit / diff check per version.
+VERSION_SUFFIX_RE = re.compile(
+    r"[\s_\-.—]*(?:"
+    r"v\d+(?:\.\d+)*|ver\.?\s*\d+|version\s*\d+|rev\.?\s*\d+|r\d+"
+    r"|第?\d+版|版本\s*\d+|final|最终稿|终稿|定稿|[^\s_\-.—()（）]{0,8}版"
+    r"|copy|副本|\(\d+\)|（\d+）|\d{4}[-.]\d{1,2}[-.]\d{1,2}|\d{8}|\d{6}"
+    r")$",
+    re.IGNORECASE
+)
+FINAL_MARKER_RE = re.compile(r"final|最终|终稿|定稿|不改", re.IGNORECASE)
+
+def split_version_name(stem):
+    """
+    (V5.20 新增)
+    '合同_v2' -> ('合同', '_v2')。去掉后会变成空名的后缀予以保留 (例如 '终稿' 本身)。
+    Returns: (文档名, 版本后缀)
+    """
+    base = stem
+    while True:
+        match = VERSION_SUFFIX_RE.search(base)
+        if not match or match.start() == 0:
+            break
+        base = base[:match.start()]
+    return base, stem[len(base):]
+
+def _version_rank(suffix):
+    number = re.search(r"\d+", suffix)
+    return (1 if FINAL_MARKER_RE.search(suffix) else 0, int(number.group()) if number else 0)
+
+def plan_import(source_dir, order="mtime", skip=()):
+    """
+    (V5.20 新增)
+    把 source_dir 下的 .docx 按文档分组并排序。
+    order: 'mtime' 按修改时间; 'name' 按文件名中的版本号 (final / 定稿 等排在最后)
+    skip: 不导入的相对路径 (从项目自身导入时跳过已跟踪的文件)
+    Returns: [{'path': 目标相对路径, 'versions': [{'source': 绝对路径, 'name': 文件名, 'mtime': 秒}, ...]}]
+    """
+    if order not in ("mtime", "name"):
+        raise ValueError(f"未知的排序方式: {order}")
+    root = Path(source_dir)
+    groups = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if d not in IGNORED_DIR_NAMES and not d.startswith("."))
+        rel_dir = Path(dirpath).relative_to(root).as_posix()
+        for name in filenames:
+            if not name.endswith(".docx") or is_office_temp_file(name):
+                continue
+            if (name if rel_dir == "." else f"{rel_dir}/{name}") in skip:
+                continue
+            base, suffix = split_version_name(name[:-len(".docx")])
+            target = f"{base}.docx" if rel_dir == "." else f"{rel_dir}/{base}.docx"
+            full = os.path.join(dirpath, name)
+            groups.setdefault(target, []).append({
+                "source": full,
+                "name": name,
+                "mtime": os.stat(full).st_mtime,
+                "rank": _version_rank(suffix),
+            })
+
+    plan = []
+    for target in sorted(groups):
+        versions = groups[target]
+        if order == "name":
+            versions.sort(key=lambda v: (v["rank"], v["mtime"], v["name"]))
+        else:
+            versions.sort(key=lambda v: (v["mtime"], v["rank"], v["name"]))
+        for version in versions:
+            del version["rank"]
+        plan.append({"path": target, "versions": versions})
+    return plan
+
+def _fast_import_path(path):
+    """fast-import 的 C 风格带引号路径 (可以包含空格和非 ASCII 字符)"""
+    escaped = path.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return f'"{escaped}"'
+
+def _author_ident(project_path):
+    result = run_command(["git", "var", "GIT_AUTHOR_IDENT"], capture_output=True, check=False, cwd=project_path)
+    ident = result.stdout.strip() if result.returncode == 0 else ""
+    match = re.match(r"(.*<.*>)", ident)
+    return match.group(1) if match else "wg <wg@localhost>"
+
+def _current_branch_ref(project_path):
+    head = (Path(project_path) / ".git" / "HEAD").read_text(encoding="utf-8").strip()
+    if not head.startswith("ref: "):
+        raise RuntimeError("HEAD 处于分离状态, 无法导入。请先切换到一个分支。")
+    return head[5:]
+
+@timed_operation("import")
+def handle_import(project_path, source_dir=None, order="mtime", dry_run=False):
+    """
+    (V5.20 新增)
+    把一堆按版本命名的 .docx 导入为历史: 每个版本一个提交, 提交时间取文件 mtime。
+    source_dir 默认为项目本身; 源文件不会被修改或删除。从项目自身导入时, 已导入的
+    版本文件 (报告_v1.docx 等) 写入 .git/info/exclude, 之后的提交不会把它们当作新文档;
+    确认历史无误后可以删除这些文件, 并删掉 exclude 中 "# wg import" 下的对应行。
+    Returns: {'documents': [{'path', 'versions': [文件名...]}], 'commits': n, 'excluded': [路径...], 'seconds': t}
+    """
+    check_init_status(project_path)
+    started = time.perf_counter()
+    skip = ()
+    in_place = not source_dir or Path(source_dir).resolve() == Path(project_path).resolve()
+    if in_place:
+        source_dir = project_path
+        skip = set(list_index_entries(project_path, []))
+    plan = plan_import(source_dir, order, skip)
+    summary = {
+        "documents": [{"path": d["path"], "versions": [v["name"] for v in d["versions"]]} for d in plan],
+        "commits": sum(len(d["versions"]) for d in plan),
+        "excluded": [],
+    }
+    if dry_run or not plan:
+        summary["seconds"] = round(time.perf_counter() - started, 3)
+        return summary
+
+    # One commit per version, in time order; within a document times never go backwards
+    commits = []
+    for document in plan:
+        last = 0
+        for version in document["versions"]:
+            last = max(int(version["mtime"]), last + 1) if order == "name" else int(version["mtime"])
+            commits.append((last, document["path"], version))
+    commits.sort(key=lambda c: c[0])
+
+    branch = _current_branch_ref(project_path)
+    parent = read_head_sha(project_path)
+    ident = _author_ident(project_path)
+    canonical = uses_canonical_storage(project_path)
+
+    process = subprocess.Popen(
+        ["git", "fast-import", "--quiet", "--date-format=raw"],
+        stdin=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        cwd=project_path
+    )
+    try:
+        stream = process.stdin
+        for mark, (timestamp, path, version) in enumerate(commits, start=1):
+            with open(version["source"], "rb") as f:
+                data = f.read()
+            if canonical:
+                data = canonicalize_docx(data) # fast-import bypasses the clean filter
+            stream.write(b"blob\nmark :%d\ndata %d\n" % (mark, len(data)))
+            stream.write(data)
+            message = f"导入 {version['name']}".encode("utf-8")
+            stream.write(f"\ncommit {branch}\n".encode("utf-8"))
+            stream.write(f"author {ident} {timestamp} +0000\ncommitter {ident} {timestamp} +0000\n".encode("utf-8"))
+            stream.write(b"data %d\n" % len(message) + message + b"\n")
+            if mark == 1 and parent:
+                stream.write(f"from {parent}\n".encode("utf-8"))
+            stream.write(f"M 100644 :{mark} {_fast_import_path(path)}\n\n".encode("utf-8"))
+        stream.write(b"done\n")
+        stream.close()
+        stderr = process.stderr.read().decode("utf-8", "replace")
+        if process.wait() != 0:
+            raise RuntimeError(f"git fast-import 失败:\n{stderr}")
+    except BaseException:
+        process.kill()
+        process.wait()
+        raise
+
+    # The branch moved under the index / worktree: sync the imported paths only
+    paths = [document["path"] for document in plan]
+    run_command(
+        ["git", "reset", "-q", "--pathspec-from-file=-", "--pathspec-file-nul"],
+        cwd=project_path,
+        input="\0".join(paths)
+    )
+    missing = [path for path in paths if not (Path(project_path) / path).exists()]
+    if missing:
+        run_command(
+            ["git", "checkout", "--pathspec-from-file=-", "--pathspec-file-nul"],
+            cwd=project_path,
+            input="\0".join(missing)
+        )
+    if in_place:
+        root = Path(project_path)
+        sources = [
+            Path(version["source"]).relative_to(root).as_posix()
+            for document in plan for version in document["versions"]
+        ]
+        summary["excluded"] = _exclude_paths(project_path, [path for path in sources if path not in paths])
+    summary["seconds"] = round(time.perf_counter() - started, 3)
+    return summary
+
+def _exclude_paths(project_path, paths):
+    """
+    把路径 (锚定到项目根, glob 字符转义) 追加到 .git/info/exclude 的 "# wg import" 段。
+    Returns: 新加入的路径
+    """
+    exclude = Path(project_path) / ".git" / "info" / "exclude"
+    try:
+        existing = exclude.read_text(encoding="utf-8")
+    except OSError:
+        existing = ""
+    escape = str.maketrans({"*": "[*]", "?": "[?]", "[": "[[]"})
+    lines = set(existing.splitlines())
+    added = [path for path in paths if "/" + path.translate(escape) not in lines]
+    if not added:
+        return []
+    block = "" if not existing or existing.endswith("\n") else "\n"
+    block += "# wg import: version files already in the history\n"
+    block += "".join("/" + path.translate(escape) + "\n" for path in added)
+    exclude.parent.mkdir(parents=True, exist_ok=True)
+    with open(exclude, "a", encoding="utf-8") as f:
+        f.write(block)
+    return added
+
+# --- (V5.24 新增) 自动快照 ---
+# Snapshots are ordinary commits on a side ref (refs/wg/snapshots), each with the
+# previous snapshot as parent, so the branch, HEAD and the real index are never
+# touched. Trees are built in a private index file (GIT_INDEX_FILE), which keeps
+# snapshots from locking .git/index under 'git status' polling. Worktree files
+# reuse their stat-cached blob SHA and only blobs missing from the object store
+# are written.
+SNAPSHOT_REF = "refs/wg/snapshots"
+SNAPSHOT_INDEX_FILE = "wg-snapshot-index" # Under .git/
+SNAPSHOT_CONFIG_KEY = "wg.autoSnapshot"
+ZERO_SHA = "0" * 40
+
+_snapshot_locks = {}
+# project -> (HEAD, snapshot ref, {path: blob sha}) of the last check, to skip no-op runs
+_snapshot_state = {}
+
+@contextlib.contextmanager
+def _snapshot_lock(project_path):
+    """快照与提升共用 wg-snapshot-index: 进程内线程锁 + 跨进程文件锁 (CLI / 其他 worker)"""
+    with _snapshot_locks.setdefault(str(project_path), threading.Lock()), project_lock(project_path, "snapshot"):
+        yield
+
+def _snapshot_env(project_path):
+    env = os.environ.copy()
+    env["GIT_INDEX_FILE"] = str(Path(project_path) / ".git" / SNAPSHOT_INDEX_FILE)
+    return env
+
+def _tree_of(project_path, commit_sha):
+    info = object_info(project_path, f"{commit_sha}^{{tree}}") if commit_sha else None
+    return info[0] if info else EMPTY_TREE_SHA
+
+def _list_tree_docx(project_path, commit_sha):
+    """Returns: {path: blob sha} — 提交中的全部 .docx"""
+    if not commit_sha:
+        return {}
+    result = run_command(
+        ["git", "ls-tree", "-r", "-z", commit_sha],
+        capture_output=True,
+        cwd=project_path
+    )
+    entries = {}
+    for record in result.stdout.split("\0"):
+        meta, _, path = record.partition("\t")
+        if path.endswith(".docx") and meta.split(" ")[1:2] == ["blob"]:
+            entries[path] = meta.split(" ")[2]
+    return entries
+
+def write_missing_blobs(project_path, entries):
+    """
+    (V5.24 新增)
+    只把对象库中还没有的 blob 写入 (一次 'git hash-object -w --stdin-paths', 按路径应用 clean 过滤器)。
+    entries: {path: 预期的 blob sha}, 写入期间文件又被保存时以实际写入的 sha 为准
+    Returns: 写入的 blob 数
+    """
+    missing = [path for path, sha in entries.items() if object_info(project_path, sha) is None]
+    if missing:
+        result = run_command(
+            ["git", "hash-object", "-w", "--stdin-paths"],
+            capture_output=True,
+            cwd=project_path,
+            input="".join(path + "\n" for path in missing)
+        )
+        for path, sha in zip(missing, result.stdout.split()):
+            entries[path] = sha
+    return len(missing)
+
+def build_docx_tree(project_path, base_commit, entries):
+    """
+    (V5.24 新增)
+    以 base_commit 的树为底, 把其中的 .docx 替换为 entries, 在临时索引中写出新树。
+    Returns: tree sha
+    """
+    env = _snapshot_env(project_path)
+    if base_commit:
+        run_command(["git", "read-tree", base_commit], cwd=project_path, env=env)
+    else:
+        run_command(["git", "read-tree", "--empty"], cwd=project_path, env=env)
+    records = [f"100644 {sha}\t{path}" for path, sha in sorted(entries.items())]
+    records += [f"0 {ZERO_SHA}\t{path}" for path in _list_tree_docx(project_path, base_commit) if path not in entries]
+    if records:
+        run_command(
+            ["git", "update-index", "-z", "--index-info"],
+            cwd=project_path,
+            env=env,
+            input="".join(record + "\0" for record in records)
+        )
+    return run_command(["git", "write-tree"], capture_output=True, cwd=project_path, env=env).stdout.strip()
+
+@timed_operation("snapshot")
+def take_snapshot(project_path, message=None):
+    """
+    (V5.24 新增)
+    把工作区中全部 .docx 的当前状态记录为 refs/wg/snapshots 上的一个快照。
+    与上一个快照或 HEAD 相同时不创建。
+    Returns: {'sha', 'id', 'files': [与上一个快照不同的文件], 'blobs_written'}; 无变化时返回 None
+    """
+    check_init_status(project_path)
+    key = str(project_path)
+    with _snapshot_lock(project_path):
+        head = read_head_sha(project_path)
+        parent = read_ref_sha(project_path, SNAPSHOT_REF)
+        stat_index = get_stat_index(project_path)
+        entries = {path: hash_worktree_file(project_path, path, stat_index) for path in get_docx_files(project_path)}
+        stat_index.flush()
+        if _snapshot_state.get(key) == (head, parent, entries):
+            return None # Nothing saved since the last check: no git process at all
+
+        written = write_missing_blobs(project_path, entries)
+        tree = build_docx_tree(project_path, head, entries)
+        head_tree = _tree_of(project_path, head)
+        previous_tree = _tree_of(project_path, parent) if parent else head_tree
+        if tree in (previous_tree, head_tree):
+            _snapshot_state[key] = (head, parent, entries)
+            return None
+
+        message = message or f"自动快照 {time.strftime('%Y-%m-%d %H:%M:%S')}"
+        command = ["git", "commit-tree", tree, "-m", message]
+        if head:
+            command += ["-m", f"Base: {head}"]
+        if parent:
+            command += ["-p", parent]
+        sha = run_command(command, capture_output=True, cwd=project_path).stdout.strip()
+        run_command(
+            ["git", "update-ref", "-m", "wg snapshot", SNAPSHOT_REF, sha, parent or ZERO_SHA],
+            cwd=project_path
+        )
+        changed = run_command(
+            ["git", "diff-tree", "-r", "-z", "--name-only", "--no-renames", previous_tree, tree, "--"],
+            capture_output=True,
+            cwd=project_path
+        ).stdout.split("\0")
+        _snapshot_state[key] = (head, sha, entries)
+        return {"sha": sha, "id": sha[:7], "files": [p for p in changed if p.endswith(".docx")], "blobs_written": written}
+
+def list_snapshots(project_path, limit=50):
+    """
+    (V5.24 新增)
+    Returns: [{'sha', 'id', 'message', 'date', 'base', 'files'}] (新 -> 旧)
+    """
+    check_init_status(project_path)
+    if not read_ref_sha(project_path, SNAPSHOT_REF):
+        return []
+    fmt = "%x1e%H%x1f%h%x1f%s%x1f%ci%x1f%(trailers:key=Base,valueonly,separator=%x2C)"
+    result = run_command(
+        ["git", "log", f"--format={fmt}", "--name-only", "--no-renames", f"-n{int(limit)}", SNAPSHOT_REF, "--"],
+        capture_output=True,
+        cwd=project_path
+    )
+    snapshots = []
+    for record in result.stdout.split(LOG_RECORD_START):
+        header, _, names = record.partition("\n")
+        parts = header.split(LOG_FIELD_SEP)
+        if len(parts) < 5:
+            continue
+        snapshots.append({
+            "sha": parts[0],
+            "id": parts[1],
+            "message": parts[2],
+            "date": parts[3],
+            "base": parts[4].strip() or None,
+            "files": [line.strip() for line in names.split("\n") if line.strip().endswith(".docx")]
+        })
+    return snapshots
+
+@timed_operation("promote")
+def promote_snapshot(project_path, snapshot_id, message):
+    """
+    (V5.24 新增)
+    把一个快照中的 .docx 作为当前分支上的一个真正提交 (工作区不变)。
+    暂存区只有快照改动的文件跟随新的 HEAD, 其余已暂存的内容保持不变。
+    Returns: 新提交的 SHA; 与 HEAD 相同时返回 None
+    """
+    check_init_status(project_path)
+    snapshot = resolve_commit(project_path, snapshot_id)
+    if not snapshot or run_command(
+        ["git", "merge-base", "--is-ancestor", snapshot, SNAPSHOT_REF],
+        check=False,
+        cwd=project_path
+    ).returncode != 0:
+        raise ValueError(f"不是一个快照: {snapshot_id}")
+
+    with _snapshot_lock(project_path): # build_docx_tree uses the shared snapshot index file
+        head = read_head_sha(project_path)
+        head_tree = _tree_of(project_path, head)
+        tree = build_docx_tree(project_path, head, _list_tree_docx(project_path, snapshot))
+        if tree == head_tree:
+            return None
+        command = ["git", "commit-tree", tree, "-m", message]
+        if head:
+            command += ["-p", head]
+        sha = run_command(command, capture_output=True, cwd=project_path).stdout.strip()
+        run_command(["git", "update-ref", "-m", f"wg: promote snapshot {snapshot[:7]}", "HEAD", sha, head or ZERO_SHA], cwd=project_path)
+        changed = run_command(
+            ["git", "diff-tree", "-r", "-z", "--name-only", "--no-renames", head_tree, tree, "--"],
+            capture_output=True,
+            cwd=project_path
+        ).stdout.split("\0")
+        run_command(
+            ["git", "reset", "-q", "--pathspec-from-file=-", "--pathspec-file-nul"],
+            cwd=project_path,
+            input="\0".join(path for path in changed if path)
+        ) # Only these paths follow the new HEAD; worktree untouched
+    return sha
+
+def is_auto_snapshot_enabled(project_path):
+    """(V5.24 新增) 项目是否开启自动快照 (git config wg.autoSnapshot)"""
+    result = run_command(
+        ["git", "config", "--bool", "--get", SNAPSHOT_CONFIG_KEY],
+        capture_output=True,
+        check=False,
+        cwd=project_path
+    )
+    return result.stdout.strip() == "true"
+
+def set_auto_snapshot(project_path, enabled):
+    """(V5.24 新增) 开启 / 关闭自动快照"""
+    check_init_status(project_path)
+    run_command(["git", "config", "--bool", SNAPSHOT_CONFIG_KEY, "true" if enabled else "false"], cwd=project_path)
+
+# --- (V5.12 新增) 异步执行路径 ---
+# API handlers await these directly: the event loop waits on the child process
+# instead of a threadpool thread, and cancelling the awaiting task kills the child.
+# Pure-Python work (zip/XML extraction, diff) still runs in worker threads.
+COMMAND_TIMEOUT = 60
+PANDOC_TIMEOUT = 120
+
+class CommandTimeoutError(RuntimeError):
+    """(V5.12 新增) 子进程超过时限, 已被终止"""
+
+async def _kill_process(process):
+    if process.returncode is None:
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+    await process.wait()
+
+async def run_command_async(command, cwd=None, timeout=COMMAND_TIMEOUT, check=True, text=True, input=None):
+    """
+    (V5.12 新增)
+    run_command 的 asyncio 版本 (总是捕获输出)。超时或调用方被取消时杀掉子进程。
+    Returns: subprocess.CompletedProcess
+    """
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=cwd
+        )
+    except FileNotFoundError as e:
+        raise RuntimeError(f"依赖命令未找到: {e.filename}. 请确保 git 和 pandoc 都在系统 PATH 中。")
+
+    started = time.perf_counter()
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(input), timeout)
+    except asyncio.TimeoutError:
+        await _kill_process(process)
+        record_subprocess(command, cwd, time.perf_counter() - started, True)
+        raise CommandTimeoutError(f"命令超时 ({timeout}s): {command}")
+    except asyncio.CancelledError:
+        await _kill_process(process)
+        record_subprocess(command, cwd, time.perf_counter() - started, True)
+        raise
+    record_subprocess(command, cwd, time.perf_counter() - started, process.returncode != 0)
+
+    if text:
+        stdout = stdout.decode("utf-8", "replace")
+        stderr = stderr.decode("utf-8", "replace")
+    if check and process.returncode != 0:
+        error_msg = f"命令执行失败 (Code: {process.returncode}): {command}"
+        if stderr:
+            error_msg += f"\nStderr:\n{stderr if text else stderr.decode('utf-8', 'replace')}"
+        raise RuntimeError(error_msg)
+    return subprocess.CompletedProcess(command, process.returncode, stdout, stderr)
+
+async def convert_with_pandoc_async(source, timeout=PANDOC_TIMEOUT):
+    """(V5.12 新增) convert_with_pandoc 的异步版本, source 为路径或 bytes"""
+    tmp_path = None
+    if isinstance(source, (bytes, bytearray)):
+        tmp_path = await asyncio.to_thread(_write_pandoc_input, source)
+    try:
+        result = await run_command_async(
+            ["pandoc", "-f", "docx", "-t", "markdown", str(tmp_path or source)],
+            timeout=timeout
+        )
+        return result.stdout
+    finally:
+        if tmp_path:
+            os.unlink(tmp_path)
+
+async def get_blob_text_async(project_path, blob_sha, loader):
+    """(V5.12 新增) get_blob_text 的异步版本: pandoc 回退可被取消"""
+    cached = await asyncio.to_thread(cache_read, project_path, "text", blob_sha)
+    if cached is not None:
+        return cached.decode("utf-8")
+
+    source = await asyncio.to_thread(loader)
+    try:
+        text = await asyncio.to_thread(extract_docx_text, source)
+    except UnsupportedDocxError:
+        text = await convert_with_pandoc_async(source)
+    await asyncio.to_thread(cache_write, project_path, "text", blob_sha, text.encode("utf-8"))
+    return text
+
+@timed_operation("status")
+async def handle_status_async(project_path, files=None, stamp=None):
+    """(V5.12 新增) handle_status 的异步版本"""
+    check_init_status(project_path)
+    stamp = stamp or await asyncio.to_thread(project_stamp, project_path)
+    cache_key = (str(project_path), tuple(files or ()))
+    cached = _cached_status(cache_key, stamp, shared=False)
+    if cached is None and _state_store is not None:
+        cached = await asyncio.to_thread(_cached_status, cache_key, stamp)
+    if cached is not None:
+        return cached
+
+    files_to_check = files if files else await asyncio.to_thread(get_docx_files, project_path)
+    if not files_to_check:
+        await asyncio.to_thread(_remember_status, cache_key, stamp, [])
+        return []
+
+    result = await run_command_async(
+        ["git", "status", "--porcelain", "-z", "--"] + docx_pathspec(files_to_check),
+        cwd=project_path,
+        check=False
+    )
+    status_list = parse_status_output(result.stdout, files_to_check)
+    await asyncio.to_thread(_remember_status, cache_key, stamp, status_list)
+    return status_list
+
+async def get_log_index_async(project_path):
+    """(V5.12 新增) get_log_index 的异步版本"""
+    key = str(project_path)
+    head = read_head_sha(project_path)
+    index = _log_indexes.get(key)
+    if index and index["head"] == head:
+        return index
+    if _state_store is not None:
+        index = await asyncio.to_thread(_stored_log_index, project_path, head, index)
+        if index and index["head"] == head:
+            with _log_index_lock:
+                _log_indexes[key] = index
+            return index
+
+    if head is None:
+        index = {"head": None, "entries": []}
+    elif index and index["head"] and (await run_command_async(
+        ["git", "merge-base", "--is-ancestor", index["head"], head],
+        cwd=project_path,
+        check=False
+    )).returncode == 0:
+        result = await run_command_async(_log_command(f"{index['head']}..{head}"), cwd=project_path, check=False)
+        index = {"head": head, "entries": parse_log_output(result.stdout) + index["entries"]}
+    else:
+        result = await run_command_async(_log_command(head), cwd=project_path, check=False)
+        index = {"head": head, "entries": parse_log_output(result.stdout)}
+    with _log_index_lock:
+        _log_indexes[key] = index
+    if _state_store is not None:
+        await asyncio.to_thread(state_put, project_path, "log-index", index)
+    return index
+
+@timed_operation("log")
+async def query_log_async(project_path, files=None, cursor=None, limit=None):
+    """(V5.12 新增) query_log 的异步版本"""
+    check_init_status(project_path)
+    files_to_log = files if files else await asyncio.to_thread(get_docx_files, project_path)
+    if not files_to_log:
+        return [], None
+    index = await get_log_index_async(project_path)
+    stats = await asyncio.to_thread(get_commit_stats, project_path)
+    return page_log_entries(index["entries"], set(files_to_log), cursor, limit, stats)
+
+async def resolve_side_async(project_path, rev, files):
+    """(V5.12 新增) resolve_side 的异步版本 (暂存区一侧不占用线程)"""
+    if rev == INDEX_REV:
+        result = await run_command_async(
+            ["git", "ls-files", "-s", "-z", "--"] + docx_pathspec(files),
+            cwd=project_path,
+            check=False
+        )
+        return parse_ls_files_output(result.stdout, files)
+    return await asyncio.to_thread(resolve_side, project_path, rev, files)
+
+async def _changes_async(project_path, files, rev_from, rev_to):
+    rev_from, rev_to = await asyncio.to_thread(resolve_revisions, project_path, rev_from, rev_to)
+    old_entries, new_entries = await asyncio.gather(
+        resolve_side_async(project_path, rev_from, files),
+        resolve_side_async(project_path, rev_to, files)
+    )
+    return list(pair_changes(project_path, files, rev_from, rev_to, old_entries, new_entries))
+
+@timed_operation("diff")
+async def handle_diff_async(project_path, files=None, rev_from=None, rev_to=None):
+    """(V5.12 新增) handle_diff 的异步版本"""
+    check_init_status(project_path)
+    files_to_check = files if files else await asyncio.to_thread(get_docx_files, project_path)
+    if not files_to_check:
+        return "No .docx files found."
+
+    page = DiffPage()
+    await collect_diff_async(project_path, files_to_check, rev_from, rev_to, page)
+    return page.text()
+
+async def collect_diff_async(project_path, files, rev_from, rev_to, page):
+    """(V5.26 新增) collect_diff 的异步版本"""
+    changes = await _changes_async(project_path, files, rev_from or INDEX_REV, rev_to or WORKTREE_REV)
+    for file_path, mode, old_sha, new_sha, old_loader, new_loader in changes:
+        old_text = await get_blob_text_async(project_path, old_sha, old_loader) if old_sha else ""
+        new_text = await get_blob_text_async(project_path, new_sha, new_loader) if new_sha else ""
+        await asyncio.to_thread(page.add_file, file_path, old_sha, new_sha, mode, old_text, new_text)
+    return page
+
+@timed_operation("diff")
+async def handle_diff_page_async(project_path, files=None, rev_from=None, rev_to=None,
+                                 hunk_start=0, hunk_limit=None, max_bytes=DIFF_MAX_BYTES):
+    """(V5.26 新增) handle_diff_page 的异步版本"""
+    check_init_status(project_path)
+    files_to_check = files if files else await asyncio.to_thread(get_docx_files, project_path)
+    page = DiffPage(hunk_start, hunk_limit, max_bytes)
+    if files_to_check:
+        await collect_diff_async(project_path, files_to_check, rev_from, rev_to, page)
+    return page.result()
+
+@timed_operation("diff")
+async def handle_paragraph_diff_async(project_path, files=None, rev_from=None, rev_to=None):
+    """(V5.12 新增) handle_paragraph_diff 的异步版本"""
+    check_init_status(project_path)
+    files_to_check = files if files else await asyncio.to_thread(get_docx_files, project_path)
+    results = []
+    changes = await _changes_async(project_path, files_to_check, rev_from or INDEX_REV, rev_to or WORKTREE_REV)
+    for file_path, _, old_sha, new_sha, old_loader, new_loader in changes:
+        key = paragraph_diff_key(old_sha, new_sha)
+        cached = await asyncio.to_thread(cache_read, project_path, "pdiff", key)
+        if cached is not None:
+            diff = json.loads(cached.decode("utf-8"))
+        else:
+            old_text = await get_blob_text_async(project_path, old_sha, old_loader) if old_sha else ""
+            new_text = await get_blob_text_async(project_path, new_sha, new_loader) if new_sha else ""
+            diff = await asyncio.to_thread(diff_paragraphs, old_text, new_text)
+            payload = json.dumps(diff, ensure_ascii=False).encode("utf-8")
+            await asyncio.to_thread(cache_write, project_path, "pdiff", key, payload)
+        results.append({"path": file_path, "old": old_sha, "new": new_sha, **diff})
+    return results
+
+# --- (V5.21 新增) 流式下载 ---
+# Historical versions go straight from git's stdout into the HTTP response in
+# fixed-size chunks: no copy under 'Restore Copy/', and memory stays bounded by the
+# pipe buffers whatever the document size. A snapshot is zipped by 'git archive'
+# (which applies the smudge filter, so canonical storage comes out expanded).
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+def resolve_commit(project_path, commit_id):
+    """(V5.21 新增) 任意版本名 -> 完整提交 SHA; 不存在时返回 None"""
+    if not commit_id or commit_id.startswith("-"):
+        return None
+    info = object_info(project_path, f"{commit_id}^{{commit}}")
+    return info[0] if info else None
+
+def prepare_blob_download(project_path, commit_id, file_name):
+    """
+    (V5.21 新增)
+    校验并解析要下载的版本, 在开始发送响应之前完成。
+    Returns: (command, size) — size 为 None 表示经过 smudge 后大小未知; 版本或文件不存在时返回 None
+    """
+    check_init_status(project_path)
+    if not file_name.endswith(".docx"):
+        raise ValueError(f"文件 {file_name} 不是 .docx 文件")
+    commit_sha = resolve_commit(project_path, commit_id)
+    info = object_info(project_path, f"{commit_sha}:{file_name}") if commit_sha else None
+    if not info or info[1] != "blob":
+        return None
+    if uses_canonical_storage(project_path):
+        return ["git", "cat-file", "--filters", f"{commit_sha}:{file_name}"], None
+    return ["git", "cat-file", "blob", info[0]], info[2]
+
+def prepare_archive_download(project_path, commit_id, files=None):
+    """
+    (V5.21 新增)
+    一个提交中全部 (或指定的) .docx 打成 zip 的 'git archive' 命令。
+    .docx 本身已经压缩, 所以归档只存储不压缩 (-0)。
+    Returns: (command, paths); 版本不存在或没有匹配的文件时返回 None
+    """
+    check_init_status(project_path)
+    commit_sha = resolve_commit(project_path, commit_id)
+    if not commit_sha:
+        return None
+    # ls-tree takes literal paths only (no ':(glob)' magic), so filter the full listing here
+    result = run_command(
+        ["git", "ls-tree", "-r", "-z", "--name-only", commit_sha],
+        capture_output=True,
+        cwd=project_path
+    )
+    paths = [path for path in result.stdout.split("\0") if path.endswith(".docx")]
+    if files:
+        wanted = set(files)
+        paths = [path for path in paths if path in wanted]
+    if not paths:
+        return None
+    command = ["git", "archive", "--format=zip", "-0", commit_sha, "--"] + (paths if files else [DOCX_PATHSPEC])
+    return command, paths
+
+async def stream_command_async(command, cwd=None, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    """
+    (V5.21 新增)
+    逐块产出子进程的 stdout (async generator)。
+    消费方提前停止 (例如客户端断开) 时杀掉子进程; 子进程失败时抛出 RuntimeError。
+    """
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=cwd,
+            limit=chunk_size
+        )
+    except FileNotFoundError as e:
+        raise RuntimeError(f"依赖命令未找到: {e.filename}. 请确保 git 和 pandoc 都在系统 PATH 中。")
+
+    started = time.perf_counter()
+    finished = False
+    try:
+        while True:
+            chunk = await process.stdout.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+        stderr = await process.stderr.read()
+        await process.wait()
+        finished = True
+        if process.returncode != 0:
+            raise RuntimeError(
+                f"命令执行失败 (Code: {process.returncode}): {command}\nStderr:\n{stderr.decode('utf-8', 'replace')}"
+            )
+    finally:
+        if not finished:
+            await _kill_process(process)
+        record_subprocess(command, cwd, time.perf_counter() - started, not finished or process.returncode != 0)
+
+# --- (V5.18 新增) 仓库维护 ---
+# Every commit adds loose objects and nothing ever packs them; these passes keep
+# 'git log' / 'git status' fast. Decisions are made from 'git count-objects' and a
+# stat of the commit-graph file; the passes themselves run at idle priority.
+LOOSE_OBJECT_THRESHOLD = 1000 # Loose objects before an incremental repack
+PACK_COUNT_THRESHOLD = 20 # Packs before a full gc consolidates them
+MAINTENANCE_TIMEOUT = 1800
+MAINTENANCE_COMMANDS = {
+    "commit-graph": ["git", "commit-graph", "write", "--reachable"],
+    "repack": ["git", "repack", "-d", "-l", "-q"], # Loose objects into one new pack
+    "gc": ["git", "gc", "--quiet"], # Also rewrites the commit-graph
+}
+
+def count_objects(project_path):
+    """(V5.18 新增) 'git count-objects -v'。Returns: dict (size 类字段单位为 KiB)"""
+    result = run_command(["git", "count-objects", "-v"], capture_output=True, cwd=project_path)
+    stats = {}
+    for line in result.stdout.splitlines():
+        key, _, value = line.partition(":")
+        try:
+            stats[key.strip()] = int(value.strip())
+        except ValueError:
+            continue
+    return stats
+
+def _commit_graph_stale(project_path):
+    git_dir = Path(project_path) / ".git"
+    try:
+        graph_mtime = (git_dir / "objects" / "info" / "commit-graph").stat().st_mtime_ns
+    except OSError:
+        return True
+    try:
+        # The HEAD reflog is touched by every commit / reset / revert
+        return (git_dir / "logs" / "HEAD").stat().st_mtime_ns > graph_mtime
+    except OSError:
+        return False
+
+def plan_maintenance(project_path, stats=None):
+    """
+    (V5.18 新增)
+    根据对象统计决定需要哪些维护任务。
+    Returns: 任务名列表 (可能为空), 取自 MAINTENANCE_COMMANDS
+    """
+    stats = stats or count_objects(project_path)
+    if stats.get("packs", 0) >= PACK_COUNT_THRESHOLD:
+        return ["gc"]
+    tasks = []
+    if stats.get("count", 0) >= LOOSE_OBJECT_THRESHOLD:
+        tasks.append("repack")
+    if _commit_graph_stale(project_path):
+        tasks.append("commit-graph")
+    return tasks
+
+def _low_priority(command):
+    """在 CPU / IO 空闲优先级下运行"""
+    if os.name == "nt":
+        return command, {"creationflags": subprocess.IDLE_PRIORITY_CLASS}
+    prefix = []
+    if shutil.which("ionice"):
+        prefix += ["ionice", "-c", "3"]
+    if shutil.which("nice"):
+        prefix += ["nice", "-n", "19"]
+    return prefix + command, {}
+
+@timed_operation("maintenance")
+def run_maintenance(project_path, tasks=None):
+    """
+    (V5.18 新增)
+    执行维护任务 (默认按 plan_maintenance 决定), 并报告前后对比。
+    调用方负责保证期间没有写操作。
+    Returns: {'tasks': [...], 'before': {...}, 'after': {...}, 'gained': {...}}
+    """
+    check_init_status(project_path)
+    before = count_objects(project_path)
+    tasks = plan_maintenance(project_path, before) if tasks is None else tasks
+    done = []
+    for task in tasks:
+        command, kwargs = _low_priority(MAINTENANCE_COMMANDS[task])
+        started = time.perf_counter()
+        try:
+            run_command(command, capture_output=True, cwd=project_path, timeout=MAINTENANCE_TIMEOUT, **kwargs)
+            done.append({"task": task, "seconds": round(time.perf_counter() - started, 3)})
+        except Exception as e:
+            done.append({"task": task, "seconds": round(time.perf_counter() - started, 3), "error": str(e)})
+    after = count_objects(project_path) if tasks else before
+    on_disk = lambda s: (s.get("size", 0) + s.get("size-pack", 0) + s.get("size-garbage", 0)) * 1024
+    return {
+        "tasks": done,
+        "before": before,
+        "after": after,
+        "gained": {
+            "loose_objects": before.get("count", 0) - after.get("count", 0),
+            "packs": before.get("packs", 0) - after.get("packs", 0),
+            "bytes": on_disk(before) - on_disk(after),
+        },
+    }
+
+# --- (V5.5 新增) 变更监听 ---
+# Files inside .git/ whose change means status or log may have changed
+GIT_STATE_FILES = ("HEAD", "index", "packed-refs")
+
+def is_office_temp_file(name):
+    """Office 打开文档时生成的锁文件 (~$xx.docx / .~xx.docx)"""
+    return name.startswith("~$") or name.startswith(".~")
+
+def project_stamp(project_path):
+    """
+    (V5.5 新增)
+    不启动任何进程, 收集决定 status/files/log 结果的磁盘状态:
+    工作区 .docx 的 (path, size, mtime_ns, inode) 以及 .git/HEAD, index, refs 的 stat。
+    Returns: 可比较的 tuple, 内容不变则结果相等
+    """
+    root = Path(project_path)
+    git_dir = root / ".git"
+    stamps = []
+    # (V5.15) 文件列表来自增量目录索引, 只需对每个文件做一次 stat
+    for rel_path in refresh_directory_index(root)[0]:
+        try:
+            st = os.stat(root / rel_path)
+        except OSError:
+            continue
+        stamps.append((rel_path, st.st_size, st.st_mtime_ns, st.st_ino))
+
+    for name in GIT_STATE_FILES:
+        try:
+            st = (git_dir / name).stat()
+            stamps.append((".git/" + name, st.st_size, st.st_mtime_ns, st.st_ino))
+        except OSError:
+            pass
+    for dirpath, _, filenames in os.walk(git_dir / "refs"):
+        for name in filenames:
+            full = os.path.join(dirpath, name)
+            try:
+                st = os.stat(full)
+            except OSError:
+                continue
+            stamps.append((full, st.st_size, st.st_mtime_ns, st.st_ino))
+    return tuple(sorted(stamps))
+
+class _Inotify:
+    """Linux inotify 的最小 ctypes 封装; 不可用时构造函数抛出 OSError"""
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    EVENT_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    EVENT_HEADER = struct.Struct("iIII")
+
+    def __init__(self):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify 仅在 Linux 上可用")
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 失败")
+        self.watches = {}
+
+    def add_watch(self, path):
+        wd = self._add_watch(self.fd, os.fsencode(str(path)), self.EVENT_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch 失败: {path}")
+        self.watches[wd] = Path(path)
+        return wd
+
+    def read_events(self):
+        """Returns: [(目录 Path, 文件名, mask)]"""
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, name_len = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = data[offset:offset + name_len].rstrip(b"\0").decode("utf-8", "replace")
+            offset += name_len
+            events.append((self.watches.get(wd), name, mask))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+class ProjectWatcher:
+    """
+    (V5.5 新增)
+    监听一个项目的工作区 .docx 文件 (V5.15 起包括子目录) 以及 .git/HEAD, index, refs。
+    Linux 上使用 inotify (空闲时阻塞在 select 上, 不占 CPU), 其他平台按 interval 做 stat 扫描。
+    检测到变化并经过 debounce 秒的静默后, 在后台线程中调用一次 callback()。
+    """
+
+    def __init__(self, project_path, callback, interval=2.0, debounce=0.3):
+        self.project_path = Path(project_path)
+        self.callback = callback
+        self.interval = interval
+        self.debounce = debounce
+        self.mode = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._inotify = None
+
+    def start(self):
+        try:
+            self._inotify = _Inotify()
+            self._setup_inotify()
+            self.mode = "inotify"
+        except OSError:
+            if self._inotify:
+                self._inotify.close()
+            self._inotify = None
+            self.mode = "stat"
+        self._thread = threading.Thread(target=self._run, name=f"wg-watch:{self.project_path.name}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        if self._inotify:
+            self._inotify.close()
+            self._inotify = None
+
+    def _setup_inotify(self):
+        git_dir = self.project_path / ".git"
+        # (V5.15) 监听目录索引中的每个工作区目录
+        for rel_dir in refresh_directory_index(self.project_path)[1]:
+            self._inotify.add_watch(self.project_path / rel_dir)
+        self._inotify.add_watch(git_dir)
+        for dirpath, _, _ in os.walk(git_dir / "refs"):
+            self._inotify.add_watch(dirpath)
+
+    def _is_relevant(self, directory, name, mask):
+        if mask & _Inotify.IN_Q_OVERFLOW:
+            return True
+        git_dir = self.project_path / ".git"
+        if directory is not None and directory != git_dir and git_dir not in directory.parents:
+            if mask & _Inotify.IN_ISDIR:
+                if mask & (_Inotify.IN_CREATE | _Inotify.IN_MOVED_TO):
+                    self._watch_new_directories()
+                return name not in IGNORED_DIR_NAMES
+            return name.endswith(".docx") and not is_office_temp_file(name)
+        if directory == git_dir:
+            return name in GIT_STATE_FILES
+        if directory is not None and (mask & _Inotify.IN_ISDIR) and (mask & _Inotify.IN_CREATE):
+            self._inotify.add_watch(directory / name) # New ref namespace, e.g. refs/heads/feature/
+        return not name.endswith(".lock")
+
+    def _watch_new_directories(self):
+        watched = set(self._inotify.watches.values())
+        for rel_dir in refresh_directory_index(self.project_path)[1]:
+            path = self.project_path / rel_dir
+            if path not in watched:
+                try:
+                    self._inotify.add_watch(path)
+                except OSError:
+                    pass # Removed again before we got to it
+
+    def _wait_inotify(self, timeout):
+        """等待直到有相关事件或超时; 返回是否发生了相关变化"""
+        ready, _, _ = select.select([self._inotify.fd], [], [], timeout)
+        if not ready:
+            return False
+        return any(self._is_relevant(d, n, m) for d, n, m in self._inotify.read_events())
+
+    def _run(self):
+        last_stamp = None if self._inotify else project_stamp(self.project_path)
+        while not self._stop.is_set():
+            if self._inotify:
+                if not self._wait_inotify(1.0):
+                    continue
+                # Coalesce a burst (Word saves through several renames) into one callback
+                while self._wait_inotify(self.debounce):
+                    pass
+            else:
+                if self._stop.wait(self.interval):
+                    break
+                try:
+                    stamp = project_stamp(self.project_path)
+                except OSError:
+                    continue
+                if stamp == last_stamp:
+                    continue
+                last_stamp = stamp
+
+            if self._stop.is_set():
+                break
+            try:
+                self.callback()
+            except Exception as e:
+                print(f"Watcher callback failed for {self.project_path}: {e}")
+
 # --- CLI Entry Point ---
 def main():
     parser = argparse.ArgumentParser(
@@ -383,7 +4319,12 @@ def main():
     subparsers = parser.add_subparsers(dest="command", required=True)
 
     # Init
-    subparsers.add_parser("init", help="在一个新目录中初始化 'wg' 仓库并配置 pandoc diff。")
+    init_parser = subparsers.add_parser("init", help="在一个新目录中初始化 'wg' 仓库并配置 pandoc diff。")
+    init_parser.add_argument(
+        "--canonical-storage",
+        action="store_true",
+        help="以不压缩的规范化 zip 存储 .docx, 让 git 能够增量压缩历史"
+    )
 
     # Status
     status_parser = subparsers.add_parser("status", help="运行 'git status' (默认所有 .docx)。")
@@ -400,6 +4341,9 @@ def main():
         nargs="*", 
         help="[可选] 指定要比较的 .docx 文件 (默认: 所有)"
     )
+    diff_parser.add_argument("--from", dest="rev_from", help="[可选] 旧版本 (commit / INDEX, 默认: 暂存区)")
+    diff_parser.add_argument("--to", dest="rev_to", help="[可选] 新版本 (commit / WORKTREE, 默认: 工作区)")
+    diff_parser.add_argument("--summary", action="store_true", help="[可选] 只显示每个文件的 hunk 数和 diff 大小")
 
     # Log
     log_parser = subparsers.add_parser("log", help="显示 .docx 文件的提交历史。")
@@ -432,6 +4376,42 @@ def main():
         help="您想要恢复的原始 .docx 文件名 (例如 'pr.docx')"
     )
 
+    # Search (V5.16)
+    search_parser = subparsers.add_parser("search", help="在所有历史版本中搜索一段文字。")
+    search_parser.add_argument("query", help="要查找的文字")
+    search_parser.add_argument("-n", "--limit", type=int, default=50, help="最多显示的结果数 (默认: 50)")
+
+    # Maintenance (V5.18)
+    maintenance_parser = subparsers.add_parser("maintenance", help="打包松散对象并更新 commit-graph。")
+    maintenance_parser.add_argument("--dry-run", action="store_true", help="只显示需要执行的任务")
+
+    # Import (V5.20)
+    import_parser = subparsers.add_parser("import", help="把按版本命名的旧文件 (v1 / v2 / 终稿) 导入为提交历史。")
+    import_parser.add_argument("source", nargs="?", help="旧文件所在目录 (默认: 当前仓库)")
+    import_parser.add_argument("--order", choices=["mtime", "name"], default="mtime", help="版本排序方式 (默认: mtime)")
+    import_parser.add_argument("--dry-run", action="store_true", help="只显示分组结果, 不写入历史")
+
+    # Snapshots (V5.24)
+    snapshot_parser = subparsers.add_parser("snapshot", help="记录 / 列出 / 提升自动快照 (不影响暂存区)。")
+    snapshot_parser.add_argument("-m", "--message", help="快照或提升后提交的说明")
+    snapshot_parser.add_argument("--list", action="store_true", help="列出最近的快照")
+    snapshot_parser.add_argument("--promote", metavar="SNAPSHOT", help="把快照作为当前分支上的正式提交")
+    snapshot_parser.add_argument("--auto", choices=["on", "off"], help="开启 / 关闭服务端的自动快照")
+
+    # Commit statistics (V5.22)
+    stats_parser = subparsers.add_parser("stats", help="为历史提交补算变更统计 (写入 refs/notes/wg-stats)。")
+    stats_parser.add_argument("-j", "--workers", type=int, default=STATS_WORKERS, help=f"并行转换数 (默认: {STATS_WORKERS})")
+    stats_parser.add_argument("-n", "--limit", type=int, help="本次最多处理的提交数")
+
+    # Textconv (V5.3, invoked by git, not meant to be typed by hand)
+    textconv_parser = subparsers.add_parser("textconv", help="(内部) git diff 使用的 .docx 文本转换驱动。")
+    textconv_parser.add_argument("file", help="git 传入的 .docx 文件路径")
+
+    # Storage filters (V5.17, invoked by git)
+    subparsers.add_parser("clean", help="(内部) 规范化存储的 clean 过滤器 (stdin -> stdout)。")
+    subparsers.add_parser("smudge", help="(内部) 规范化存储的 smudge 过滤器 (stdin -> stdout)。")
+    subparsers.add_parser("filter-process", help="(内部) git 长驻过滤进程。")
+
     args = parser.parse_args()
     
     # CLI 模式下，project_path 默认为当前目录
@@ -439,7 +4419,7 @@ def main():
 
     try:
         if args.command == "init":
-            handle_init(current_cwd)
+            handle_init(current_cwd, args.canonical_storage)
             print("WG 仓库初始化完成。")
         elif args.command == "status":
             items = handle_status(current_cwd, args.files)
@@ -450,21 +4430,91 @@ def main():
                 for item in items:
                     print(f"{item['status']} {item['path']}")
         elif args.command == "diff":
-            diff = handle_diff(current_cwd, args.files)
-            print(diff)
+            if args.summary:
+                page = handle_diff_page(current_cwd, args.files, args.rev_from, args.rev_to, hunk_limit=0)
+                for item in page["files"]:
+                    print(f"{item['path']}: {item['hunks']} hunks, {item['bytes']} 字节, +{item['added']} / -{item['removed']} 行")
+                print(f"合计: {page['total_hunks']} hunks, {page['bytes']} 字节")
+            else:
+                diff = handle_diff(current_cwd, args.files, args.rev_from, args.rev_to)
+                print(diff)
         elif args.command == "commit":
             if handle_commit(current_cwd, args.message, args.files):
                 print("提交成功！")
+                try:
+                    backfill_commit_stats(current_cwd, limit=1) # The new commit is the newest pending one
+                except RuntimeError as e:
+                    print(f"警告: 变更统计未能写入 ({e})", file=sys.stderr)
             else:
                 print("无需提交。")
         elif args.command == "log":
             logs = handle_log(current_cwd, args.files)
             print(f"--- Git 日志 ---")
             for log in logs:
-                print(f"{log['id'][:7]} | {log['message']} | {log['author']} | {log['date']}")
+                stats = log["stats"]
+                summary = f" | +{stats['words_added']} / -{stats['words_removed']} 字" if stats else ""
+                print(f"{log['id'][:7]} | {log['message']} | {log['author']} | {log['date']}{summary}")
         elif args.command == "restore":
             path = handle_restore(current_cwd, args.commit_id, args.docx_file)
             print(f"成功！版本已恢复为: {path}")
+        elif args.command == "search":
+            update_search_index(current_cwd) # No background indexer in the CLI
+            results = handle_search(current_cwd, args.query, args.limit)
+            if not results:
+                print("未找到匹配的内容。")
+            for item in results:
+                commit = item["commit"]
+                print(f"{commit['id'][:7]} | {commit['date']} | {item['path']} #{item['paragraph'] + 1}")
+                print(f"    ...{item['snippet']}...")
+        elif args.command == "maintenance":
+            tasks = plan_maintenance(current_cwd)
+            if not tasks:
+                print("仓库状态良好, 无需维护。")
+            elif args.dry_run:
+                print(f"需要执行: {', '.join(tasks)}")
+            else:
+                report = run_maintenance(current_cwd, tasks)
+                for item in report["tasks"]:
+                    print(f"{item['task']}: {item['seconds']:.1f}s" + (f" (失败: {item['error']})" if "error" in item else ""))
+                gained = report["gained"]
+                print(f"松散对象 -{gained['loose_objects']}, pack -{gained['packs']}, 空间 -{gained['bytes'] / 1024 / 1024:.1f} MB")
+        elif args.command == "snapshot":
+            if args.auto:
+                set_auto_snapshot(current_cwd, args.auto == "on")
+                print(f"自动快照已{'开启' if args.auto == 'on' else '关闭'}。")
+            elif args.list:
+                for snap in list_snapshots(current_cwd):
+                    print(f"{snap['id']} | {snap['date']} | {snap['message']} | {', '.join(snap['files'])}")
+            elif args.promote:
+                sha = promote_snapshot(current_cwd, args.promote, args.message or f"提升快照 {args.promote[:7]}")
+                print(f"已提交 {sha[:7]}" if sha else "快照与当前提交相同, 无需提交。")
+            else:
+                snap = take_snapshot(current_cwd, args.message)
+                print(f"快照 {snap['id']}: {', '.join(snap['files'])}" if snap else "没有变化, 未创建快照。")
+        elif args.command == "stats":
+            report = backfill_commit_stats(current_cwd, args.workers, args.limit)
+            print(f"已统计 {report['computed']} 个提交, 剩余 {report['remaining']} 个。")
+        elif args.command == "import":
+            report = handle_import(current_cwd, args.source, args.order, args.dry_run)
+            if not report["documents"]:
+                print("未找到可导入的 .docx 文件。")
+            for document in report["documents"]:
+                print(f"{document['path']} <- {' -> '.join(document['versions'])}")
+            if report["documents"] and not args.dry_run:
+                print(f"已导入 {report['commits']} 个版本 ({report['seconds']:.1f}s)")
+            if report["excluded"]:
+                print(f"{len(report['excluded'])} 个版本文件已加入 .git/info/exclude, 确认历史无误后可以删除它们。")
+        elif args.command in ("clean", "smudge"):
+            data = sys.stdin.buffer.read()
+            sys.stdout.buffer.write(canonicalize_docx(data) if args.command == "clean" else expand_docx(data))
+            sys.stdout.flush()
+        elif args.command == "filter-process":
+            handle_filter_process(sys.stdin.buffer, sys.stdout.buffer)
+        elif args.command == "textconv":
+            # git runs textconv from the worktree root, but be tolerant of subdirectories
+            project_root = find_project_root(current_cwd) or current_cwd
+            sys.stdout.buffer.write(handle_textconv(project_root, args.file))
+            sys.stdout.flush()
             
     except Exception as e:
         print(f"Error: {e}")